@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+atomic_json.py
+------------------------------------------
+多个进程共用的小 JSON 文件（latency_profiles.json、persona_compact_cache.json 等）的读-改-写：
+在 <文件>.lock 上持 fcntl.flock 排他锁，锁内重新读取最新内容、修改后写临时文件再 os.replace，
+并发的问卷阶段（pipeline.py --jobs）不会互相覆盖更新，读者也不会看到写了一半的文件。
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def file_lock(path: Path):
+    """path 对应的 .lock 文件上的排他锁"""
+    lock_path = Path(path).with_name(Path(path).name + ".lock")
+    with open(lock_path, "a+") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def update_json(path: Path, update, default=dict, **dump_kw):
+    """
+    锁内读取 path（不存在时用 default()），调用 update(data) 原地修改后原子写回。
+    :return: 写回后的内容
+    """
+    path = Path(path)
+    with file_lock(path):
+        data = json.loads(path.read_text("utf-8")) if path.exists() else default()
+        update(data)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, **dump_kw), "utf-8")
+        os.replace(tmp, path)
+    return data
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+batch_mode.py
+------------------------------------------
+CBF-PI-B 问卷的离线批量模式，分两阶段：
+
+    1) render   把一次运行的全部 (用户, repeat, 题号) 请求渲染成 OpenAI Batch 格式的 JSONL，
+                custom_id = "<配置名>|<uid>|<repeat>|<题号>"，同一配置重复渲染结果不变；
+                同时写出 manifest（运行参数 + 用户列表），供第二阶段组装结果。
+    2) ingest   读取批量结果 JSONL，解析评分，组装成与 cbfpib_completion.py 相同的
+                results/bigfive_result_*.json；缺失或无法解析的请求另存为补跑批次。
+
+    execute     本地替身执行器：并发把批次文件发给 LLM_API_URL，写出同格式的结果 JSONL。
+
+    python batch_mode.py render  --model qwen-turbo --data-type memory --repeat 5 --cot
+    python batch_mode.py execute batches/bigfive_result_qwen-turbo_memory_cot_repeat5.requests.jsonl
+    python batch_mode.py ingest  batches/bigfive_result_qwen-turbo_memory_cot_repeat5.results.jsonl [补跑结果 ...]
+
+批次文件默认写在 batches/ 下（仓库根目录的 requests.jsonl 不做改动）。
+"""
+
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import requests
+from loguru import logger
+from tqdm import tqdm
+
+import cbfpib_completion as cb
+
+# ===== 配置区 =====
+BATCH_DIR   = Path("batches")
+BATCH_URL   = "/v1/chat/completions"
+SEP         = "|"
+EXEC_WORKERS = 8                 # 本地执行器并发数
+
+# ----------------- 工具函数 -----------------
+
+
+def make_custom_id(config: str, uid, rep: int, qid) -> str:
+    return SEP.join([config, str(uid), str(rep), str(qid)])
+
+
+def split_custom_id(custom_id: str) -> tuple[str, str, int, str]:
+    config, uid, rep, qid = custom_id.rsplit(SEP, 3)
+    return config, uid, int(rep), qid
+
+
+def read_jsonl(path: Path) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_jsonl(path: Path, rows) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def response_text(row: dict) -> str | None:
+    """从批量结果行中取出回答文本；请求失败时返回 None"""
+    resp = row.get("response") or {}
+    if row.get("error") or resp.get("status_code", 200) != 200:
+        return None
+    try:
+        return resp["body"]["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+# ----------------- 核心函数 -----------------
+def render(args):
+    """阶段一：渲染批次文件与 manifest"""
+    outfile = cb.setup_run(args)
+    config = outfile.stem
+    data = cb.load_personas(args)
+    done = {entry["user"] for entry in cb.load_output(outfile)}
+    data = [entry for entry in data if entry["user"] not in done]
+    questions = json.loads(Path(cb.CBFPIB).read_text(encoding="utf-8"))
+    if cb.retrieval_k:
+        cb.build_retrieval_index(data, questions)
+
+    def rows():
+        for entry in tqdm(data, desc="Rendering users"):
+            tasks, _ = cb.build_user_tasks(entry, questions, args.seed)
+            for (rep, qid), messages in tasks.items():
+                yield {"custom_id": make_custom_id(config, entry["uid"], rep, qid), "method": "POST",
+                       "url": BATCH_URL, "body": cb.build_payload(messages)}
+
+    out = args.output or BATCH_DIR / f"{config}.requests.jsonl"
+    n = write_jsonl(out, rows())
+    run_args = {k: v for k, v in vars(args).items() if k not in ("cmd", "output")}
+    manifest = {"config": config, "outfile": str(outfile), "repeat": args.repeat, "args": run_args,
+                "users": [{"user": e["user"], "uid": e["uid"]} for e in data]}
+    manifest_path = BATCH_DIR / f"{config}.manifest.json"
+    manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    logger.success(f"{len(data)} 个用户（已完成 {len(done)} 个跳过），{n} 条请求 → {out}；manifest → {manifest_path}")
+
+
+def execute(args):
+    """本地替身执行器：逐条调用 LLM_API_URL，输出批量结果格式"""
+    batch = read_jsonl(args.batch)
+
+    def run_one(row: dict) -> dict:
+        try:
+            resp = requests.post(cb.API_URL, headers=cb.HEADERS, data=json.dumps(row["body"]), timeout=args.timeout)
+            return {"id": row["custom_id"], "custom_id": row["custom_id"], "error": None,
+                    "response": {"status_code": resp.status_code,
+                                 "body": resp.json() if resp.ok else {"error": resp.text}}}
+        except (requests.RequestException, ValueError) as e:
+            return {"id": row["custom_id"], "custom_id": row["custom_id"], "response": None,
+                    "error": {"message": str(e)}}
+
+    out = args.output or args.batch.with_name(args.batch.name.replace(".requests.", ".results."))
+    if out == args.batch:
+        out = args.batch.with_suffix(".results.jsonl")
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(run_one, row) for row in batch]
+        results = [f.result() for f in tqdm(as_completed(futures), total=len(futures), desc="Executing batch")]
+    failed = sum(response_text(r) is None for r in results)
+    write_jsonl(out, results)
+    logger.success(f"{len(results)} 条请求执行完毕，失败 {failed} 条 → {out}")
+
+
+def ingest(args):
+    """阶段二：解析批量结果并组装问卷结果文件"""
+    rows = [row for path in args.results for row in read_jsonl(path)]
+    if not rows:
+        logger.warning("结果文件为空")
+        return
+    config = split_custom_id(rows[0]["custom_id"])[0]
+    manifest_path = args.manifest or BATCH_DIR / f"{config}.manifest.json"
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    run_args = argparse.Namespace(**manifest["args"])
+    cb.setup_run(run_args)
+    questions = json.loads(Path(cb.CBFPIB).read_text(encoding="utf-8"))
+
+    answers, bad = {}, {}
+    for row in rows:
+        cfg, uid, rep, qid = split_custom_id(row["custom_id"])
+        if cfg != config:
+            continue
+        text = response_text(row)
+        try:
+            if text is None:
+                raise ValueError(f"请求失败: {row.get('error') or row.get('response')}")
+            answers.setdefault(uid, {})[(rep, qid)] = (cb.parse_answer(text), text)
+        except ValueError as e:
+            bad[row["custom_id"]] = str(e)
+
+    outfile = Path(manifest["outfile"])
+    output_data = cb.load_output(outfile)
+    done = {entry["user"] for entry in output_data}
+    keys = [(rep, str(q["id"])) for rep in range(run_args.repeat) for q in questions]
+    incomplete = []
+    for entry in manifest["users"]:
+        if entry["user"] in done:
+            continue
+        got = answers.get(str(entry["uid"]), {})
+        if any(k not in got for k in keys):
+            incomplete.append(entry)
+            continue
+        by_id = {(rep, q["id"]): got[(rep, str(q["id"]))] for rep in range(run_args.repeat) for q in questions}
+        output_data.append(cb.assemble_result(entry, questions, by_id))
+    cb.save_result(output_data, outfile)
+    logger.success(f"组装完成 {len(output_data) - len(done)} 个用户，未完成 {len(incomplete)} 个，"
+                   f"无效回答 {len(bad)} 条 → {outfile}")
+
+    if incomplete:
+        # 补跑批次：只包含缺失或无效的请求，沿用原 custom_id
+        requests_path = args.requests or BATCH_DIR / f"{config}.requests.jsonl"
+        wanted = {str(e["uid"]) for e in incomplete}
+        retry = []
+        for row in read_jsonl(requests_path):
+            _, uid, rep, qid = split_custom_id(row["custom_id"])
+            if uid in wanted and (rep, qid) not in answers.get(uid, {}):
+                retry.append(row)
+        retry_path = BATCH_DIR / f"{config}.retry.requests.jsonl"
+        write_jsonl(retry_path, retry)
+        logger.warning(f"{len(retry)} 条请求需要补跑 → {retry_path}（执行后与原结果一起重新 ingest）")
+
+
+# ----------------- 主入口 -----------------
+def main():
+    parser = argparse.ArgumentParser(description="CBF-PI-B 离线批量模式")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_render = cb.add_run_args(sub.add_parser("render", help="渲染批次文件"))
+    p_render.add_argument("--output", type=Path, default=None, help="批次文件路径，默认 batches/<配置名>.requests.jsonl")
+
+    p_exec = sub.add_parser("execute", help="本地执行批次文件")
+    p_exec.add_argument("batch", type=Path, help="render 生成的批次文件")
+    p_exec.add_argument("--output", type=Path, default=None, help="结果文件路径，默认 *.results.jsonl")
+    p_exec.add_argument("--workers", type=int, default=EXEC_WORKERS, help="并发数")
+    p_exec.add_argument("--timeout", type=float, default=300, help="单条请求超时（秒）")
+
+    p_ingest = sub.add_parser("ingest", help="读取批量结果并组装问卷结果")
+    p_ingest.add_argument("results", type=Path, nargs="+", help="批量结果 JSONL（可多个，如原批次 + 补跑批次）")
+    p_ingest.add_argument("--manifest", type=Path, default=None, help="默认 batches/<配置名>.manifest.json")
+    p_ingest.add_argument("--requests", type=Path, default=None, help="原批次文件，用于生成补跑批次")
+
+    args = parser.parse_args()
+    {"render": render, "execute": execute, "ingest": ingest}[args.cmd](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+microbench.py
+------------------------------------------
+CPU 阶段微基准：在 synth_data.py 生成的各规模数据上计时，捕捉扩展性回退。
+
+    stage            对应代码
+    json_load        读取原始关键词 / 记忆 / 结果文件
+    payload_weight   generate_prompt_payload：展开 → 权重 → top-k → payload
+    uid_matching     matching.update_json（按姓名匹配编号）
+    result_parse     cbfpib_completion.parse_answer 解析所有回答
+    aggregation      每用户各维度跨 repeat 求均值，再做全体统计
+    normalization    lda/keyword_normalize.normalize_keywords（冷缓存）
+
+    python bench/synth_data.py --sizes 1000 10000
+    python bench/microbench.py --sizes 1000 10000 --baseline bench/results/microbench_old.csv
+"""
+
+import argparse
+import csv
+import json
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "lda"))
+
+import generate_prompt_payload as gpp
+import matching
+from cbfpib_completion import parse_answer
+from keyword_normalize import normalize_keywords
+
+RAW_NAME = "人格特质50位受试者原始数据.json"
+
+
+def stage_json_load(d: Path):
+    for name in (RAW_NAME, "bigfive_memories.json", "bigfive_result_memory_repeat5.json"):
+        json.loads((d / name).read_text("utf-8"))
+
+
+def stage_payload_weight(d: Path, raw):
+    df = gpp.compute_weights(gpp.build_dataframe(raw))
+    gpp.to_payload(gpp.select_topk(df, 80))
+
+
+def stage_uid_matching(d: Path, uid_map):
+    matching.update_json(d / RAW_NAME, uid_map)
+
+
+def stage_result_parse(d: Path, results):
+    for entry in results:
+        for reps in entry["answer"].values():
+            for a in reps.values():
+                parse_answer(a["text"])
+
+
+def stage_aggregation(d: Path, results):
+    rows = [{"user": e["user"], "dim": dim, "score": statistics.fmean(reps.values())}
+            for e in results for dim, reps in e["result"].items()]
+    df = pd.DataFrame(rows).pivot(index="user", columns="dim", values="score")
+    df.describe()
+
+
+def stage_normalization(d: Path, keywords):
+    with tempfile.TemporaryDirectory() as tmp:
+        normalize_keywords(keywords, cache_path=Path(tmp) / "cache.json")
+
+
+def bench_size(d: Path, runs: int) -> list[dict]:
+    raw = json.loads((d / RAW_NAME).read_text("utf-8"))
+    results = json.loads((d / "bigfive_result_memory_repeat5.json").read_text("utf-8"))
+    subjects = json.loads((d / "subjects.json").read_text("utf-8"))
+    uid_map = {s["name"]: s["uid"] for s in subjects}
+    keywords = [kw for u in raw for b in u["data"] for kw in (b["keywords"] or {})]
+
+    stages = {
+        "json_load":      lambda: stage_json_load(d),
+        "payload_weight": lambda: stage_payload_weight(d, raw),
+        "uid_matching":   lambda: stage_uid_matching(d, uid_map),
+        "result_parse":   lambda: stage_result_parse(d, results),
+        "aggregation":    lambda: stage_aggregation(d, results),
+        "normalization":  lambda: stage_normalization(d, keywords),
+    }
+    rows = []
+    for name, fn in stages.items():
+        times = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        best = min(times)
+        rows.append({"stage": name, "users": len(raw), "best_s": round(best, 4),
+                     "median_s": round(statistics.median(times), 4),
+                     "us_per_user": round(best / max(len(raw), 1) * 1e6, 2)})
+        print(f"  {name:<15s} users={len(raw):>7,d}  best={best:9.4f}s  "
+              f"{rows[-1]['us_per_user']:>9.2f} µs/user", flush=True)
+    return rows
+
+
+def compare(rows: list[dict], baseline: Path, tolerance: float) -> int:
+    """与历史结果对比，返回回退的阶段数"""
+    old = {(r["stage"], int(r["users"])): float(r["best_s"]) for r in csv.DictReader(open(baseline, encoding="utf-8"))}
+    regressions = 0
+    for r in rows:
+        prev = old.get((r["stage"], r["users"]))
+        if prev and r["best_s"] > prev * (1 + tolerance):
+            regressions += 1
+            print(f"⚠️  回退: {r['stage']} @ {r['users']:,} users  {prev:.4f}s → {r['best_s']:.4f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU 阶段微基准")
+    parser.add_argument("--data", type=Path, default=BENCH_DIR / "data", help="synth_data.py 的输出根目录")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="要测的规模")
+    parser.add_argument("--runs", type=int, default=3, help="每个阶段重复次数，取最优")
+    parser.add_argument("--baseline", type=Path, default=None, help="对比的历史 CSV")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="超过基线多少比例算回退")
+    parser.add_argument("--output", type=Path, default=None, help="CSV 输出路径")
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        d = args.data / str(n)
+        if not d.exists():
+            print(f"跳过 {d}：不存在，请先运行 bench/synth_data.py --sizes {n}")
+            continue
+        print(f"▶︎ {d}")
+        rows.extend(bench_size(d, args.runs))
+    if not rows:
+        return
+
+    out = args.output or BENCH_DIR / "results" / f"microbench_{datetime.now():%Y%m%d_%H%M%S}.csv"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"✅ 结果已写入 {out}")
+    if args.baseline and compare(rows, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+mock_llm_server.py
+------------------------------------------
+本地 OpenAI 兼容的 /v1/chat/completions 替身，用于不花钱地压测各个管线脚本。
+
+    python bench/mock_llm_server.py --port 8100 --latency lognormal --latency-mean 0.8 --p429 0.02
+
+    * 延迟分布：fixed / uniform / lognormal
+    * 故障注入：按概率返回 429、返回格式错误的回答
+    * 按请求类型（问卷作答 / 直接评分 / 记忆生成 / 故事生成）返回合法格式的回答
+    * token 计数：中文按字、其他按空白分词近似
+    GET  /stats   计数器（请求数、对冲请求数（带 X-Hedge 头）、429、畸形回答、token、按类型分布）
+    POST /reset   清零计数器
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def approx_tokens(text: str) -> int:
+    """粗略 token 数：CJK 字符各算一个，其余按空白分词"""
+    cjk = len(re.findall(r"[一-鿿]", text))
+    rest = re.sub(r"[一-鿿]", " ", text)
+    return cjk + len(rest.split())
+
+
+def classify(messages: list[dict]) -> str:
+    """根据 prompt 判断是哪个脚本发来的请求"""
+    system = messages[0]["content"] if messages else ""
+    user = messages[-1]["content"] if messages else ""
+    if '"memories"' in system:
+        return "memory_gen"
+    if "心理叙事者" in system:
+        return "story_gen"
+    if "OCEAN" in system:
+        return "direct_eval"
+    if "description" in user or "人格自我画像" in user:
+        return "persona_gen"
+    return "survey"
+
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.by_kind = Counter()
+
+    def latency(self) -> float:
+        a = self.args
+        with self.lock:
+            if a.latency == "fixed":
+                return a.latency_mean
+            if a.latency == "uniform":
+                return self.rng.uniform(0, 2 * a.latency_mean)
+            # lognormal：保证均值为 latency_mean
+            mu = math.log(a.latency_mean) - a.latency_sigma ** 2 / 2
+            return self.rng.lognormvariate(mu, a.latency_sigma)
+
+    def roll(self, p: float) -> bool:
+        with self.lock:
+            return self.rng.random() < p
+
+    def randint(self, a: int, b: int) -> int:
+        with self.lock:
+            return self.rng.randint(a, b)
+
+    def answer(self, kind: str, messages: list[dict], malformed: bool) -> str:
+        user = messages[-1]["content"] if messages else ""
+        if kind == "survey":
+            if malformed:
+                return "我无法给出评分。" if self.roll(0.5) else "9"
+            score = self.randint(1, 6)
+            if "详细的分析" in (messages[0]["content"] if messages else ""):
+                return f"结合我的经历逐条分析，这句话与我的整体性格有一定契合。最终评分：{score}"
+            return str(score)
+        if kind == "direct_eval":
+            if malformed:
+                return "抱歉，我无法评估。"
+            scores = {d: {"score": self.randint(0, 100)} for d in "OCEAN"}
+            return "```json\n" + json.dumps(scores, ensure_ascii=False) + "\n```"
+        if kind == "memory_gen":
+            if malformed:
+                return "{memories: 未闭合"
+            m = re.search(r"输出(\d+)句", user)
+            n = int(m.group(1)) if m else 3
+            return json.dumps({"memories": [f"我记得第{i + 1}次参加这样的活动时的细节。" for i in range(n)]},
+                              ensure_ascii=False)
+        if kind == "persona_gen":
+            return "我喜欢在生活中寻找新鲜感，也珍惜与朋友相处的时光。"
+        # story_gen
+        return "那是一个安静的午后，我回想起这些年的点点滴滴。" * 20
+
+    def record(self, **kw):
+        with self.lock:
+            self.counters.update(kw)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state: MockState = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, code: int, obj: dict):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.state.lock:
+                self._send_json(200, {**self.state.counters, "by_kind": dict(self.state.by_kind)})
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/reset":
+            with self.state.lock:
+                self.state.counters.clear()
+                self.state.by_kind.clear()
+            self._send_json(200, {"status": "reset"})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        req = json.loads(body)
+        messages = req.get("messages", [])
+        kind = classify(messages)
+        prompt_tokens = sum(approx_tokens(m.get("content", "")) for m in messages)
+        hedge = int(self.headers.get("X-Hedge") == "1")
+        with self.state.lock:
+            self.state.by_kind[kind] += 1
+        time.sleep(self.state.latency())
+
+        if self.state.roll(self.state.args.p429):
+            self.state.record(requests=1, hedges=hedge, throttled=1, prompt_tokens=prompt_tokens)
+            self._send_json(429, {"error": {"message": "Requests rate limit exceeded", "code": "Throttling"}})
+            return
+
+        malformed = self.state.roll(self.state.args.pmalformed)
+        content = self.state.answer(kind, messages, malformed)
+        completion_tokens = approx_tokens(content)
+        self.state.record(requests=1, hedges=hedge, ok=1, malformed=int(malformed),
+                          prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        self._send_json(200, {
+            "id": f"mock-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地模拟 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8100, help="监听端口")
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="fixed", help="延迟分布")
+    parser.add_argument("--latency-mean", type=float, default=0.05, help="平均延迟（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal 的 sigma")
+    parser.add_argument("--p429", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--pmalformed", type=float, default=0.0, help="返回畸形回答的概率")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    MockHandler.state = MockState(args)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    print(f"mock LLM listening on http://{args.host}:{args.port}/v1/chat/completions", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+run_benchmarks.py
+------------------------------------------
+端到端吞吐压测：对每个模拟服务配置，启动 mock_llm_server，
+在临时目录里用真实脚本跑一遍小规模数据，统计：
+
+    calls/sec、墙钟时间、实际请求数、对冲请求数（mock 按 X-Hedge 请求头计数）、
+    重试数（请求数 - 对冲数 - 理论调用数）、429 / 畸形回答次数、
+    被测脚本的 CPU 时间（user + sys）、token 计数
+
+    python bench/run_benchmarks.py --configs fast throttled --scripts survey direct_eval --users 5
+
+结果打印成表格并写入 bench/results/benchmark_<时间>.csv。
+"""
+
+import argparse
+import csv
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib import request as urlrequest
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+
+# 模拟服务配置：名称 → mock_llm_server 参数
+CONFIGS = {
+    "fast":      ["--latency", "fixed", "--latency-mean", "0.01"],
+    "realistic": ["--latency", "lognormal", "--latency-mean", "0.8", "--latency-sigma", "0.6"],
+    "throttled": ["--latency", "lognormal", "--latency-mean", "0.3", "--p429", "0.05"],
+    "flaky":     ["--latency", "lognormal", "--latency-mean", "0.3", "--pmalformed", "0.05"],
+}
+
+GEN_MEMORY_K = 10                       # 与 generate_memory.K 一致
+
+
+def _subset_inputs(workdir: Path, n_users: int) -> dict:
+    """把前 n 个用户的输入文件写入临时目录，返回各脚本的理论调用数所需信息"""
+    memories = json.loads((ROOT / "bigfive_memories.json").read_text("utf-8"))[:n_users]
+    payload = json.loads((ROOT / "bigfive_prompt_payload.json").read_text("utf-8"))
+    uid_of = {m["user"]: m["uid"] for m in memories}
+    payload = [{**p, "uid": uid_of[p["user"]]} for p in payload if p["user"] in uid_of]
+
+    shutil.copy(ROOT / "CBF-PI-B.json", workdir / "CBF-PI-B.json")
+    (workdir / "bigfive_memories.json").write_text(json.dumps(memories, ensure_ascii=False), "utf-8")
+    (workdir / "bigfive_story.json").write_text(json.dumps(memories, ensure_ascii=False), "utf-8")
+    (workdir / "bigfive_prompt_payload.json").write_text(json.dumps(payload, ensure_ascii=False), "utf-8")
+    n_items = len(json.loads((ROOT / "CBF-PI-B.json").read_text("utf-8")))
+    return {"users": len(memories), "items": n_items,
+            "keywords": sum(min(GEN_MEMORY_K, len(p["keywords"])) for p in payload)}
+
+
+# 被测脚本：名称 → (命令构造, 理论调用数)
+SCRIPTS = {
+    "survey": (
+        lambda a: [sys.executable, str(ROOT / "cbfpib_completion.py"), "--model", "mock",
+                   "--data-type", "memory", "--repeat", str(a.repeat)],
+        lambda info, a: (info["users"] + 1) * info["items"] * a.repeat,     # +1 为 baseline 用户
+    ),
+    "direct_eval": (
+        lambda a: [sys.executable, str(ROOT / "direct_evaluation.py")],
+        lambda info, a: info["users"],
+    ),
+    "gen_memory": (
+        lambda a: [sys.executable, str(ROOT / "generate_memory.py")],
+        lambda info, a: info["keywords"],
+    ),
+    "gen_story": (
+        lambda a: [sys.executable, str(ROOT / "generate_story.py")],
+        lambda info, a: info["users"],
+    ),
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _http(url: str, data: bytes | None = None) -> dict:
+    with urlrequest.urlopen(urlrequest.Request(url, data=data)) as resp:
+        return json.loads(resp.read())
+
+
+def start_mock(config: str, port: int) -> subprocess.Popen:
+    proc = subprocess.Popen([sys.executable, str(BENCH_DIR / "mock_llm_server.py"), "--port", str(port),
+                             *CONFIGS[config]], stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            _http(f"http://127.0.0.1:{port}/health")
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"mock server ({config}) 未能启动")
+
+
+def run_one(config: str, script: str, port: int, args) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    _http(base + "/reset", data=b"")
+    build_cmd, expected_calls = SCRIPTS[script]
+    with tempfile.TemporaryDirectory(prefix=f"bench_{script}_") as tmp:
+        workdir = Path(tmp)
+        info = _subset_inputs(workdir, args.users)
+        env = {**os.environ, "LLM_API_URL": base + "/v1/chat/completions",
+               "DASHSCOPE_API_KEY": "mock", "BIGFIVE_MODEL_SERVER": "off"}
+
+        usage0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        t0 = time.perf_counter()
+        try:
+            proc = subprocess.run(build_cmd(args), cwd=workdir, env=env, timeout=args.timeout,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            status = "ok" if proc.returncode == 0 else f"exit {proc.returncode}"
+            if proc.returncode and args.verbose:
+                print(proc.stderr[-2000:], file=sys.stderr)
+        except subprocess.TimeoutExpired:
+            status = "timeout"
+        wall = time.perf_counter() - t0
+        usage1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    stats = _http(base + "/stats")
+    requests_made = stats.get("requests", 0)
+    hedges = stats.get("hedges", 0)
+    expected = expected_calls(info, args)
+    return {
+        "config": config, "script": script, "status": status, "users": info["users"],
+        "wall_s": round(wall, 3),
+        "calls": requests_made,
+        "calls_per_s": round(requests_made / wall, 2) if wall else 0.0,
+        "expected_calls": expected,
+        "hedges": hedges,
+        "retries": requests_made - hedges - expected,
+        "throttled": stats.get("throttled", 0),
+        "malformed": stats.get("malformed", 0),
+        "cpu_s": round((usage1.ru_utime - usage0.ru_utime) + (usage1.ru_stime - usage0.ru_stime), 3),
+        "prompt_tokens": stats.get("prompt_tokens", 0),
+        "completion_tokens": stats.get("completion_tokens", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="管线脚本端到端吞吐压测")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=["fast"], help="模拟服务配置")
+    parser.add_argument("--scripts", nargs="+", choices=list(SCRIPTS), default=list(SCRIPTS), help="被测脚本")
+    parser.add_argument("--users", type=int, default=3, help="使用前 N 个用户")
+    parser.add_argument("--repeat", type=int, default=1, help="问卷重复次数")
+    parser.add_argument("--timeout", type=float, default=1800, help="单次运行超时（秒）")
+    parser.add_argument("--output", type=Path, default=None, help="CSV 输出路径")
+    parser.add_argument("--verbose", action="store_true", help="失败时打印脚本 stderr")
+    args = parser.parse_args()
+
+    rows = []
+    for config in args.configs:
+        port = _free_port()
+        mock = start_mock(config, port)
+        try:
+            for script in args.scripts:
+                row = run_one(config, script, port, args)
+                rows.append(row)
+                print(f"[{config:>9s}] {script:<12s} {row['status']:<8s} wall={row['wall_s']:>8.2f}s "
+                      f"calls={row['calls']:>5d} ({row['calls_per_s']:>6.2f}/s) hedges={row['hedges']:>4d} retries={row['retries']:>4d} "
+                      f"429={row['throttled']:>3d} bad={row['malformed']:>3d} cpu={row['cpu_s']:>6.2f}s", flush=True)
+        finally:
+            mock.terminate()
+            mock.wait()
+
+    out = args.output or BENCH_DIR / "results" / f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.csv"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"✅ 结果已写入 {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+synth_data.py
+------------------------------------------
+按真实文件的结构生成大规模合成数据集，用于压测 CPU 阶段的扩展性：
+
+    <out>/<n>/人格特质50位受试者原始数据.json   [{name, data: [{theme, frequency, keywords: {词: 频次}}]}]
+    <out>/<n>/subjects.json                     [{name, uid}]（代替 xlsx 的姓名-编号表）
+    <out>/<n>/bigfive_memories.json             [{user, uid, keywords: [{token, weight, context, memories}]}]
+    <out>/<n>/bigfive_stories.json              [{uid, user, story}]
+    <out>/<n>/bigfive_result_memory_repeat5.json[{user, uid, result, answer}]
+
+主题、关键词、记忆句子都从仓库里的真实数据中抽样；逐用户流式写出，内存占用与规模无关。
+
+    python bench/synth_data.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import json
+import random
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+RAW_NAME = "人格特质50位受试者原始数据.json"
+
+
+def load_pools() -> dict:
+    """从真实数据中收集主题、关键词、记忆句与题库"""
+    raw = json.loads((ROOT / RAW_NAME).read_text("utf-8"))
+    memories = json.loads((ROOT / "bigfive_memories.json").read_text("utf-8"))
+    themes, tokens = set(), set()
+    for u in raw:
+        for block in u["data"]:
+            themes.add(block["theme"])
+            tokens.update((block["keywords"] or {}).keys())
+    sentences = [m for u in memories for kw in u["keywords"] for m in kw.get("memories", [])]
+    return {
+        "themes": sorted(themes),
+        "tokens": sorted(tokens),
+        "sentences": sentences,
+        "questions": json.loads((ROOT / "CBF-PI-B.json").read_text("utf-8")),
+    }
+
+
+class JsonArrayWriter:
+    """逐条写出 JSON 数组，避免在内存中攒整个列表"""
+
+    def __init__(self, path: Path):
+        self.f = open(path, "w", encoding="utf-8")
+        self.f.write("[\n")
+        self.first = True
+
+    def write(self, obj):
+        if not self.first:
+            self.f.write(",\n")
+        self.f.write(json.dumps(obj, ensure_ascii=False))
+        self.first = False
+
+    def close(self):
+        self.f.write("\n]\n")
+        self.f.close()
+
+
+def synth_user(rng: random.Random, pools: dict, idx: int, repeat: int) -> dict:
+    """生成一个用户在各文件中的记录"""
+    name, uid = f"synth_{idx:07d}", str(idx + 1)
+
+    blocks = []
+    for theme in rng.sample(pools["themes"], k=rng.randint(4, min(8, len(pools["themes"])))):
+        kws = rng.sample(pools["tokens"], k=10)
+        counts = sorted((rng.randint(1, 40) for _ in kws), reverse=True)
+        blocks.append({"theme": theme, "frequency": float(rng.randint(1, 60)),
+                       "keywords": dict(zip(kws, counts))})
+
+    top = sorted(((kw, c, b["theme"]) for b in blocks for kw, c in b["keywords"].items()),
+                 key=lambda x: x[1], reverse=True)[:10]
+    keywords = [{"token": kw, "weight": round(c * rng.uniform(0.5, 1.5), 4), "context": theme,
+                 "memories": rng.sample(pools["sentences"], k=10 - i)}
+                for i, (kw, c, theme) in enumerate(top)]
+    story = "".join(m for kw in keywords for m in kw["memories"])
+
+    answer, result = {}, {}
+    for q in pools["questions"]:
+        answer[str(q["id"])] = {}
+        result.setdefault(q["dimension"], {str(r): 0 for r in range(repeat)})
+        for r in range(repeat):
+            a = rng.randint(1, 6)
+            answer[str(q["id"])][str(r)] = {"answer": a, "text": str(a)}
+            result[q["dimension"]][str(r)] += (7 - a) if q["reverse"] else a
+
+    return {
+        "raw": {"name": name, "data": blocks},
+        "subject": {"name": name, "uid": uid},
+        "memory": {"user": name, "uid": uid, "keywords": keywords},
+        "story": {"uid": uid, "user": name, "story": story},
+        "result": {"user": name, "uid": uid, "result": result, "answer": answer},
+    }
+
+
+def generate(n: int, out_dir: Path, pools: dict, seed: int, repeat: int):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    writers = {
+        "raw": JsonArrayWriter(out_dir / RAW_NAME),
+        "subject": JsonArrayWriter(out_dir / "subjects.json"),
+        "memory": JsonArrayWriter(out_dir / "bigfive_memories.json"),
+        "story": JsonArrayWriter(out_dir / "bigfive_stories.json"),
+        "result": JsonArrayWriter(out_dir / f"bigfive_result_memory_repeat{repeat}.json"),
+    }
+    rng = random.Random(seed)
+    try:
+        for i in range(n):
+            for key, obj in synth_user(rng, pools, i, repeat).items():
+                writers[key].write(obj)
+    finally:
+        for w in writers.values():
+            w.close()
+    print(f"✅ {n:,} users → {out_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成结构一致的大规模合成数据")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="用户规模")
+    parser.add_argument("--out", type=Path, default=Path(__file__).resolve().parent / "data", help="输出根目录")
+    parser.add_argument("--repeat", type=int, default=5, help="结果文件中的重复次数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    args = parser.parse_args()
+
+    pools = load_pools()
+    for n in args.sizes:
+        generate(n, args.out / str(n), pools, args.seed, args.repeat)
@@ -1,12 +1,18 @@
-import argparse
 import json
 import re
 import random
+import sys
 import threading
 from pathlib import Path
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from prompt_generator import generate_system_prompt
+from users_file import read_users_file
+from run_config import add_run_args, build_parser, result_path, users_suffix   # 供其他脚本以 cb.xxx 复用
+from atomic_json import update_json
+from hedging import HedgedCaller
+from scheduler import FairScheduler
+from tracing import span
+import tracing
 
 import requests
 from tqdm import tqdm
@@ -15,16 +21,21 @@ import os
 import time
 # ===== 配置区 =====
 API_KEY   = os.getenv("DASHSCOPE_API_KEY")
-API_URL   = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+API_URL   = os.getenv("LLM_API_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions")
 
 CBFPIB    = "CBF-PI-B.json"            # 40 道题库
 
 MAX_WORKERS     = 4                    # 线程池并发数
 MAX_API_CONC    = 4                    # 同时 hitting API 的线程数
 MAX_RETRY       = 200
+MAX_PARSE_RETRY = 10                   # 回答解析失败的重试上限，超过即判定该题失败
+LATENCY_PROFILES = Path("latency_profiles.json")   # 实测延迟画像，供 plan_run.py 估算
+DEMOTE_AFTER    = 3                    # 同一题连续失败几次后降级到低优先级重试通道
 SEMAPHORE = threading.Semaphore(MAX_API_CONC)
+HEDGER = HedgedCaller(timeout_floor=15, timeout_cap=300, hedge_pct=0.05)   # 超时取 3×p99，超过 p95 发对冲
 
 model, repeat, system_prompt_raw, data_type, thinking = "qwen_turbo", 1, "", "memory", False
+retrieval_k, retrieval_index, item_emb = 0, {}, {}   # 检索模式：每题只放 top-k 条相关记忆
 
 # ---------------- 请求头 ----------------
 HEADERS = {
@@ -45,28 +56,74 @@ def build_messages(system_prompt: str, user_prompt: str) -> list[dict]:
         {"role": "user",   "content": user_prompt},
     ]
 
-def call_deepseek(messages: list[dict]) -> str:
-    """线程安全地调用 DeepSeek / DashScope，返回纯文本回答"""
-    global model, thinking
-    
-    payload = {
+def build_payload(messages: list[dict]) -> dict:
+    """Chat Completion 请求体（交互调用与批量文件共用）"""
+    return {
         "model": model,
         "messages": messages,
         "temperature": 0.3,
         "enable_thinking": thinking
     }
+
+def call_deepseek(messages: list[dict]) -> str:
+    """线程安全地调用 DeepSeek / DashScope，返回纯文本回答（带截止时间与对冲请求）"""
+    return post_payload(build_payload(messages))
+
+def post_payload(payload: dict) -> str:
+    """发送已构造好的请求体，返回回答文本"""
     # logger.debug(payload)
     # logger.debug(HEADERS)
-    with SEMAPHORE:  # 控制同时并发 API 数
-        resp = requests.post(API_URL, headers=HEADERS, data=json.dumps(payload))
-    resp.raise_for_status()
-    return resp.json()["choices"][0]["message"]["content"]
+    def post(timeout: float, attempt) -> str:
+        with attempt.slot(SEMAPHORE):                  # 控制同时并发 API 数，对冲请求也占这里的槽位
+            with span("network", hedge=attempt.is_hedge):
+                resp = requests.post(API_URL, headers=attempt.tag(HEADERS), data=json.dumps(payload), timeout=timeout)
+            resp.raise_for_status()
+        return resp.json()["choices"][0]["message"]["content"]
+
+    return HEDGER.call(post)
+
+def parse_answer(response: str) -> int:
+    """从回答末尾取出整数评分，必须在 1-6 之间"""
+    m = re.search(r"\d+", response[::-1])
+    if not m:
+        raise ValueError("未找到整数")
+    last_int = int(m.group())
+    if not 1 <= last_int <= 6:
+        raise ValueError(f"数字超出范围: {last_int}")
+    return last_int
+
+def build_retrieval_index(data: list[dict], questions: list[dict]):
+    """一次性编码所有记忆与题目，为每个用户建立归一化向量索引"""
+    global retrieval_index, item_emb
+    from embedding_cache import encode_cached       # 只有检索模式才加载句向量模型
+    user_mems = {
+        entry["user"]: [m for kw in entry.get("keywords", []) for m in kw.get("memories", [])]
+        for entry in data
+    }
+    all_mems = [m for mems in user_mems.values() for m in mems]
+    emb = encode_cached(all_mems + [q["text"] for q in questions], normalize=True)
+    q_emb = emb[len(all_mems):]
+    item_emb = {q["id"]: q_emb[i] for i, q in enumerate(questions)}
+
+    offset = 0
+    for user, mems in user_mems.items():
+        retrieval_index[user] = (mems, emb[offset:offset + len(mems)])
+        offset += len(mems)
+    logger.info(f"检索索引构建完成：{len(user_mems)} 个用户，{len(all_mems)} 条记忆，{len(questions)} 道题")
+
+def retrieve_memories(user: str, qid: int, k: int) -> list[str]:
+    """返回与题目最相关的 k 条记忆（按相似度降序）"""
+    mems, emb = retrieval_index[user]
+    sims = emb @ item_emb[qid]
+    return [mems[i] for i in (-sims).argsort()[:k]]
 
 # ----------------- 核心函数 -----------------
-def process_user(entry: dict, questions: list[dict], seed: int = 42) -> dict:
-    """单用户处理逻辑，返回结果字典"""
+def build_user_tasks(entry: dict, questions: list[dict], seed: int = 42) -> tuple[dict, dict | None]:
+    """
+    构造单用户的全部作答任务
+    :return: ({(repeat, qid): messages}, prompt_size)；prompt_size 仅检索模式下非 None
+    """
     user = entry["user"]
-    uid  = entry["uid"]
 
     global system_prompt_raw, repeat
     # 1) 取出记忆片段
@@ -76,11 +133,17 @@ def process_user(entry: dict, questions: list[dict], seed: int = 42) -> dict:
         persona = entry.get("story", None)
     else:
         persona = None
-    
-    answer, result = {}, {}
-    for q in questions:
-        answer[q["id"]], result[q["dimension"]] = {}, defaultdict(int)
 
+    use_retrieval = retrieval_k > 0 and isinstance(persona, list) and bool(persona)
+    prompt_size = None
+    if use_retrieval:
+        full_len = len(system_prompt_raw[0] + "\n    ".join(persona) + system_prompt_raw[1])
+        rag_lens = [len(system_prompt_raw[0] + "\n    ".join(retrieve_memories(user, q["id"], retrieval_k))
+                        + system_prompt_raw[1]) for q in questions]
+        prompt_size = {"full_chars": full_len, "retrieval_chars_mean": round(sum(rag_lens) / len(rag_lens), 1)}
+        logger.info(f"用户 {user} system prompt 字符数：全量 {full_len}，检索 top-{retrieval_k} 平均 {prompt_size['retrieval_chars_mean']}")
+
+    tasks = {}
     for i in range(repeat):
         if not persona:
             system_prompt = system_prompt_raw[1]
@@ -93,83 +156,152 @@ def process_user(entry: dict, questions: list[dict], seed: int = 42) -> dict:
                 system_prompt = system_prompt_raw[0] + persona + system_prompt_raw[1]
         # logger.debug(f"用户 {user} system_prompt 构造完成：{system_prompt}")
 
-        # 2) 按题目循环
+        # 2) 按题目构造
         for q in questions:
-            qid, text, dim, reverse = q["id"], q["text"], q["dimension"], q["reverse"]
-            user_prompt = USER_PROMPT[0] + text
-
-            last_int = None
-            for attempt in range(1, MAX_RETRY + 1):
-                try:
-                    response = call_deepseek(build_messages(system_prompt, user_prompt))
-                    m = re.search(r"\d+", response[::-1])
-                    if not m:
-                        raise ValueError("未找到整数")
-                    last_int = int(m.group())
-                    # logger.debug(f"[{user}] 题 {qid} 第 {i} 次回答：{response} → {last_int}")
-                    if not 1 <= last_int <= 6:
-                        raise ValueError(f"数字超出范围: {last_int}")
-                    break  # 成功跳出 retry 循环
-                except requests.HTTPError as e:
-                    if e.response.status_code == 429:
-                        wait = random.randint(3000,20000)/1000
-                        logger.warning(f"请求过于频繁，等待 {wait}s")
-                        time.sleep(wait)
-                    logger.error(f"[{user}] 题 {qid} 第 {i} 次回答调用失败({attempt}/{MAX_RETRY}): {e}。原始回答: {response if 'response' in locals() else '无'}")
-            if last_int is None:
-                raise RuntimeError(f"[{user}] 题 {qid} 第 {i} 次回答多次失败，终止该用户")
+            item_prompt = system_prompt
+            if use_retrieval:
+                item_prompt = system_prompt_raw[0] + "\n    ".join(retrieve_memories(user, q["id"], retrieval_k)) + system_prompt_raw[1]
+            tasks[(i, q["id"])] = build_messages(item_prompt, USER_PROMPT[0] + q["text"])
+    return tasks, prompt_size
+
+def ask_item(messages: list[dict]) -> tuple[int, str]:
+    """单次作答：调用接口并解析评分，失败直接抛异常交给调度器重试"""
+    with span("ask_item"):
+        response = call_deepseek(messages)
+        try:
+            with span("parse"):
+                return parse_answer(response), response
+        except ValueError as e:
+            raise ValueError(f"{e}。原始回答: {response}") from e
 
+def retry_backoff(exc: Exception, attempts: int) -> float | None:
+    """
+    调度器的重试等待：只有 429 / 5xx 按失败次数指数退避（带抖动）；
+    解析失败与其他错误不等待（连续失败 DEMOTE_AFTER 次后进重试通道），
+    已失败 MAX_PARSE_RETRY 次且这次仍是解析失败时放弃该题（返回 None）。
+    """
+    status = exc.response.status_code if isinstance(exc, requests.HTTPError) and exc.response is not None else None
+    if status == 429 or (status is not None and status >= 500):
+        base = min(2 ** attempts, 60)
+        wait = round(random.uniform(base / 2, base), 2)
+        logger.warning(f"接口返回 {status}，{wait}s 后重试({attempts}/{MAX_RETRY})")
+        return wait
+    if isinstance(exc, ValueError) and attempts >= MAX_PARSE_RETRY:
+        logger.error(f"作答解析失败 {attempts} 次，放弃该题: {exc}")
+        return None
+    logger.error(f"作答失败({attempts}/{MAX_RETRY}): {exc}")
+    return 0
+
+def assemble_result(entry: dict, questions: list[dict], answers: dict, prompt_size: dict | None = None) -> dict:
+    """把 {(repeat, qid): (评分, 原始回答)} 汇总成单用户结果字典"""
+    answer, result = {}, {}
+    for q in questions:
+        answer[q["id"]], result[q["dimension"]] = {}, defaultdict(int)
+    for i in range(repeat):
+        for q in questions:
+            last_int, response = answers[(i, q["id"])]
             # 汇总维度分
-            result[dim][i] += last_int if not reverse else (7 - last_int)
-            answer[qid][i]  = {"answer": last_int, "text": response}
+            result[q["dimension"]][i] += last_int if not q["reverse"] else (7 - last_int)
+            answer[q["id"]][i] = {"answer": last_int, "text": response}
+
+    ret = {"user": entry["user"], "uid": entry["uid"], "result": result, "answer": answer}
+    if prompt_size:
+        ret["prompt_size"] = prompt_size
+    return ret
 
-    # logger.success(f"用户 {user} 完成，维度分: {dict(result)}")
-    return {"user": user, "uid": uid, "result": result, "answer": answer}
+def process_user(entry: dict, questions: list[dict], seed: int = 42) -> dict:
+    """单用户串行处理逻辑（不经调度器），返回结果字典"""
+    tasks, prompt_size = build_user_tasks(entry, questions, seed)
+    answers = {}
+    for key, messages in tasks.items():
+        for attempt in range(1, MAX_RETRY + 1):
+            try:
+                answers[key] = ask_item(messages)
+                break  # 成功跳出 retry 循环
+            except (requests.RequestException, ValueError) as e:
+                delay = retry_backoff(e, attempt)
+                if delay is None:
+                    raise RuntimeError(f"[{entry['user']}] 题 {key[1]} 第 {key[0]} 次回答无法解析，终止该用户") from e
+                with span("backoff_sleep"):
+                    time.sleep(delay)
+        else:
+            raise RuntimeError(f"[{entry['user']}] 题 {key[1]} 第 {key[0]} 次回答多次失败，终止该用户")
+    return assemble_result(entry, questions, answers, prompt_size)
 
 def save_result(output_data: list, outfile_path: Path):
     """将结果保存到文件"""
-    with open(outfile_path, 'w', encoding='utf-8') as f:
+    with span("save_result"), open(outfile_path, 'w', encoding='utf-8') as f:
         json.dump(output_data, f, ensure_ascii=False, indent=2)
 
-# ----------------- 主入口 -----------------
-def main():
-
-    argparse.ArgumentParser(description="CBF-PI-B Memory Zero-shot Processing")
-    parser = argparse.ArgumentParser(description="CBF-PI-B Memory Zero-shot Processing")
-    parser.add_argument("--seed", type=int, default=42, help="随机种子，默认为 42")
-    parser.add_argument("--model", type=str, required=True ,help="模型名称，例如 qwen-turbo")
-    parser.add_argument("--data-type", type=str, default="memory", choices=["memory", "story"], help="处理类型，默认为 memory")
-    parser.add_argument("--cot", action="store_true", help="是否启用 Chain of Thought (CoT) 模式")
-    parser.add_argument("--zeroshot", action="store_true", help="是否启用zeroshot")
-    parser.add_argument("--repeat", type=int, default=1, help="重复次数，默认为 1")
-    parser.add_argument("--thinking", action="store_true", help="是否启用模型自带的思考模式")
-    args = parser.parse_args()
-
-    # 设置全局变量
-    global model, repeat, system_prompt_raw, data_type, thinking
-    model, data_type, cot, zeroshot, repeat, thinking = args.model, args.data_type, args.cot, args.zeroshot, args.repeat, args.thinking
-    seed = args.seed
+# ----------------- 运行配置 -----------------
+def configure_run(args):
+    """按参数设置全局变量（不碰文件系统），只渲染 prompt 的场景（plan_run.py）直接用它"""
+    global model, repeat, system_prompt_raw, data_type, thinking, retrieval_k
+    model, data_type, repeat, thinking = args.model, args.data_type, args.repeat, args.thinking
+    retrieval_k = args.retrieval_k if data_type == "memory" else 0
 
-    system_prompt_raw = generate_system_prompt(data_type, cot, zeroshot)
-    logger.info(f"使用模型: {model}, 数据类型: {data_type}, CoT: {cot}, Zero-shot: {zeroshot}, 重复次数: {repeat}，思考模式：{thinking}")
+    system_prompt_raw = generate_system_prompt(data_type, args.cot, args.zeroshot)
+    logger.info(f"使用模型: {model}, 数据类型: {data_type}, CoT: {args.cot}, Zero-shot: {args.zeroshot}, 重复次数: {repeat}，思考模式：{thinking}，检索 top-k：{retrieval_k}")
 
+def setup_run(args) -> Path:
+    """按参数设置全局变量，返回本次运行的结果文件路径"""
+    configure_run(args)
     # 文件路径
-    if not Path("results").exists() or not Path("results").is_dir():
-        os.mkdir("results")
-    outfile_path = f'''bigfive_result_{model}_{data_type}{"_cot" if cot else ""}{"_zeroshot" if zeroshot else ""}_repeat{repeat}.json'''
-    outfile_path = Path.joinpath(Path("results"), Path(outfile_path))
-    personas_path  = Path("bigfive_memories.json" if data_type == "memory" else "bigfive_stories.json") 
-    questions_path = Path(CBFPIB)
+    Path("results").mkdir(exist_ok=True)            # 并发的问卷阶段可能同时创建
+    return result_path(args)
 
-    data      = json.loads(personas_path.read_text(encoding="utf-8"))
+def load_personas(args, write_cache: bool = True) -> list[dict]:
+    """读取人格画像（按需裁剪、按 --users-file 筛选），末尾追加无画像的 baseline 用户；write_cache=False 时不写裁剪缓存"""
+    personas_path = Path("bigfive_memories.json" if args.data_type == "memory" else "bigfive_stories.json")
+    with span("load_json", file=str(personas_path)):
+        data = json.loads(personas_path.read_text(encoding="utf-8"))
+    if getattr(args, "users_file", None):
+        wanted = set(read_users_file(args.users_file))
+        missing = wanted - {entry["user"] for entry in data}
+        if missing:
+            logger.warning(f"{personas_path} 中没有这些用户：{sorted(missing)}")
+        data = [entry for entry in data if entry["user"] in wanted]
+        logger.info(f"按 {args.users_file} 只跑 {len(data)} 个用户")
+    if args.token_budget:
+        from persona_compact import compact_personas   # 只有设置预算时才加载 tokenizer
+        data, report = compact_personas(data, args.data_type, args.token_budget, write_cache=write_cache)
+        cut = report.loc[report["units_after"] < report["units_before"], "user"].tolist() if len(report) else []
+        logger.info(f"按 {args.token_budget} tokens 裁剪了 {len(cut)} 个用户的画像：{cut}")
     data.append({"user": "baseline", "uid": -1, "story": ""})
+    return data
 
-    # 初始化输出文件
+def save_latency_profile(args, stats: dict):
+    """把本次运行的实测延迟与失败率按 <模型>[_cot][_thinking] 记入 LATENCY_PROFILES"""
+    profile = HEDGER.profile()
+    if not profile["samples"]:
+        return
+    profile["retry_rate"] = stats["failures"] / max(stats["tasks"], 1)
+    key = f"{args.model}{'_cot' if args.cot else ''}{'_thinking' if args.thinking else ''}"
+    update_json(LATENCY_PROFILES, lambda profiles: profiles.__setitem__(key, profile), indent=2)   # 加锁合并，并发运行互不覆盖
+
+def load_output(outfile_path: Path) -> list[dict]:
+    """读取已有结果，用于断点续跑"""
     if outfile_path.exists():
-        with open(outfile_path, 'r', encoding='utf-8') as f:
-            output_data = json.load(f)
-    else:
-        output_data = []
+        with span("load_json", file=str(outfile_path)), open(outfile_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return []
+
+# ----------------- 主入口 -----------------
+def main():
+    args = build_parser().parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
+    if args.dry_run:
+        import plan_run
+        plan_run.print_plan(plan_run.plan([sys.argv[1:]]))
+        return
+    outfile_path = setup_run(args)
+    seed = args.seed
+    questions_path = Path(CBFPIB)
+    data = load_personas(args)
+
+    # 初始化输出文件
+    output_data = load_output(outfile_path)
     
     # 获取已处理的用户列表
     processed_users = {entry["user"] for entry in output_data}
@@ -180,26 +312,36 @@ def main():
         logger.info("所有用户已处理完成，无需继续处理")
         return
     
-    questions = json.loads(questions_path.read_text(encoding="utf-8"))
+    with span("load_json", file=CBFPIB):
+        questions = json.loads(questions_path.read_text(encoding="utf-8"))
     errors = []
+    if retrieval_k:
+        with span("retrieval_index"):
+            build_retrieval_index(data_filtered, questions)
 
-    # 线程池并发
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_user, entry, questions, seed): entry["user"] for entry in data_filtered}
+    # 任务级调度：(用户, repeat, 题号) 拆成小任务，按用户到达顺序完成
+    sched = FairScheduler(n_workers=MAX_WORKERS, max_attempts=MAX_RETRY, demote_after=DEMOTE_AFTER,
+                          backoff=retry_backoff)
+    entries, sizes = {}, {}
+    for entry in data_filtered:
+        with span("build_prompts", user=entry["user"]):
+            tasks, sizes[entry["user"]] = build_user_tasks(entry, questions, seed)
+        entries[entry["user"]] = entry
+        sched.add_job(entry["user"], tasks)
 
-        for fut in tqdm(as_completed(futures), total=len(futures), desc="Processing users"):
-            user = futures[fut]
-            try:
-                res = fut.result()
-                if res:
-                    output_data.append(res)
-                    # 每次处理完一个用户就保存一次
-                    save_result(output_data, outfile_path)
-                    logger.info(f"用户 {user} 处理完成，结果已保存")
-            except Exception as exc:
-                logger.error(f"用户 {user} 处理异常: {exc}")
-                errors.append(user)
+    for user, answers, exc in tqdm(sched.run(ask_item), total=len(entries), desc="Processing users"):
+        if exc is not None:
+            logger.error(f"用户 {user} 处理异常: {exc}")
+            errors.append(user)
+            continue
+        output_data.append(assemble_result(entries[user], questions, answers, sizes[user]))
+        # 每次处理完一个用户就保存一次
+        save_result(output_data, outfile_path)
+        logger.info(f"用户 {user} 处理完成，结果已保存")
 
+    logger.info(f"调度统计：成功调用 {sched.stats['tasks']} 次，失败 {sched.stats['failures']} 次，降级 {sched.stats['demoted']} 题")
+    HEDGER.log_summary()
+    save_latency_profile(args, sched.stats)
     logger.success(f"全部完成，成功 {len(output_data)} 条，失败 {len(errors)} 条 → {outfile_path}")
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+dedup_memories.py
+------------------------------------------
+生成记忆的语义去重：同一用户的不同关键词下常出现同一场景（多条画画、逛市集……），
+在下游每次调用中都要重复付费。
+
+    1. 所有用户的记忆一次性编码（走 embedding_cache，重复运行不再编码）；
+    2. 每个用户按关键词 weight 从高到低排列记忆，计算相似度矩阵；
+    3. 贪心保留：高权重记忆作为代表，删除与其相似度 ≥ 阈值的后续记忆；
+    4. 输出去重后的 bigfive_memories 与每用户 token 节省报告。
+
+    python dedup_memories.py --threshold 0.85
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from tqdm import tqdm
+
+from embedding_cache import encode_cached
+from persona_compact import MEMORY_SEP, count_tokens
+
+
+def ordered_memories(entry: dict) -> list[tuple[int, int, str]]:
+    """按关键词权重降序展开 (关键词下标, 记忆下标, 记忆)"""
+    order = sorted(range(len(entry.get("keywords", []))),
+                   key=lambda i: entry["keywords"][i].get("weight", 0), reverse=True)
+    return [(k, j, m) for k in order for j, m in enumerate(entry["keywords"][k].get("memories", []))]
+
+
+def dedup_user(emb: np.ndarray, threshold: float) -> np.ndarray:
+    """贪心去重：按顺序保留代表，删除与之近似重复的后续记忆，返回保留掩码"""
+    sims = emb @ emb.T
+    dup = np.triu(sims >= threshold, k=1)
+    keep = np.ones(len(emb), dtype=bool)
+    for i in range(len(emb)):
+        if keep[i]:
+            keep[dup[i]] = False
+    return keep
+
+
+def main(args):
+    data = json.loads(args.input.read_text(encoding="utf-8"))
+    if not data:
+        logger.warning(f"{args.input} 中没有用户，不做去重")
+        return
+    flat = [ordered_memories(entry) for entry in data]
+    all_mems = [m for mems in flat for _, _, m in mems]
+    emb = encode_cached(all_mems, normalize=True, show_progress=True)
+    logger.info(f"{len(data)} 个用户，{len(all_mems)} 条记忆编码完成")
+
+    rows, offset = [], 0
+    for entry, mems in tqdm(zip(data, flat), total=len(data), desc="dedup users"):
+        user_emb = emb[offset:offset + len(mems)]
+        offset += len(mems)
+        keep = dedup_user(user_emb, args.threshold) if len(mems) else np.zeros(0, dtype=bool)
+
+        kept = {(k, j) for (k, j, _), ok in zip(mems, keep) if ok}
+        before_text = MEMORY_SEP.join(m for _, _, m in mems)
+        for k, kw in enumerate(entry.get("keywords", [])):
+            kw["memories"] = [m for j, m in enumerate(kw.get("memories", [])) if (k, j) in kept]
+        after_text = MEMORY_SEP.join(m for kw in entry.get("keywords", []) for m in kw["memories"])
+
+        rows.append({
+            "user": entry.get("user"), "uid": entry.get("uid"),
+            "memories_before": len(mems), "memories_after": int(keep.sum()),
+            "tokens_before": count_tokens(before_text), "tokens_after": count_tokens(after_text),
+        })
+
+    report = pd.DataFrame(rows)
+    report["tokens_saved"] = report["tokens_before"] - report["tokens_after"]
+    args.output.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    report.to_csv(args.report, index=False)
+    logger.success(
+        f"去重完成：记忆 {report['memories_before'].sum()} → {report['memories_after'].sum()}，"
+        f"token {report['tokens_before'].sum()} → {report['tokens_after'].sum()}"
+        f"（节省 {report['tokens_saved'].sum()}），结果 → {args.output}，报告 → {args.report}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成记忆的语义近重复去除")
+    parser.add_argument("--input", type=Path, default=Path("bigfive_memories.json"), help="记忆文件")
+    parser.add_argument("--output", type=Path, default=Path("bigfive_memories_dedup.json"), help="去重后输出")
+    parser.add_argument("--report", type=Path, default=Path("memory_dedup_report.csv"), help="每用户 token 报告")
+    parser.add_argument("--threshold", type=float, default=0.85, help="余弦相似度阈值，≥ 该值视为重复")
+    main(parser.parse_args())
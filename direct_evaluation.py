@@ -98,7 +98,7 @@ import re
 import os
 # === 配置区 ===
 API_KEY = os.getenv("DASHSCOPE_API_KEY")
-API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+API_URL = os.getenv("LLM_API_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions")
 MODEL = "deepseek-v3"
 HEADERS = {
     "Content-Type": "application/json",
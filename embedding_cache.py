@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+embedding_cache.py
+------------------------------------------
+磁盘句向量缓存，按 (模型名, 规范化文本哈希) 索引：
+    * <cache_dir>/<model>.npy     float32 矩阵 (N, D)，可内存映射，只在末尾追加行
+    * <cache_dir>/<model>.index   每行一个文本哈希，行号即矩阵行号，只追加写
+
+.npy 头部预留固定长度，追加时原地改写 shape，不搬动已有数据。
+索引文件是权威记录：进程在写完向量、写索引之前崩溃，多出的行会在下次追加时被覆盖。
+
+用法：
+    from embedding_cache import encode_cached
+    emb = encode_cached(texts, model_name, normalize=True)   # 只编码缓存里没有的文本
+"""
+
+import fcntl
+import hashlib
+import os
+import re
+import struct
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from model_server import EMBED_MODEL_NAME, embed
+
+# ===== 配置区 =====
+CACHE_DIR  = Path(os.getenv("BIGFIVE_EMBED_CACHE", Path(__file__).resolve().parent / "embedding_cache"))
+HEADER_LEN = 256                       # .npy 头部总长（含 magic），预留给不断变大的 shape
+
+
+def text_key(text: str) -> str:
+    """规范化文本（NFKC + 去首尾空白）后的 sha1"""
+    norm = unicodedata.normalize("NFKC", text).strip()
+    return hashlib.sha1(norm.encode("utf-8")).hexdigest()
+
+
+def _write_header(f, rows: int, dim: int):
+    """写入固定长度的 .npy v1.0 头部"""
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dim)
+    header = header.ljust(HEADER_LEN - 10 - 1) + "\n"
+    f.seek(0)
+    f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+
+class EmbeddingStore:
+    """单个模型的向量缓存"""
+
+    def __init__(self, model_name: str, cache_dir: Path = CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^\w.-]+", "_", model_name)
+        self.npy_path = self.cache_dir / f"{slug}.npy"
+        self.index_path = self.cache_dir / f"{slug}.index"
+        self.keys: dict[str, int] = {}
+        self._reload()
+
+    def _reload(self):
+        self.keys = {}
+        if self.index_path.exists():
+            for row, line in enumerate(self.index_path.read_text("ascii").splitlines()):
+                self.keys[line] = row
+
+    def matrix(self) -> np.ndarray | None:
+        """只读内存映射，行数以索引为准"""
+        if not self.npy_path.exists() or not self.keys:
+            return None
+        return np.load(self.npy_path, mmap_mode="r")[:len(self.keys)]
+
+    def missing(self, texts: list[str]) -> list[str]:
+        """返回缓存中没有的文本（保序去重）"""
+        seen, out = set(), []
+        for t in texts:
+            k = text_key(t)
+            if k not in self.keys and k not in seen:
+                seen.add(k)
+                out.append(t)
+        return out
+
+    def get(self, texts: list[str]) -> np.ndarray:
+        rows = [self.keys[text_key(t)] for t in texts]
+        mat = self.matrix()
+        if mat is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.asarray(mat[rows], dtype=np.float32)
+
+    def append(self, texts: list[str], vectors: np.ndarray):
+        """追加新向量；持文件锁，允许多个进程共用同一缓存"""
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        with open(self.index_path, "a+", encoding="ascii") as idx:
+            fcntl.flock(idx, fcntl.LOCK_EX)
+            try:
+                self._reload()                    # 其他进程可能已经追加过
+                todo = [(text_key(t), v) for t, v in zip(texts, vectors)]
+                todo = list({k: v for k, v in todo if k not in self.keys}.items())
+                if not todo:
+                    return
+                dim = vectors.shape[1]
+                rows = len(self.keys)
+                mode = "r+b" if self.npy_path.exists() else "w+b"
+                with open(self.npy_path, mode) as f:
+                    f.seek(HEADER_LEN + rows * dim * 4)
+                    f.write(np.stack([v for _, v in todo]).tobytes())
+                    f.truncate()
+                    _write_header(f, rows + len(todo), dim)
+                    f.flush()
+                    os.fsync(f.fileno())
+                idx.seek(0, os.SEEK_END)
+                idx.write("".join(k + "\n" for k, _ in todo))
+                idx.flush()
+                for i, (k, _) in enumerate(todo):
+                    self.keys[k] = rows + i
+            finally:
+                fcntl.flock(idx, fcntl.LOCK_UN)
+
+
+def encode_cached(texts: list[str], model_name: str = EMBED_MODEL_NAME, batch_size: int = 512,
+                  normalize: bool = False, show_progress: bool = False,
+                  cache_dir: Path = CACHE_DIR) -> np.ndarray:
+    """
+    带磁盘缓存的句向量编码，只把缓存缺失的文本交给编码器。
+    缓存中保存未归一化的向量，normalize=True 时在读出后做 L2 归一化。
+    """
+    store = EmbeddingStore(model_name, cache_dir)
+    missing = store.missing(texts)
+    n_unique = len({text_key(t) for t in texts})
+    logger.info(f"向量缓存命中 {n_unique - len(missing)}/{n_unique}，需编码 {len(missing)} 条")
+    if missing:
+        store.append(missing, embed(missing, model_name, batch_size=batch_size,
+                                    show_progress=show_progress))
+    emb = store.get(texts)
+    if normalize and len(emb):
+        emb /= np.linalg.norm(emb, axis=1, keepdims=True).clip(min=1e-12)
+    return emb
@@ -3,6 +3,7 @@ from collections import defaultdict
 from tqdm import tqdm
 from loguru import logger
 import re
+from tracing import span
 
 OUTPUT_PATH = "bigfive_story.json"  # 输出文件路径
 SYSTEM_PROMPT = """
@@ -46,7 +47,7 @@ USER_PROMPT = [
 import os
 API_KEY = os.getenv("DASHSCOPE_API_KEY")
 K = 10  # 保留关键词数
-API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+API_URL = os.getenv("LLM_API_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions")
 MODEL = "qwen-turbo"
 HEADERS = {
     "Content-Type": "application/json",
@@ -87,23 +88,26 @@ def call_deepseek(payload: list[dict]) -> dict:
     }
     for i in range(5):
         try:
-            resp = requests.post(API_URL, headers=HEADERS, data=json.dumps(payload))
+            with span("network"):
+                resp = requests.post(API_URL, headers=HEADERS, data=json.dumps(payload))
             resp.raise_for_status()
             resp = resp.json()
             result = resp["choices"][0]["message"]["content"]
-            result_list = pharse_json(result)
+            with span("parse"):
+                result_list = pharse_json(result)
             if not result_list:
                 logger.error(f"解析结果失败: {result}")
                 continue
+            return result_list
         except requests.exceptions.HTTPError as e:
             logger.error(f"请求失败: {e}, 重试 {i+1}/5")
-    return result_list
+    raise RuntimeError("重试 5 次仍未得到有效记忆")
 
 
 def save_incremental(data_so_far: list[dict]):
     """把当前进度写入 OUTPUT_PATH。每次覆盖写，防止进程崩溃时丢失全部成果。"""
     try:
-        with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+        with span("save_result"), open(OUTPUT_PATH, "w", encoding="utf-8") as f:
             json.dump(data_so_far, f, ensure_ascii=False, indent=2)
         logger.debug("已增量写入当前进度 …")
     except OSError as e:
@@ -111,7 +115,7 @@ def save_incremental(data_so_far: list[dict]):
 
 
 if __name__ == "__main__":
-    with open("bigfive_prompt_payload.json") as f:   # 你的那份原始列表
+    with span("load_json"), open("bigfive_prompt_payload.json") as f:   # 你的那份原始列表
         data = json.load(f)
 
     valid_kw = []
@@ -136,9 +140,13 @@ if __name__ == "__main__":
 
             payload = generate_payload(theme, token, n)
             try:
-                response = call_deepseek(payload)
+                with span("call_llm", user=entry["user"], token=token):
+                    response = call_deepseek(payload)
             except Exception as e:
-                logger.error(f"调用 DeepSeek 失败: {e}")
+                logger.error(f"调用 DeepSeek 失败，跳过关键词 {token}: {e}")
+                kw["memories"] = []
+                save_incremental(valid_kw)
+                continue
             logger.info(f"用户 {entry['user']} 的 {theme}, {token} 生成的描述：{response}")
             kw["memories"] = response
             save_incremental(valid_kw)
@@ -35,7 +35,7 @@ USER_PROMPT = ["""请根据下面按主题关键词组合，为「我」生成
 import os
 API_KEY = os.getenv("DASHSCOPE_API_KEY")
 K = 10  # 保留关键词数
-API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+API_URL = os.getenv("LLM_API_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions")
 MODEL = "qwen-turbo"
 HEADERS = {
     "Content-Type": "application/json",
@@ -6,15 +6,19 @@ from loguru import logger
 from tqdm import tqdm
 import random
 import os
+from hedging import HedgedCaller
+from subject_registry import normalize_uid
+from tracing import span
 
 # ============ 配置区 ============
-API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+API_URL = os.getenv("LLM_API_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions")
 MODEL = "qwen-turbo"
 API_KEY = os.getenv("DASHSCOPE_API_KEY")
 HEADERS = {"Content-Type": "application/json", "Authorization": f"Bearer {API_KEY}"}
 
 SOURCE_FILE = "bigfive_story.json"    # 上一步增量生成的文件
 OUTPUT_JSON = Path("stories.json")  # 故事输出文件
+HEDGER = HedgedCaller(timeout_floor=60, timeout_cap=300, hedge_pct=0.05)   # 长文本生成，超时上限沿用 300s
 
 # =================================
 
@@ -65,29 +69,38 @@ def call_llm(messages: List[Dict]) -> str:
         "temperature": 0.7,
         "enable_thinking": False
     }
-    resp = requests.post(API_URL, headers=HEADERS, data=json.dumps(payload), timeout=300)
-    resp.raise_for_status()
-    return resp.json()["choices"][0]["message"]["content"]
+
+    def post(timeout: float, attempt) -> str:
+        with span("network", hedge=attempt.is_hedge):
+            resp = requests.post(API_URL, headers=attempt.tag(HEADERS), data=json.dumps(payload), timeout=timeout)
+        resp.raise_for_status()
+        return resp.json()["choices"][0]["message"]["content"]
+
+    return HEDGER.call(post)
 
 
 def load_stories() -> List[Dict]:
     if OUTPUT_JSON.exists():
-        return json.loads(OUTPUT_JSON.read_text(encoding="utf-8"))
+        with span("load_json", file=str(OUTPUT_JSON)):
+            return json.loads(OUTPUT_JSON.read_text(encoding="utf-8"))
     return []
 
 
 def save_stories(stories: List[Dict]):
-    OUTPUT_JSON.write_text(json.dumps(stories, ensure_ascii=False, indent=2), encoding="utf-8")
+    with span("save_result"):
+        OUTPUT_JSON.write_text(json.dumps(stories, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
 def story_already_done(stories: List[Dict], uid: str | int) -> bool:
-    return any(s["uid"] == str(uid) or s["uid"] == uid for s in stories)
+    uid = normalize_uid(uid)
+    return any(normalize_uid(s["uid"]) == uid for s in stories)
 
 
 # ---------- 主流程 ----------
 
 def main():
-    raw_data = json.loads(Path(SOURCE_FILE).read_text(encoding="utf-8"))
+    with span("load_json", file=SOURCE_FILE):
+        raw_data = json.loads(Path(SOURCE_FILE).read_text(encoding="utf-8"))
     stories = load_stories()
 
     for user in tqdm(raw_data, desc="Writing stories"):
@@ -96,9 +109,11 @@ def main():
             continue
 
         try:
-            memories_sorted = sort_memories(user["keywords"])
-            messages = build_messages(memories_sorted)
-            story_text = call_llm(messages)
+            with span("build_prompts", user=user["uid"]):
+                memories_sorted = sort_memories(user["keywords"])
+                messages = build_messages(memories_sorted)
+            with span("call_llm", user=user["uid"]):
+                story_text = call_llm(messages)
 
             record = {
                 "uid": user["uid"],
@@ -111,6 +126,7 @@ def main():
         except Exception as e:
             logger.error(f"用户 {user['uid']} 生成失败: {e}")
 
+    HEDGER.log_summary()
     logger.info("全部处理完毕！")
 
 
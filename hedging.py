@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+hedging.py
+------------------------------------------
+带截止时间与对冲请求的 API 调用，压低长尾延迟：
+
+    * 每次调用的超时 = clamp(p99 × 倍数, 下限, 上限)，样本不足时用上限；
+    * 请求超过 p95 仍未返回时，再发一个相同的对冲请求，先返回者胜出；
+    * 对冲请求总数不超过调用数的 hedge_pct，避免放大流量；
+    * 主请求与对冲从同一个信号量取并发槽位；一方胜出后，还没拿到槽位的另一方不再发出，
+      已发出的另一方无法中断，会占着槽位（与 hedge 线程）直到返回或超时，结果丢弃。
+
+用法：
+    HEDGER = HedgedCaller()
+
+    def post(timeout, attempt):
+        with attempt.slot(SEMAPHORE):                  # 主请求与对冲共用同一并发预算
+            resp = requests.post(url, json=payload, headers=attempt.tag(headers), timeout=timeout)
+            resp.raise_for_status()
+        return resp.json()
+
+    text = HEDGER.call(post)
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from loguru import logger
+
+from tracing import span
+
+HEDGE_HEADER = "X-Hedge"                   # 对冲请求带此请求头，便于服务端（bench/mock_llm_server.py）区分对冲与重试
+
+
+class LatencyTracker:
+    """线程安全的滑动窗口延迟统计（只记录成功请求）"""
+
+    def __init__(self, window: int = 500, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            data = sorted(self.samples)
+        return data[min(len(data) - 1, int(len(data) * p / 100))]
+
+
+class Attempt:
+    """
+    一次请求（主请求或对冲）的句柄，同一次调用的两个 Attempt 共享 done 标记。
+    已发出的 HTTP 请求无法从其他线程中断（requests 阻塞在读响应时不响应 Session.close），所以落败方：
+    还在等并发槽位的直接放弃、不再发出；已发出的照常等到返回或超时，期间一直占着槽位，
+    保证真实在途连接数不超过信号量上限。
+    """
+
+    def __init__(self, is_hedge: bool, done: threading.Event):
+        self.is_hedge = is_hedge
+        self.done = done
+
+    def tag(self, headers: dict) -> dict:
+        """对冲请求在请求头上加 X-Hedge 标记，主请求原样返回"""
+        return {**headers, HEDGE_HEADER: "1"} if self.is_hedge else headers
+
+    @contextmanager
+    def slot(self, sem: threading.Semaphore):
+        """
+        在 sem 的一个槽位内执行请求；拿到槽位时另一方已成功则归还并抛 CancelledError。
+        正常退出时先置 done 再归还槽位，等待中的另一方拿到槽位后一定能看到。
+        """
+        with span("semaphore_wait"):
+            sem.acquire()
+        try:
+            if self.done.is_set():
+                raise CancelledError("另一方已返回，不再发出该请求")
+            yield
+            self.done.set()
+        finally:
+            sem.release()
+
+
+class HedgedCaller:
+    """按观测到的延迟分位数设置超时并发起对冲请求"""
+
+    def __init__(self, timeout_floor: float = 15, timeout_cap: float = 300, timeout_mult: float = 3.0,
+                 hedge_quantile: float = 95, hedge_pct: float = 0.05, max_workers: int = 32):
+        self.tracker = LatencyTracker()
+        self.timeout_floor, self.timeout_cap, self.timeout_mult = timeout_floor, timeout_cap, timeout_mult
+        self.hedge_quantile, self.hedge_pct = hedge_quantile, hedge_pct
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.lock = threading.Lock()
+        self.calls = self.hedges = self.hedge_wins = 0
+
+    def timeout(self) -> float:
+        p99 = self.tracker.percentile(99)
+        if p99 is None:
+            return self.timeout_cap
+        return min(self.timeout_cap, max(self.timeout_floor, p99 * self.timeout_mult))
+
+    def _take_hedge_budget(self) -> bool:
+        with self.lock:
+            if self.hedges + 1 > self.hedge_pct * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def _timed(self, fn, timeout: float, attempt: Attempt):
+        t0 = time.perf_counter()
+        result = fn(timeout, attempt)
+        self.tracker.record(time.perf_counter() - t0)
+        return result
+
+    def call(self, fn):
+        """
+        :param fn: fn(timeout, attempt: Attempt) -> 结果；超时或失败应抛异常
+        :return: 先成功返回的结果；两个请求都失败时抛出最后一个异常
+
+        fn 在 hedge 线程里执行，其中的 span（network 等）记在 hedge 线程上；
+        调用方线程上的等待记为 hedge_wait，外层 span（如 ask_item）的自身耗时因此不含网络等待。
+        """
+        with span("hedge_wait"):
+            return self._call(fn)
+
+    def _call(self, fn):
+        with self.lock:
+            self.calls += 1
+        timeout = self.timeout()
+        finished = threading.Event()
+        primary = self.pool.submit(self._timed, fn, timeout, Attempt(False, finished))
+
+        delay = self.tracker.percentile(self.hedge_quantile)
+        if delay is None or wait([primary], timeout=delay).done or not self._take_hedge_budget():
+            return primary.result()
+
+        hedge = self.pool.submit(self._timed, fn, timeout, Attempt(True, finished))
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if fut is hedge:
+                    with self.lock:
+                        self.hedge_wins += 1
+                finished.set()                # 还没发出的落败方不再发出
+                return result
+        raise error
+
+    def profile(self) -> dict:
+        """当前延迟画像（供 plan_run.py 估算墙钟时间）"""
+        with self.tracker.lock:
+            samples = list(self.tracker.samples)
+        p50, p95, p99 = (self.tracker.percentile(p) for p in (50, 95, 99))
+        return {"calls": self.calls, "hedges": self.hedges, "samples": len(samples),
+                "mean_s": sum(samples) / len(samples) if samples else None,
+                "p50_s": p50, "p95_s": p95, "p99_s": p99}
+
+    def summary(self) -> str:
+        p50, p95, p99 = (self.tracker.percentile(p) for p in (50, 95, 99))
+        fmt = lambda x: f"{x:.2f}s" if x is not None else "n/a"
+        return (f"调用 {self.calls} 次，对冲 {self.hedges} 次（胜出 {self.hedge_wins}），"
+                f"延迟 p50={fmt(p50)} p95={fmt(p95)} p99={fmt(p99)}，当前超时 {self.timeout():.1f}s")
+
+    def log_summary(self):
+        logger.info(self.summary())
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+job_queue.py
+------------------------------------------
+多进程 / 多机分片跑问卷的任务队列（SQLite）。任务粒度为 (配置, 用户, repeat, 题号)：
+
+    enqueue   按 cbfpib_completion.py 的参数渲染一次运行的全部请求并入队（重复入队不会产生重复任务）
+    work      领取任务（带租约）→ 调用接口 → 写回结果；可在任意多台机器上同时启动
+    requeue   把租约过期的任务放回队列（work 领取时也会自动接管过期租约），--failed 重置失败任务
+    merge     把已全部完成的用户组装成 results/bigfive_result_*.json
+    status    各配置的任务状态统计
+
+    python job_queue.py enqueue --model qwen-turbo --data-type memory --repeat 5 --cot
+    python job_queue.py work --workers 4            # 每台机器各起一个或多个
+    python job_queue.py merge
+
+数据库默认 jobs.sqlite，使用 WAL 模式；WAL 依赖共享内存，只适用于同一台机器上的多个进程。
+跨机器放在 NFS 等网络存储上时请加 --journal delete（回退到回滚日志 + 文件锁）。
+写回结果时校验租约持有者，过期后被别人接管的任务不会被旧 worker 覆盖。
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from loguru import logger
+from tqdm import tqdm
+
+import cbfpib_completion as cb
+
+# ===== 配置区 =====
+DB_PATH       = Path("jobs.sqlite")
+LEASE_SECONDS = 600             # 租约时长，超过即视为 worker 已失联
+CLAIM_BATCH   = 1               # 每次领取的任务数（调大可减少写锁竞争，但要保证处理完一批不超过租约）
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    config   TEXT PRIMARY KEY,
+    outfile  TEXT NOT NULL,
+    args     TEXT NOT NULL,
+    users    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id            INTEGER PRIMARY KEY,
+    config        TEXT NOT NULL,
+    uid           TEXT NOT NULL,
+    rep           INTEGER NOT NULL,
+    qid           TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    status        TEXT NOT NULL DEFAULT 'pending',      -- pending / leased / done / failed
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    not_before    REAL NOT NULL DEFAULT 0,
+    lease_owner   TEXT,
+    lease_expires REAL,
+    answer        INTEGER,
+    response      TEXT,
+    error         TEXT,
+    UNIQUE (config, uid, rep, qid)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_claim ON tasks (status, not_before, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_config ON tasks (config, uid);
+"""
+
+# ----------------- 工具函数 -----------------
+
+
+def connect(db_path: Path, journal: str = "wal") -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    conn.execute(f"PRAGMA journal_mode={journal}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def claim(conn: sqlite3.Connection, owner: str, n: int, lease: float) -> list[tuple]:
+    """领取至多 n 个任务（待处理，或租约已过期），返回 [(id, payload, attempts)]"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT id, payload, attempts FROM tasks "
+            "WHERE (status = 'pending' AND not_before <= ?) OR (status = 'leased' AND lease_expires < ?) "
+            "ORDER BY id LIMIT ?", (now, now, n)).fetchall()
+        conn.executemany(
+            "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+            [(owner, now + lease, r[0]) for r in rows])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rows
+
+
+def complete(conn: sqlite3.Connection, task_id: int, owner: str, answer: int, response: str) -> bool:
+    cur = conn.execute(
+        "UPDATE tasks SET status = 'done', answer = ?, response = ?, error = NULL, lease_owner = NULL "
+        "WHERE id = ? AND lease_owner = ? AND status = 'leased'", (answer, response, task_id, owner))
+    return cur.rowcount == 1
+
+
+def fail(conn: sqlite3.Connection, task_id: int, owner: str, attempts: int, error: str, delay: float | None):
+    """记录一次失败；delay 为 None（不再重试）或次数用尽时置为 failed"""
+    status = "failed" if attempts >= cb.MAX_RETRY or delay is None else "pending"
+    conn.execute(
+        "UPDATE tasks SET status = ?, error = ?, not_before = ?, lease_owner = NULL "
+        "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+        (status, error[:2000], time.time() + (delay or 0), task_id, owner))
+
+
+def open_count(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+
+# ----------------- 子命令 -----------------
+def enqueue(args):
+    outfile = cb.setup_run(args)
+    config = outfile.stem
+    data = cb.load_personas(args)
+    done = {entry["user"] for entry in cb.load_output(outfile)}
+    data = [entry for entry in data if entry["user"] not in done]
+    questions = json.loads(Path(cb.CBFPIB).read_text(encoding="utf-8"))
+    if cb.retrieval_k:
+        cb.build_retrieval_index(data, questions)
+
+    conn = connect(args.db, args.journal)
+    run_args = {k: v for k, v in vars(args).items() if k not in ("cmd", "db", "journal")}
+    users = [{"user": e["user"], "uid": e["uid"]} for e in data]
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("INSERT OR REPLACE INTO configs (config, outfile, args, users) VALUES (?, ?, ?, ?)",
+                 (config, str(outfile), json.dumps(run_args, ensure_ascii=False), json.dumps(users, ensure_ascii=False)))
+    before = conn.total_changes
+    for entry in tqdm(data, desc="Enqueue users"):
+        tasks, _ = cb.build_user_tasks(entry, questions, args.seed)
+        conn.executemany(
+            "INSERT OR IGNORE INTO tasks (config, uid, rep, qid, payload) VALUES (?, ?, ?, ?, ?)",
+            [(config, str(entry["uid"]), rep, str(qid), json.dumps(cb.build_payload(messages), ensure_ascii=False))
+             for (rep, qid), messages in tasks.items()])
+    added = conn.total_changes - before
+    conn.execute("COMMIT")
+    logger.success(f"{config}：{len(data)} 个用户（已完成 {len(done)} 个跳过），新增任务 {added} 条 → {args.db}")
+
+
+def work_loop(args, stats: dict, lock: threading.Lock):
+    conn = connect(args.db, args.journal)
+    owner = worker_id()
+    while True:
+        rows = claim(conn, owner, args.claim, args.lease)
+        if not rows:
+            if not args.forever and open_count(conn) == 0:
+                return
+            time.sleep(args.poll)
+            continue
+        for task_id, payload, attempts in rows:
+            try:
+                response = cb.post_payload(json.loads(payload))
+                answer = cb.parse_answer(response)
+            except Exception as e:                   # 单条任务出错只记失败，不让 worker 线程退出
+                logger.warning(f"任务 {task_id} 第 {attempts + 1} 次失败：{type(e).__name__}: {e}")
+                fail(conn, task_id, owner, attempts + 1, str(e), cb.retry_backoff(e, attempts + 1))
+                with lock:
+                    stats["failed"] += 1
+                continue
+            ok = complete(conn, task_id, owner, answer, response)
+            with lock:
+                stats["done" if ok else "lost_lease"] += 1
+
+
+def work(args):
+    stats, lock = {"done": 0, "failed": 0, "lost_lease": 0}, threading.Lock()
+    threads = [threading.Thread(target=work_loop, args=(args, stats, lock), daemon=True) for _ in range(args.workers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    cb.HEDGER.log_summary()
+    logger.success(f"worker 退出：完成 {stats['done']} 条，失败 {stats['failed']} 次，租约丢失 {stats['lost_lease']} 条，"
+                   f"{stats['done'] / max(elapsed, 1e-9):.2f} 条/s")
+
+
+def requeue(args):
+    conn = connect(args.db, args.journal)
+    n = conn.execute("UPDATE tasks SET status = 'pending', lease_owner = NULL "
+                     "WHERE status = 'leased' AND lease_expires < ?", (time.time(),)).rowcount
+    logger.info(f"过期租约放回队列 {n} 条")
+    if args.failed:
+        n = conn.execute("UPDATE tasks SET status = 'pending', attempts = 0, not_before = 0 WHERE status = 'failed'").rowcount
+        logger.info(f"失败任务重置 {n} 条")
+
+
+def merge(args):
+    conn = connect(args.db, args.journal)
+    configs = conn.execute("SELECT config, outfile, args, users FROM configs").fetchall()
+    questions = json.loads(Path(cb.CBFPIB).read_text(encoding="utf-8"))
+    for config, outfile, run_args, users in configs:
+        if args.config and config not in args.config:
+            continue
+        run_args = argparse.Namespace(**json.loads(run_args))
+        cb.setup_run(run_args)
+        answers = {}
+        for uid, rep, qid, answer, response in conn.execute(
+                "SELECT uid, rep, qid, answer, response FROM tasks WHERE config = ? AND status = 'done'", (config,)):
+            answers.setdefault(uid, {})[(rep, qid)] = (answer, response)
+
+        outfile = Path(outfile)
+        output_data = cb.load_output(outfile)
+        done = {entry["user"] for entry in output_data}
+        n_tasks = run_args.repeat * len(questions)
+        added = pending = 0
+        for entry in json.loads(users):
+            if entry["user"] in done:
+                continue
+            got = answers.get(str(entry["uid"]), {})
+            if len(got) < n_tasks:
+                pending += 1
+                continue
+            by_id = {(rep, q["id"]): got[(rep, str(q["id"]))] for rep in range(run_args.repeat) for q in questions}
+            output_data.append(cb.assemble_result(entry, questions, by_id))
+            added += 1
+        if added:
+            cb.save_result(output_data, outfile)
+        logger.success(f"{config}：新合并 {added} 个用户，未完成 {pending} 个 → {outfile}")
+
+
+def status(args):
+    conn = connect(args.db, args.journal)
+    rows = conn.execute("SELECT config, status, COUNT(*), SUM(attempts) FROM tasks GROUP BY config, status ORDER BY config").fetchall()
+    for config, st, n, attempts in rows:
+        print(f"{config:<60s} {st:<8s} {n:>8d}  attempts={attempts}")
+
+
+# ----------------- 主入口 -----------------
+def main():
+    parser = argparse.ArgumentParser(description="问卷任务队列（SQLite）")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help="队列数据库路径")
+    parser.add_argument("--journal", default="wal", choices=["wal", "delete"], help="日志模式，网络存储请用 delete")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    cb.add_run_args(sub.add_parser("enqueue", help="渲染一次运行的全部任务并入队"))
+
+    p_work = sub.add_parser("work", help="领取并执行任务")
+    p_work.add_argument("--workers", type=int, default=cb.MAX_WORKERS, help="本进程的工作线程数")
+    p_work.add_argument("--claim", type=int, default=CLAIM_BATCH, help="每次领取的任务数")
+    p_work.add_argument("--lease", type=float, default=LEASE_SECONDS, help="租约时长（秒）")
+    p_work.add_argument("--poll", type=float, default=5, help="暂时无任务可领时的等待间隔（秒）")
+    p_work.add_argument("--forever", action="store_true", help="队列清空后继续等待新任务")
+
+    p_requeue = sub.add_parser("requeue", help="回收过期租约")
+    p_requeue.add_argument("--failed", action="store_true", help="同时重置已判定失败的任务")
+
+    p_merge = sub.add_parser("merge", help="组装结果文件")
+    p_merge.add_argument("--config", nargs="*", default=None, help="只合并指定配置（结果文件名去掉 .json）")
+
+    sub.add_parser("status", help="任务状态统计")
+
+    args = parser.parse_args()
+    {"enqueue": enqueue, "work": work, "requeue": requeue, "merge": merge, "status": status}[args.cmd](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,142 @@
+import argparse
 import json
+import multiprocessing as mp
 import re
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from loguru import logger
-from sentence_transformers import SentenceTransformer
 from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from threadpoolctl import threadpool_limits
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from embedding_cache import encode_cached   # 只编码缓存中没有的词
 
 # ---------------- 参数 ----------------
 DATA       = Path("keywords_副本.json")
 MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
 THRESHOLD  = 0.30             # 距离阈值：余弦相似 ≥ 0.70
 OUT_FILE   = Path("clusters.json")
+SWEEP_FILE = Path("k_sweep.csv")
+
+_emb, _sub_idx, _n_init = None, None, 20   # fit_k 使用的数据：主进程直接设置，工作进程由 _init_worker 设置
+
+
+def _set_data(emb: np.ndarray, sub_idx: np.ndarray, n_init: int):
+    global _emb, _sub_idx, _n_init
+    _emb, _sub_idx, _n_init = emb, sub_idx, n_init
+
+
+def _init_worker(emb_path: str, sub_idx: np.ndarray, n_init: int):
+    """进程池 initializer：以只读内存映射打开句向量，各进程共享页缓存，不经 pickle 复制"""
+    _set_data(np.load(emb_path, mmap_mode="r"), sub_idx, n_init)
+
+
+def fit_k(k: int) -> dict:
+    """拟合一个 k，返回抽样轮廓系数、抽样 inertia 与全量标签"""
+    with threadpool_limits(1):      # 进程级并行，避免 BLAS 线程超卖
+        kmeans = MiniBatchKMeans(
+            n_clusters=k,
+            init="k-means++",
+            batch_size=2048,
+            max_iter=300,
+            n_init=_n_init,         # 多次初始化挑最优
+            random_state=42
+        ).fit(_emb)
+        sub = np.asarray(_emb[_sub_idx])
+        sub_labels = kmeans.predict(sub)
+        silhouette = silhouette_score(sub, sub_labels) if len(set(sub_labels.tolist())) > 1 else -1.0
+        inertia = -kmeans.score(sub)
+    return {"k": k, "silhouette": float(silhouette), "inertia": float(inertia),
+            "labels": kmeans.labels_.astype(np.int32)}
+
+
+def sweep(emb: np.ndarray, sub_idx: np.ndarray, ks: list[int], n_init: int, workers: int | None) -> list[dict]:
+    """
+    并行扫描 k。进程池用 forkserver（不可用时 spawn）：本进程已加载句向量模型、起了 torch / BLAS 线程，
+    fork 会把这些线程的锁状态带进子进程。句向量先落成 .npy，子进程通过 initializer 内存映射读取。
+    """
+    methods = mp.get_all_start_methods()
+    ctx = mp.get_context("forkserver" if "forkserver" in methods else "spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        emb_path = str(Path(tmp) / "emb.npy")
+        np.save(emb_path, emb)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=(emb_path, sub_idx, n_init)) as pool:
+            return list(pool.map(fit_k, ks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="关键词句向量 MiniBatchKMeans 聚类")
+    parser.add_argument("--k",       type=int, default=10, help="固定簇数（不做扫描时使用）")
+    parser.add_argument("--sweep",   type=int, nargs=2, metavar=("K_MIN", "K_MAX"), default=None,
+                        help="在 [K_MIN, K_MAX] 内扫描 k，按抽样轮廓系数挑最优")
+    parser.add_argument("--k_step",  type=int, default=1, help="扫描步长")
+    parser.add_argument("--n_init",  type=int, default=20, help="每个 k 的初始化次数")
+    parser.add_argument("--sample",  type=int, default=5000, help="轮廓系数 / inertia 的固定抽样数")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数，默认 CPU 核数")
+    args = parser.parse_args()
+
+    # ---------------- 日志 ----------------
+    logger.add("cluster.log",
+               rotation="10 MB",
+               retention="7 days",
+               compression="zip",
+               format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
+
+    # ---------------- 读文件 & 清洗 ----------------
+    words   = json.loads(DATA.read_text("utf-8"))
+    cleaned = sorted({w.strip() for w in words if w and isinstance(w, str) and w.strip()})
+
+    re_date = re.compile(r"\d{4}年|\d{1,2}[/-]\d{1,2}")
+    re_num  = re.compile(r"^\d+([.:kmKM]+)?$")
+
+    semantic_words = [w for w in cleaned
+                      if not (re_num.match(w) or re_date.search(w))]
+
+    logger.info(f"语义词数量: {len(semantic_words)}")
+
+    # ---------------- 向量化 ----------------
+    emb   = encode_cached(semantic_words, MODEL_NAME, show_progress=True)
+    logger.info(f"向量化完成: {emb.shape}")
+
+    # 固定抽样：所有 k 用同一批点打分，结果可比
+    rng     = np.random.default_rng(42)
+    sub_idx = np.sort(rng.choice(len(emb), size=min(args.sample, len(emb)), replace=False))
+
+    if args.sweep:
+        k_min, k_max = args.sweep
+        ks = list(range(k_min, k_max + 1, args.k_step))
+        logger.info(f"扫描 k ∈ {ks}，抽样 {len(sub_idx)} 点打分")
+        fits = sweep(emb, sub_idx, ks, args.n_init, args.workers)
+        for fit in fits:
+            logger.info(f"k={fit['k']:>3d}  silhouette={fit['silhouette']:.4f}  inertia={fit['inertia']:.2f}")
+        pd.DataFrame([{key: f[key] for key in ("k", "silhouette", "inertia")} for f in fits]) \
+            .to_csv(SWEEP_FILE, index=False, float_format="%.6f")
+        best = max(fits, key=lambda f: f["silhouette"])
+        logger.success(f"最优 k={best['k']}（silhouette={best['silhouette']:.4f}），扫描结果见 {SWEEP_FILE}")
+    else:
+        _set_data(emb, sub_idx, args.n_init)
+        best = fit_k(args.k)
+
+    k, labels = best["k"], best["labels"]
+
+    # ---------- 导出 ----------
+    clusters = {i: [] for i in range(k)}
+    for w, lb in zip(semantic_words, labels):
+        clusters[int(lb)].append(w)
+
+    OUT_FILE.write_text(
+        json.dumps({k: sorted(v) for k, v in clusters.items()},
+                   ensure_ascii=False, indent=2),
+        "utf-8")
+    print(f"✅ 已写入 {OUT_FILE.resolve()}")
+
 
-# ---------------- 日志 ----------------
-logger.add("cluster.log",
-           rotation="10 MB",
-           retention="7 days",
-           compression="zip",
-           format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
-
-# ---------------- 读文件 & 清洗 ----------------
-words   = json.loads(DATA.read_text("utf-8"))
-cleaned = {w.strip() for w in words if w and isinstance(w, str) and w.strip()}
-
-re_date = re.compile(r"\d{4}年|\d{1,2}[/-]\d{1,2}")
-re_num  = re.compile(r"^\d+([.:kmKM]+)?$")
-
-semantic_words = [w for w in cleaned
-                  if not (re_num.match(w) or re_date.search(w))]
-
-logger.info(f"语义词数量: {len(semantic_words)}")
-
-# ---------------- 向量化 ----------------
-model = SentenceTransformer(MODEL_NAME)
-emb   = model.encode(semantic_words, show_progress_bar=True).astype(np.float32)
-logger.info(f"向量化完成: {emb.shape}")
-
-k = 10   # 示例，实际可用 pyclustering.elbow_method 或 yellowbrick
-
-kmeans = MiniBatchKMeans(
-    n_clusters=k,
-    init="k-means++",
-    batch_size=2048,
-    max_iter=300,
-    n_init=20,          # 多次初始化挑最优
-    random_state=42
-)
-labels = kmeans.fit_predict(emb)
-
-# ---------- 导出 ----------
-clusters = {i: [] for i in range(10)}
-for w, lb in zip(words, labels):
-    clusters[int(lb)].append(w)
-
-OUT_FILE.write_text(
-    json.dumps({k: sorted(v) for k, v in clusters.items()},
-               ensure_ascii=False, indent=2),
-    "utf-8")
-print(f"✅ 已写入 {OUT_FILE.resolve()}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
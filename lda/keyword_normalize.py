@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+keyword_normalize.py
+------------------------------------------
+关键词规范化（Unicode NFKC、繁→简、大小写、空白折叠、词形化），面向几万条原始关键词：
+    1. 先对原始字符串去重，重复词只算一次；
+    2. 结果写入持久化缓存（原词 → 规范词），再次运行只处理新词；
+    3. OpenCC 对拼接后的整段文本做一次转换，而不是逐词调用；
+    4. 小写 / 空白折叠 / WordNet 词形化 分发到进程池（forkserver 启动，调用方须有 __main__ 保护）；
+每一步都打印耗时。
+"""
+
+import json
+import multiprocessing as mp
+import os
+import re
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+CACHE_VERSION  = 1                      # 规范化规则变化时递增，旧缓存自动作废
+POOL_MIN_ITEMS = 2000                   # 少于该数量不启动进程池
+
+_lemmatizer = None
+_re_space = re.compile(r"\s+")
+
+
+def _finish(token: str) -> str:
+    """OpenCC 之后的步骤：小写、去首尾空白、折叠空白、英文词形归一"""
+    global _lemmatizer
+    if _lemmatizer is None:
+        from nltk.stem import WordNetLemmatizer
+        _lemmatizer = WordNetLemmatizer()
+    token = token.lower().strip()
+    token = _re_space.sub(" ", token)       # 折叠多空格
+    return _lemmatizer.lemmatize(token)     # 英文词形归一
+
+
+def normalize(token: str, cc=None) -> str:
+    """单个关键词的规范化，与批量版本结果一致"""
+    if cc is None:
+        from opencc import OpenCC
+        cc = OpenCC("t2s")
+    token = unicodedata.normalize("NFKC", token)
+    token = cc.convert(token)               # 繁体→简体
+    return _finish(token)
+
+
+def _pool_context():
+    """
+    forkserver（不可用时 spawn）：调用方此前可能已加载 OpenCC / 句向量模型、起了 BLAS 线程，
+    fork 会把这些状态连同锁一起复制进子进程；子进程只需导入本模块。
+    调用方脚本须有 if __name__ == "__main__" 保护。
+    """
+    methods = mp.get_all_start_methods()
+    return mp.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _load_cache(path: Path) -> dict[str, str]:
+    if not path.exists():
+        return {}
+    data = json.loads(path.read_text("utf-8"))
+    if data.get("version") != CACHE_VERSION:
+        return {}
+    return data["map"]
+
+
+def _save_cache(path: Path, cache: dict[str, str]):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps({"version": CACHE_VERSION, "map": cache}, ensure_ascii=False), "utf-8")
+    os.replace(tmp, path)
+
+
+def normalize_keywords(keywords_raw: list[str], cache_path: Path | str = "normalize_cache.json",
+                       workers: int | None = None) -> list[str]:
+    """
+    批量规范化。
+
+    :param keywords_raw: 原始关键词（可含重复、空串）
+    :param cache_path: 持久化缓存文件
+    :param workers: 进程数，默认 CPU 核数
+    :return: 与非空原始关键词一一对应的规范词列表（未去重）
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    raw = [k for k in keywords_raw if k.strip()]
+    uniq = list(dict.fromkeys(raw))
+    cache_path = Path(cache_path)
+    cache = _load_cache(cache_path)
+    todo = [k for k in uniq if k not in cache]
+    timings["dedup + cache lookup"] = time.perf_counter() - t0
+    print(f"  unique raw: {len(uniq):,}, cached: {len(uniq) - len(todo):,}, to normalize: {len(todo):,}")
+
+    if todo:
+        t0 = time.perf_counter()
+        # 换行会被后续的空白折叠吞掉，先替换掉，拼接后按行切分不会错位
+        nfkc = [unicodedata.normalize("NFKC", k).replace("\r", " ").replace("\n", " ") for k in todo]
+        timings["NFKC"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        from opencc import OpenCC
+        cc = OpenCC("t2s")
+        converted = cc.convert("\n".join(nfkc)).split("\n")
+        if len(converted) != len(nfkc):         # 理论上不会发生，兜底逐条转换
+            converted = [cc.convert(k) for k in nfkc]
+        timings["OpenCC t2s (batched)"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(converted) >= POOL_MIN_ITEMS:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+                finished = list(pool.map(_finish, converted,
+                                         chunksize=max(1, len(converted) // (workers * 4))))
+        else:
+            finished = [_finish(k) for k in converted]
+        timings[f"lower/space/lemmatize ({workers} procs)"] = time.perf_counter() - t0
+
+        cache.update(zip(todo, finished))
+        t0 = time.perf_counter()
+        _save_cache(cache_path, cache)
+        timings["cache save"] = time.perf_counter() - t0
+
+    for step, sec in timings.items():
+        print(f"    {step:<36s} {sec:8.3f}s")
+    return [cache[k] for k in raw]
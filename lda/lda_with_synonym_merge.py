@@ -4,142 +4,159 @@
 lda_with_synonym_merge.py
 ------------------------------------------
 Step 0 : 读取原始关键词列表 (.json)
-Step 1 : 基础规范化（Unicode NFKC、繁→简、大小写、空白折叠、词形化）
-Step 2 : 句向量 + AgglomerativeClustering 做同义词/近义词归并
+Step 1 : 基础规范化（Unicode NFKC、繁→简、大小写、空白折叠、词形化；先去重、带缓存、多进程，见 keyword_normalize.py）
+Step 2 : 句向量 + 阈值近邻图 / 并查集 做同义词/近义词归并（synonym_merge.py）
+         --incremental 时只编码新词，按最近簇质心并入已有簇或新建簇
 Step 3 : Canonical Map 替换得到“规范词”序列
 Step 4 : CountVectorizer 构建词袋  ➜  Latent Dirichlet Allocation
 Step 5 : 输出
     - console：每个主题的 top-15 关键词
     - files  ：
         * canonical_map.json      原词 → 规范词
+        * cluster_state.npz       簇质心 / 成员数 / 规范词（增量模式使用）
         * lda_topics.json         {topic_i: [kw1, kw2, …]}
         * lda_doc_labels.csv      每行：原词, 规范词, topic_id
 """
 
-import argparse, json, re, unicodedata, csv
+import argparse, json, csv, sys
 from collections import defaultdict
 from pathlib import Path
 
 import numpy as np
 from tqdm import tqdm
-from opencc import OpenCC
-import nltk
-from nltk.stem import WordNetLemmatizer
-from sentence_transformers import SentenceTransformer
-from sklearn.cluster import AgglomerativeClustering
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.decomposition import LatentDirichletAllocation
 
-# ---------------------------- CLI 参数 ----------------------------
-parser = argparse.ArgumentParser()
-parser.add_argument("--input",     default="keywords_副本.json",
-                    help="原始关键词 JSON 列表文件")
-parser.add_argument("--n_topics",  type=int, default=5,
-                    help="LDA 主题数")
-parser.add_argument("--dist_th",   type=float, default=0.30,
-                    help="余弦距离阈值 (0.30 ≈ 相似度 ≥ 0.70)")
-parser.add_argument("--topn",      type=int, default=15,
-                    help="每个主题展示前 N 个关键词")
-args = parser.parse_args()
-
-print(f"▶︎ loading {args.input}")
-keywords_raw = json.loads(Path(args.input).read_text("utf-8"))
-print(f"  total keywords: {len(keywords_raw):,}")
-
-# ----------------------- 1. 基础规范化 ----------------------------
-lemmatizer = WordNetLemmatizer()
-cc = OpenCC("t2s")
-
-def normalize(token: str) -> str:
-    token = unicodedata.normalize("NFKC", token)
-    token = cc.convert(token)               # 繁体→简体
-    token = token.lower().strip()
-    token = re.sub(r"\s+", " ", token)      # 折叠多空格
-    token = lemmatizer.lemmatize(token)     # 英文词形归一
-    return token
-
-keywords_norm = [normalize(k) for k in keywords_raw if k.strip()]
-keywords_norm = list(dict.fromkeys(keywords_norm))  # 保序去重
-print(f"  after normalize & dedup: {len(keywords_norm):,}")
-
-# ----------------------- 2. 同义词聚合 ----------------------------
-print("▶︎ encoding sentence embeddings …")
-model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-emb = model.encode(
-    keywords_norm, batch_size=512,
-    show_progress_bar=True, normalize_embeddings=True
-)
-
-print("▶︎ agglomerative clustering …")
-cluster = AgglomerativeClustering(
-    n_clusters=None, linkage="average",
-    metric="cosine", distance_threshold=args.dist_th
-).fit(emb)
-
-cluster2words = defaultdict(list)
-for w, lab in zip(keywords_norm, cluster.labels_):
-    cluster2words[lab].append(w)
-
-def pick_canonical(ws):
-    # 最短优先，其次字典序
-    return sorted(ws, key=lambda s: (len(s), s))[0]
-
-canonical_map = {w: pick_canonical(cluster2words[lab])
-                 for lab, ws in cluster2words.items() for w in ws}
-print(f"  clusters found: {len(cluster2words):,}")
-
-# 保存映射
-Path("canonical_map.json").write_text(
-    json.dumps(canonical_map, ensure_ascii=False, indent=2), "utf-8"
-)
-
-# ----------------------- 3. 替换为规范词 ---------------------------
-keywords_canonical = [canonical_map[w] for w in keywords_norm]
-
-# ----------------------- 4. LDA 训练 ------------------------------
-print("▶︎ vectorizing with CountVectorizer …")
-vectorizer = CountVectorizer(
-    token_pattern=r'[\u4e00-\u9fa5]+|[a-z]+',      # 中英文 token
-    stop_words=None,                               # 如需停用词可自行添加
-    max_features=5000
-)
-X = vectorizer.fit_transform(keywords_canonical)
-
-print(f"▶︎ training LDA (n_topics={args.n_topics}) …")
-lda = LatentDirichletAllocation(
-    n_components=args.n_topics,
-    learning_method="online",
-    max_iter=20,
-    random_state=42
-).fit(X)
-
-vocab = vectorizer.get_feature_names_out()
-topic_keywords = defaultdict(list)
-
-print("\n========== LDA TOPICS ==========")
-for idx, comp in enumerate(lda.components_):
-    top_idx = comp.argsort()[-args.topn:][::-1]
-    words = [vocab[i] for i in top_idx]
-    topic_keywords[f"topic_{idx+1}"] = words
-    print(f"Topic {idx+1}: {', '.join(words)}")
-
-# -------------------- 5. 文档 → 主题 标签 -------------------------
-print("\n▶︎ assigning each keyword to its best-probability topic …")
-doc_topic = lda.transform(X).argmax(axis=1)
-
-# CSV：原词, 规范词, 主题号
-with open("lda_doc_labels.csv", "w", newline='', encoding="utf-8") as f:
-    writer = csv.writer(f)
-    writer.writerow(["raw_word", "canonical_word", "topic_id"])
-    for raw, canon, label in zip(keywords_norm, keywords_canonical, doc_topic):
-        writer.writerow([raw, canon, label+1])
-
-# JSON：{topic_i: [kw1, kw2, …]}
-Path("lda_topics.json").write_text(
-    json.dumps(topic_keywords, ensure_ascii=False, indent=2), "utf-8"
-)
-
-print("\n✅ Done.")
-print("  • canonical_map.json    归并映射")
-print("  • lda_topics.json       每个主题的 Top 关键词")
-print("  • lda_doc_labels.csv    每个词对应的主题标签")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from embedding_cache import encode_cached   # 只编码缓存中没有的词
+from keyword_normalize import normalize_keywords
+from synonym_merge import merge_synonyms, build_state, save_state, load_state, assign_incremental
+
+
+def main():
+    # ---------------------------- CLI 参数 ----------------------------
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input",     default="keywords_副本.json",
+                        help="原始关键词 JSON 列表文件")
+    parser.add_argument("--n_topics",  type=int, default=5,
+                        help="LDA 主题数")
+    parser.add_argument("--dist_th",   type=float, default=0.30,
+                        help="余弦距离阈值 (0.30 ≈ 相似度 ≥ 0.70)")
+    parser.add_argument("--block_size", type=int, default=1024,
+                        help="相似度分块大小，峰值内存约 block_size × 词数 × 4 字节")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量模式：读取已有 canonical_map 与簇状态，只处理新词")
+    parser.add_argument("--canonical_map", default="canonical_map.json",
+                        help="原词 → 规范词映射文件")
+    parser.add_argument("--state",     default="cluster_state.npz",
+                        help="簇状态文件（质心、成员数、规范词）")
+    parser.add_argument("--norm_cache", default="normalize_cache.json",
+                        help="规范化结果缓存文件（原词 → 规范词）")
+    parser.add_argument("--workers",   type=int, default=None,
+                        help="规范化进程数，默认 CPU 核数")
+    parser.add_argument("--topn",      type=int, default=15,
+                        help="每个主题展示前 N 个关键词")
+    args = parser.parse_args()
+
+    print(f"▶︎ loading {args.input}")
+    keywords_raw = json.loads(Path(args.input).read_text("utf-8"))
+    print(f"  total keywords: {len(keywords_raw):,}")
+
+    # ----------------------- 1. 基础规范化 ----------------------------
+    print("▶︎ normalizing keywords …")
+    keywords_norm = normalize_keywords(keywords_raw, cache_path=args.norm_cache,
+                                       workers=args.workers)
+    keywords_norm = list(dict.fromkeys(keywords_norm))  # 保序去重
+    print(f"  after normalize & dedup: {len(keywords_norm):,}")
+
+    # ----------------------- 2. 同义词聚合 ----------------------------
+    MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+    map_path, state_path = Path(args.canonical_map), Path(args.state)
+
+    if args.incremental and map_path.exists() and state_path.exists():
+        canonical_map = json.loads(map_path.read_text("utf-8"))
+        state = load_state(state_path)
+        unseen = [w for w in keywords_norm if w not in canonical_map]
+        print(f"▶︎ incremental update: {len(unseen):,} unseen of {len(keywords_norm):,} "
+              f"(existing clusters: {len(state['canonicals']):,})")
+        if unseen:
+            emb = encode_cached(unseen, MODEL_NAME, batch_size=512, show_progress=True, normalize=True)
+            new_map, state = assign_incremental(unseen, emb, state, args.dist_th,
+                                                block_size=args.block_size)
+            canonical_map.update(new_map)
+    else:
+        if args.incremental:
+            print(f"  {map_path} / {state_path} not found, falling back to full rebuild")
+        print("▶︎ encoding sentence embeddings …")
+        emb = encode_cached(
+            keywords_norm, MODEL_NAME, batch_size=512,
+            show_progress=True, normalize=True
+        )
+
+        print("▶︎ threshold graph + union-find merging …")
+        canonical_map, labels = merge_synonyms(keywords_norm, emb, args.dist_th,
+                                               block_size=args.block_size)
+        state = build_state(emb, labels, canonical_map, keywords_norm)
+    print(f"  clusters found: {len(state['canonicals']):,}")
+
+    # 保存映射与簇状态
+    map_path.write_text(
+        json.dumps(canonical_map, ensure_ascii=False, indent=2), "utf-8"
+    )
+    save_state(state_path, state)
+
+    # ----------------------- 3. 替换为规范词 ---------------------------
+    keywords_canonical = [canonical_map[w] for w in keywords_norm]
+
+    # ----------------------- 4. LDA 训练 ------------------------------
+    print("▶︎ vectorizing with CountVectorizer …")
+    vectorizer = CountVectorizer(
+        token_pattern=r'[\u4e00-\u9fa5]+|[a-z]+',      # 中英文 token
+        stop_words=None,                               # 如需停用词可自行添加
+        max_features=5000
+    )
+    X = vectorizer.fit_transform(keywords_canonical)
+
+    print(f"▶︎ training LDA (n_topics={args.n_topics}) …")
+    lda = LatentDirichletAllocation(
+        n_components=args.n_topics,
+        learning_method="online",
+        max_iter=20,
+        random_state=42
+    ).fit(X)
+
+    vocab = vectorizer.get_feature_names_out()
+    topic_keywords = defaultdict(list)
+
+    print("\n========== LDA TOPICS ==========")
+    for idx, comp in enumerate(lda.components_):
+        top_idx = comp.argsort()[-args.topn:][::-1]
+        words = [vocab[i] for i in top_idx]
+        topic_keywords[f"topic_{idx+1}"] = words
+        print(f"Topic {idx+1}: {', '.join(words)}")
+
+    # -------------------- 5. 文档 → 主题 标签 -------------------------
+    print("\n▶︎ assigning each keyword to its best-probability topic …")
+    doc_topic = lda.transform(X).argmax(axis=1)
+
+    # CSV：原词, 规范词, 主题号
+    with open("lda_doc_labels.csv", "w", newline='', encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["raw_word", "canonical_word", "topic_id"])
+        for raw, canon, label in zip(keywords_norm, keywords_canonical, doc_topic):
+            writer.writerow([raw, canon, label+1])
+
+    # JSON：{topic_i: [kw1, kw2, …]}
+    Path("lda_topics.json").write_text(
+        json.dumps(topic_keywords, ensure_ascii=False, indent=2), "utf-8"
+    )
+
+    print("\n✅ Done.")
+    print("  • canonical_map.json    归并映射")
+    print("  • lda_topics.json       每个主题的 Top 关键词")
+    print("  • lda_doc_labels.csv    每个词对应的主题标签")
+
+
+# 规范化的进程池用 forkserver 启动，子进程会重新导入本脚本，顶层代码必须放在 main 里
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+synonym_merge.py
+------------------------------------------
+基于阈值的同义词归并（替代 AgglomerativeClustering）：
+    1. 对 L2 归一化后的句向量做分块矩阵乘（每块 block×N），只保留余弦相似度 ≥ 1 - dist_th 的词对；
+    2. 词对边直接并入并查集，连通分量即一个同义词簇；
+    3. 每簇挑选规范词，得到 canonical_map。
+内存只与 block×N 成正比，不再需要 N×N 的距离矩阵。
+"""
+
+from collections import defaultdict
+
+import numpy as np
+from tqdm import tqdm
+
+
+class UnionFind:
+    """带路径压缩和按秩合并的并查集"""
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.rank = [0] * n
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:            # 路径压缩
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a: int, b: int) -> bool:
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return False
+        if self.rank[ra] < self.rank[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        if self.rank[ra] == self.rank[rb]:
+            self.rank[ra] += 1
+        return True
+
+    def labels(self) -> np.ndarray:
+        """返回 0..K-1 的紧凑簇标签"""
+        roots = [self.find(i) for i in range(len(self.parent))]
+        _, labels = np.unique(roots, return_inverse=True)
+        return labels
+
+
+def similar_pairs(emb: np.ndarray, sim_th: float, block_size: int = 1024):
+    """
+    分块计算上三角相似度，逐块产出 (rows, cols) 词对下标（rows < cols）。
+
+    :param emb: 已 L2 归一化的向量 (N, D)
+    :param sim_th: 余弦相似度阈值
+    :param block_size: 每块行数，峰值内存约 block_size × N × 4 字节
+    """
+    emb = np.asarray(emb, dtype=np.float32)
+    n = len(emb)
+    for start in tqdm(range(0, n, block_size), desc="similarity blocks"):
+        block = emb[start:start + block_size]
+        sims = block @ emb[start:].T               # 只和自身及之后的词比较
+        rows, cols = np.nonzero(sims >= sim_th)
+        keep = cols > rows                         # 去掉自身与块内下三角
+        yield rows[keep] + start, cols[keep] + start
+
+
+def pick_canonical(ws):
+    # 最短优先，其次字典序
+    return sorted(ws, key=lambda s: (len(s), s))[0]
+
+
+def merge_synonyms(words: list[str], emb: np.ndarray, dist_th: float,
+                   block_size: int = 1024) -> tuple[dict[str, str], np.ndarray]:
+    """
+    阈值图 + 并查集归并同义词。
+
+    :param words: 已规范化、去重的词表
+    :param emb: 对应的 L2 归一化向量 (N, D)
+    :param dist_th: 余弦距离阈值（距离 ≤ dist_th 视为同义）
+    :return: (canonical_map 原词→规范词, 每个词的簇标签)
+    """
+    uf = UnionFind(len(words))
+    n_pairs = 0
+    for rows, cols in similar_pairs(emb, 1.0 - dist_th, block_size):
+        n_pairs += len(rows)
+        for a, b in zip(rows.tolist(), cols.tolist()):
+            uf.union(a, b)
+    labels = uf.labels()
+
+    cluster2words = defaultdict(list)
+    for w, lab in zip(words, labels):
+        cluster2words[lab].append(w)
+    canonical_map = {w: pick_canonical(ws) for ws in cluster2words.values() for w in ws}
+    print(f"  similar pairs: {n_pairs:,}")
+    return canonical_map, labels
+
+
+# ----------------------- 增量归并：簇状态 -----------------------
+def build_state(emb: np.ndarray, labels: np.ndarray, canonical_map: dict[str, str],
+                words: list[str]) -> dict:
+    """
+    由全量归并结果构造簇状态：每簇的向量均值、成员数与规范词。
+    均值不归一化保存，增量更新时可按成员数精确合并。
+    """
+    emb = np.asarray(emb, dtype=np.float32)
+    k = int(labels.max()) + 1 if len(labels) else 0
+    sums = np.zeros((k, emb.shape[1]), dtype=np.float64)
+    np.add.at(sums, labels, emb)
+    counts = np.bincount(labels, minlength=k)
+    canonicals = [""] * k
+    for w, lab in zip(words, labels):
+        canonicals[lab] = canonical_map[w]
+    return {"means": (sums / counts[:, None]).astype(np.float32),
+            "counts": counts.astype(np.int64),
+            "canonicals": np.array(canonicals, dtype=object)}
+
+
+def save_state(path, state: dict):
+    np.savez(path, means=state["means"], counts=state["counts"],
+             canonicals=np.array(state["canonicals"], dtype=str))
+
+
+def load_state(path) -> dict:
+    with np.load(path) as f:
+        return {"means": f["means"], "counts": f["counts"],
+                "canonicals": f["canonicals"].astype(object)}
+
+
+def _nearest_centroid(emb: np.ndarray, means: np.ndarray, block_size: int):
+    """分块求每个新词最近的簇质心及其余弦相似度"""
+    if len(means) == 0:
+        return np.zeros(len(emb), dtype=np.int64), np.full(len(emb), -np.inf, dtype=np.float32)
+    cent = means / np.linalg.norm(means, axis=1, keepdims=True).clip(min=1e-12)
+    best_idx, best_sim = [], []
+    for start in range(0, len(emb), block_size):
+        sims = emb[start:start + block_size] @ cent.T
+        idx = sims.argmax(axis=1)
+        best_idx.append(idx)
+        best_sim.append(sims[np.arange(len(idx)), idx])
+    return np.concatenate(best_idx), np.concatenate(best_sim)
+
+
+def assign_incremental(words: list[str], emb: np.ndarray, state: dict, dist_th: float,
+                       block_size: int = 1024) -> tuple[dict[str, str], dict]:
+    """
+    把新词并入已有簇状态。
+
+    - 与最近簇质心的余弦距离 ≤ dist_th：并入该簇，沿用其规范词；
+    - 否则：在剩余新词内部做阈值归并，形成新簇。
+    :return: (新词的 canonical_map, 更新后的簇状态)
+    """
+    emb = np.asarray(emb, dtype=np.float32)
+    means = state["means"].astype(np.float64)
+    counts = state["counts"].copy()
+    canonicals = list(state["canonicals"])
+    new_map = {}
+    if not words:
+        return new_map, state
+
+    idx, sim = _nearest_centroid(emb, state["means"], block_size)
+    hit = sim >= 1.0 - dist_th
+    for i in np.nonzero(hit)[0].tolist():
+        c = int(idx[i])
+        means[c] = (means[c] * counts[c] + emb[i]) / (counts[c] + 1)
+        counts[c] += 1
+        new_map[words[i]] = canonicals[c]
+
+    rest = np.nonzero(~hit)[0]
+    if len(rest):
+        rest_words = [words[i] for i in rest.tolist()]
+        rest_map, rest_labels = merge_synonyms(rest_words, emb[rest], dist_th, block_size)
+        rest_state = build_state(emb[rest], rest_labels, rest_map, rest_words)
+        means = np.vstack([means, rest_state["means"]])
+        counts = np.concatenate([counts, rest_state["counts"]])
+        canonicals.extend(rest_state["canonicals"])
+        new_map.update(rest_map)
+
+    print(f"  joined existing clusters: {int(hit.sum()):,}, new clusters: "
+          f"{len(canonicals) - len(state['canonicals']):,}")
+    return new_map, {"means": means.astype(np.float32), "counts": counts,
+                     "canonicals": np.array(canonicals, dtype=object)}
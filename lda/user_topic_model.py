@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+user_topic_model.py
+------------------------------------------
+以「受试者」为文档的 LDA：每个用户的 主题/关键词 词频构成一篇文档，
+学到真正的 用户 × 主题 混合分布。
+
+train :
+    语料用 statistic.iter_array 增量解析（raw_decode 逐条读顶层数组），任何时候内存里只有一条用户记录
+    Pass 1  流式统计文档频率，确定词表（min_df / max_features）
+    Pass 2  按 minibatch 增量构建稀疏 用户×词 CSR 矩阵（只读一遍），之后每轮 epoch 直接从矩阵切行做
+            LatentDirichletAllocation.partial_fit（online 变分贝叶斯，E-step 多核并行），不再重复解析 JSON
+    输出    user_lda.joblib（模型 + 词表）、user_topics.json、lda_user_topics_top.json
+infer :
+    读取已保存模型，对新用户批量推断主题向量，无需重新训练
+
+示例：
+    python user_topic_model.py train --input ../人格特质50位受试者原始数据.json --n_topics 8
+    python user_topic_model.py infer --input new_users.json --output new_user_topics.json
+"""
+
+import argparse
+import json
+import sys
+from collections import Counter
+from pathlib import Path
+
+import joblib
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.decomposition import LatentDirichletAllocation
+from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from statistic import iter_array   # raw_decode 增量读取顶层 JSON 数组
+
+
+def iter_users(path: Path):
+    """逐个产出 (用户名, 主题块列表)；增量解析顶层数组，不把整个语料读进内存"""
+    for user_obj in iter_array(path):
+        yield user_obj["name"], user_obj.get("data") or []
+
+
+def user_terms(blocks: list[dict], term_mode: str, canonical_map: dict[str, str] | None) -> Counter:
+    """把一个用户的主题块展开成 词→频次；term_mode=theme_keyword 时词带主题前缀"""
+    counts = Counter()
+    for block in blocks:
+        theme = block["theme"]
+        for token, freq in (block.get("keywords") or {}).items():
+            token = token.strip()
+            if not token or not freq:
+                continue
+            if canonical_map:
+                token = canonical_map.get(token, token)
+            term = f"{theme}/{token}" if term_mode == "theme_keyword" else token
+            counts[term] += freq
+    return counts
+
+
+def iter_batches(path: Path, batch_size: int, term_mode: str, canonical_map):
+    """按 minibatch 产出 [(用户名, 词频)]"""
+    batch = []
+    for name, blocks in iter_users(path):
+        batch.append((name, user_terms(blocks, term_mode, canonical_map)))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def to_csr(batch, vocab: dict[str, int]) -> csr_matrix:
+    """把一批用户词频转换成稀疏矩阵，词表外的词直接丢弃"""
+    data, indices, indptr = [], [], [0]
+    for _, counts in batch:
+        for term, freq in counts.items():
+            j = vocab.get(term)
+            if j is not None:
+                indices.append(j)
+                data.append(freq)
+        indptr.append(len(indices))
+    return csr_matrix((np.asarray(data, dtype=np.float64), indices, indptr),
+                      shape=(len(batch), len(vocab)))
+
+
+def build_matrix(path: Path, vocab: dict[str, int], batch_size: int, term_mode: str, canonical_map):
+    """Pass 2：分批转换后拼成整体 用户×词 CSR 矩阵，返回 (用户名列表, 矩阵)"""
+    names, blocks = [], []
+    for batch in tqdm(iter_batches(path, batch_size, term_mode, canonical_map), desc="matrix pass"):
+        names.extend(name for name, _ in batch)
+        blocks.append(to_csr(batch, vocab))
+    X = vstack(blocks, format="csr") if blocks else csr_matrix((0, len(vocab)))
+    return names, X
+
+
+def build_vocab(path: Path, term_mode: str, canonical_map, min_df: int, max_features: int):
+    """Pass 1：流式统计文档频率"""
+    df, n_users = Counter(), 0
+    for _, blocks in tqdm(iter_users(path), desc="vocab pass"):
+        df.update(user_terms(blocks, term_mode, canonical_map).keys())
+        n_users += 1
+    terms = [t for t, c in df.most_common() if c >= min_df][:max_features]
+    return {t: i for i, t in enumerate(sorted(terms))}, n_users
+
+
+def train(args):
+    canonical_map = json.loads(Path(args.canonical_map).read_text("utf-8")) if args.canonical_map else None
+    vocab, n_users = build_vocab(args.input, args.term_mode, canonical_map, args.min_df, args.max_features)
+    print(f"▶︎ users: {n_users:,}, vocabulary: {len(vocab):,}")
+
+    lda = LatentDirichletAllocation(
+        n_components=args.n_topics,
+        learning_method="online",
+        total_samples=n_users,
+        batch_size=args.batch_size,
+        n_jobs=args.n_jobs,
+        random_state=42,
+    )
+    names, X = build_matrix(args.input, vocab, args.batch_size, args.term_mode, canonical_map)
+    for epoch in range(args.epochs):
+        for start in tqdm(range(0, X.shape[0], args.batch_size), desc=f"epoch {epoch + 1}/{args.epochs}"):
+            lda.partial_fit(X[start:start + args.batch_size])
+
+    joblib.dump({"lda": lda, "vocab": vocab, "term_mode": args.term_mode,
+                 "canonical_map": canonical_map}, args.model)
+    print(f"✅ 模型已保存: {args.model}")
+
+    inv_vocab = np.array(sorted(vocab, key=vocab.get))
+    topics = {}
+    print("\n========== USER LDA TOPICS ==========")
+    for idx, comp in enumerate(lda.components_):
+        words = inv_vocab[comp.argsort()[-args.topn:][::-1]].tolist()
+        topics[f"topic_{idx + 1}"] = words
+        print(f"Topic {idx + 1}: {', '.join(words)}")
+    Path(args.topics_out).write_text(json.dumps(topics, ensure_ascii=False, indent=2), "utf-8")
+
+    infer_to_file(lda, names, X, args.output, args.batch_size)
+
+
+def infer_to_file(lda, names: list[str], X: csr_matrix, out_path, batch_size):
+    """按行分批推断每个用户的主题分布并写出 JSON"""
+    out = []
+    for start in tqdm(range(0, X.shape[0], batch_size), desc="inference"):
+        theta = lda.transform(X[start:start + batch_size])
+        for name, row in zip(names[start:start + batch_size], theta):
+            out.append({"user": name, "topics": [round(float(x), 6) for x in row]})
+    Path(out_path).write_text(json.dumps(out, ensure_ascii=False, indent=2), "utf-8")
+    print(f"✅ 用户主题向量已写入: {out_path} (users={len(out)})")
+
+
+def infer(args):
+    bundle = joblib.load(args.model)
+    names, X = build_matrix(args.input, bundle["vocab"], args.batch_size, bundle["term_mode"], bundle["canonical_map"])
+    infer_to_file(bundle["lda"], names, X, args.output, args.batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="以用户为文档的 LDA 主题模型")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_train = sub.add_parser("train", help="训练并保存模型")
+    p_train.add_argument("--input", type=Path, default=Path("../人格特质50位受试者原始数据.json"),
+                         help="用户 主题/关键词 词频 JSON")
+    p_train.add_argument("--n_topics", type=int, default=8, help="LDA 主题数")
+    p_train.add_argument("--term_mode", choices=["keyword", "theme_keyword"], default="keyword",
+                         help="词项：仅关键词，或 主题/关键词")
+    p_train.add_argument("--canonical_map", default=None,
+                         help="可选：canonical_map.json，命中的关键词替换为规范词")
+    p_train.add_argument("--min_df", type=int, default=2, help="最少出现在多少个用户中")
+    p_train.add_argument("--max_features", type=int, default=20000, help="词表上限")
+    p_train.add_argument("--batch_size", type=int, default=256, help="minibatch 用户数")
+    p_train.add_argument("--epochs", type=int, default=10, help="对语料的遍历轮数")
+    p_train.add_argument("--n_jobs", type=int, default=-1, help="E-step 并行核数，-1 为全部")
+    p_train.add_argument("--topn", type=int, default=15, help="每个主题展示前 N 个词")
+    p_train.add_argument("--model", default="user_lda.joblib", help="模型保存路径")
+    p_train.add_argument("--topics_out", default="lda_user_topics_top.json", help="主题关键词输出")
+    p_train.add_argument("--output", default="user_topics.json", help="训练集用户主题向量输出")
+
+    p_infer = sub.add_parser("infer", help="用已保存模型推断新用户")
+    p_infer.add_argument("--input", type=Path, required=True, help="新用户 JSON（同训练输入格式）")
+    p_infer.add_argument("--model", default="user_lda.joblib", help="模型路径")
+    p_infer.add_argument("--batch_size", type=int, default=1024, help="推断批大小")
+    p_infer.add_argument("--output", default="new_user_topics.json", help="输出文件")
+
+    args = parser.parse_args()
+    if args.cmd == "train":
+        train(args)
+    else:
+        infer(args)
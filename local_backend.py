@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+local_backend.py
+------------------------------------------
+离线本地 LLM 后端：在 CPU 上用 transformers 跑一个小型因果语言模型，
+对外提供与 DashScope compatible-mode 相同的 /v1/chat/completions 接口。
+
+    python local_backend.py --model Qwen/Qwen2.5-0.5B-Instruct --port 8000
+    export LLM_API_URL=http://127.0.0.1:8000/v1/chat/completions
+    python cbfpib_completion.py --model local --data-type memory
+
+要点：
+    * 并发请求在短时间窗口内合批（复用 model_server.Batcher），整批请求一起解码；
+    * system prompt 的 KV cache 只算一次并做 LRU 缓存，同一用户 40 道题 × repeat 次都复用它，
+      每次调用只需对题目部分做 prefill；
+    * 每批不论前缀是否相同都只做一次前向：每行放入自己的前缀 KV（右侧补零到最长前缀），
+      题目部分在前缀之后左填充，两处填充都由 attention mask 置 0，逐 token 解码。
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from loguru import logger
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from model_server import Batcher
+
+# ===== 配置区 =====
+DEFAULT_MODEL      = "Qwen/Qwen2.5-0.5B-Instruct"
+MAX_NEW_TOKENS     = 512
+PREFIX_CACHE_SIZE  = 16                # 缓存多少个 system prompt 的 KV
+BATCH_WINDOW       = 0.05
+MAX_BATCH          = 64
+
+
+def _to_legacy(cache):
+    """把 transformers 各版本的 cache 对象统一成 ((k, v), ...) 元组"""
+    if isinstance(cache, tuple):
+        return cache
+    if hasattr(cache, "to_legacy_cache"):
+        return cache.to_legacy_cache()
+    return tuple((layer.keys, layer.values) for layer in cache.layers)
+
+
+def _from_legacy(legacy):
+    from transformers import DynamicCache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(legacy)
+    cache = DynamicCache()
+    for i, (k, v) in enumerate(legacy):
+        cache.update(k, v, i)
+    return cache
+
+
+class LocalLM:
+    """带 system prompt 前缀 KV 复用的批量贪心 / 采样解码"""
+
+    def __init__(self, model_name: str, max_new_tokens: int = MAX_NEW_TOKENS):
+        logger.info(f"加载本地模型 {model_name} …")
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32)
+        self.model.eval()
+        self.max_new_tokens = max_new_tokens
+        self.pad_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        self.stop_ids = {self.tokenizer.eos_token_id}
+        im_end = self.tokenizer.convert_tokens_to_ids("<|im_end|>")
+        if isinstance(im_end, int) and im_end != self.tokenizer.unk_token_id:
+            self.stop_ids.add(im_end)
+        self.prefix_cache = OrderedDict()
+        self.stats = defaultdict(int)
+
+    # ---------- prompt 切分 ----------
+    def split_prompt(self, messages: list[dict]) -> tuple[str, str]:
+        """渲染聊天模板，拆成（可共享的 system 前缀, 其余部分）"""
+        full = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        if messages and messages[0]["role"] == "system":
+            prefix = self.tokenizer.apply_chat_template(messages[:1], tokenize=False)
+            if full.startswith(prefix):
+                return prefix, full[len(prefix):]
+        return "", full
+
+    def prefix_kv(self, prefix: str):
+        """返回 (前缀长度, legacy KV)，命中则复用"""
+        if prefix in self.prefix_cache:
+            self.prefix_cache.move_to_end(prefix)
+            self.stats["prefix_hits"] += 1
+            return self.prefix_cache[prefix]
+        ids = self.tokenizer(prefix, return_tensors="pt", add_special_tokens=False).input_ids
+        with torch.no_grad():
+            out = self.model(input_ids=ids, use_cache=True)
+        entry = (ids.shape[1], _to_legacy(out.past_key_values))
+        self.prefix_cache[prefix] = entry
+        if len(self.prefix_cache) > PREFIX_CACHE_SIZE:
+            self.prefix_cache.popitem(last=False)
+        self.stats["prefix_misses"] += 1
+        return entry
+
+    # ---------- 解码 ----------
+    def batch_past(self, prefixes: list[str]):
+        """
+        把各行的前缀 KV 拼成一个批次：每行放自己的前缀（同一前缀只算 / 取一次），右侧不足最长前缀的部分补零，
+        返回 (每行前缀长度, 最长前缀长度, cache)；补零位置由 attention mask 屏蔽。
+        """
+        entries = {p: self.prefix_kv(p) for p in dict.fromkeys(prefixes) if p}
+        lens = [entries[p][0] if p else 0 for p in prefixes]
+        width = max(lens)
+        if not width:
+            return lens, 0, None
+        n_layers = len(next(iter(entries.values()))[1])
+        legacy = []
+        for layer in range(n_layers):
+            k0, v0 = next(iter(entries.values()))[1][layer]
+            k = k0.new_zeros((len(prefixes), k0.shape[1], width, k0.shape[3]))
+            v = v0.new_zeros((len(prefixes), v0.shape[1], width, v0.shape[3]))
+            for b, p in enumerate(prefixes):
+                if p:
+                    pk, pv = entries[p][1][layer]
+                    k[b, :, :lens[b]] = pk[0]
+                    v[b, :, :lens[b]] = pv[0]
+            legacy.append((k, v))
+        return lens, width, _from_legacy(tuple(legacy))
+
+    def generate_batch(self, prefixes: list[str], suffixes: list[str], temperatures: list[float],
+                       max_new_tokens: int) -> list[tuple[str, int, int]]:
+        """不同前缀的请求共用一次前向：返回 [(文本, prompt_tokens, completion_tokens)]"""
+        batch = len(suffixes)
+        prefix_lens, prefix_width, past = self.batch_past(prefixes)
+
+        suffix_ids = [self.tokenizer(s, add_special_tokens=False).input_ids for s in suffixes]
+        width = max(len(ids) for ids in suffix_ids)
+        input_ids = torch.full((batch, width), self.pad_id, dtype=torch.long)
+        attn = torch.zeros((batch, prefix_width + width), dtype=torch.long)
+        position_ids = torch.zeros((batch, width), dtype=torch.long)
+        for b, ids in enumerate(suffix_ids):
+            pad, p_len = width - len(ids), prefix_lens[b]
+            input_ids[b, pad:] = torch.tensor(ids, dtype=torch.long)
+            attn[b, :p_len] = 1
+            attn[b, prefix_width + pad:] = 1
+            position_ids[b, pad:] = torch.arange(p_len, p_len + len(ids))
+
+        temps = torch.tensor(temperatures, dtype=torch.float32).unsqueeze(1)
+        generated = [[] for _ in range(batch)]
+        finished = torch.zeros(batch, dtype=torch.bool)
+        next_pos = position_ids[:, -1:] + 1
+        with torch.no_grad():
+            out = self.model(input_ids=input_ids, attention_mask=attn, position_ids=position_ids,
+                             past_key_values=past, use_cache=True)
+            for _ in range(max_new_tokens):
+                logits = out.logits[:, -1, :].float()
+                greedy = logits.argmax(dim=-1)
+                probs = torch.softmax(logits / temps.clamp(min=1e-5), dim=-1)
+                sampled = torch.multinomial(probs, 1).squeeze(1)
+                token = torch.where(temps.squeeze(1) > 0, sampled, greedy)
+                token = torch.where(finished, torch.full_like(token, self.pad_id), token)
+                for b in range(batch):
+                    if not finished[b]:
+                        if token[b].item() in self.stop_ids:
+                            finished[b] = True
+                        else:
+                            generated[b].append(token[b].item())
+                if finished.all():
+                    break
+                attn = torch.cat([attn, (~finished).long().unsqueeze(1)], dim=1)
+                out = self.model(input_ids=token.unsqueeze(1), attention_mask=attn, position_ids=next_pos,
+                                 past_key_values=out.past_key_values, use_cache=True)
+                next_pos = next_pos + 1
+
+        return [(self.tokenizer.decode(g, skip_special_tokens=True), p_len + len(ids), len(g))
+                for g, ids, p_len in zip(generated, suffix_ids, prefix_lens)]
+
+    def complete_batch(self, requests: list[dict]) -> list[dict]:
+        """Batcher 回调：整批一起解码，不同 system 前缀的请求也共用前向"""
+        t0 = time.perf_counter()
+        prefixes, suffixes = zip(*(self.split_prompt(req["messages"]) for req in requests))
+        outs = self.generate_batch(list(prefixes), list(suffixes),
+                                   [float(req.get("temperature", 0) or 0) for req in requests],
+                                   max(int(req.get("max_tokens") or self.max_new_tokens) for req in requests))
+        results = [self._response(text, p_tok, c_tok) for text, p_tok, c_tok in outs]
+        self.stats["requests"] += len(requests)
+        self.stats["batches"] += 1
+        logger.debug(f"批次完成：{len(requests)} 个请求 / {len(set(prefixes))} 个前缀，用时 {time.perf_counter() - t0:.2f}s")
+        return results
+
+    def _response(self, text: str, prompt_tokens: int, completion_tokens: int) -> dict:
+        return {
+            "id": f"local-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.model_name,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+
+# ----------------- HTTP 服务 -----------------
+class ChatHandler(BaseHTTPRequestHandler):
+    batcher: Batcher = None
+    lm: LocalLM = None
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def _send_json(self, code: int, obj: dict):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "model": self.lm.model_name, **self.lm.stats})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            self._send_json(200, self.batcher.submit([req])[0])
+        except Exception as e:
+            logger.error(f"请求处理失败: {e}")
+            self._send_json(500, {"error": {"message": str(e)}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地离线 chat-completions 后端")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="HuggingFace 模型名或本地路径")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS, help="默认最大生成长度")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU 线程数")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    lm = LocalLM(args.model, args.max_new_tokens)
+    ChatHandler.lm = lm
+    ChatHandler.batcher = Batcher(lm.complete_batch, window=BATCH_WINDOW, max_batch=MAX_BATCH)
+
+    server = ThreadingHTTPServer((args.host, args.port), ChatHandler)
+    logger.success(f"本地后端已启动: http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("收到中断，服务退出")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ from pathlib import Path
 
 import pandas as pd
 
+from subject_registry import SubjectRegistry, normalize_uid, record_name
+
 # ------------------ 核心函数 ------------------ #
 def build_uid_map(excel_path: Path,
                   sheet_name: str | int | None = 0,
@@ -19,15 +21,19 @@ def build_uid_map(excel_path: Path,
         raise ValueError(
             f"Excel 缺少列：{name_col} 或 {uid_col}，请检查列名或通过参数指定"
         )
-    # 去掉空值，strip 首尾空格
+    # 去掉空值，strip 首尾空格；编号与注册表一样统一成 int（"7" / "7.0" 视为同一个人）
+    df = df.dropna(subset=[name_col])
     df[name_col] = df[name_col].astype(str).str.strip()
-    df[uid_col] = df[uid_col].astype(str).str.strip()
+    df[uid_col] = df[uid_col].map(normalize_uid)
+    if df[uid_col].isna().any():
+        print(f"[WARN] Excel 中以下姓名没有编号，已跳过: {df.loc[df[uid_col].isna(), name_col].tolist()}")
+        df = df.dropna(subset=[uid_col])
     # 去重：若同一 name 出现多次，保留首行并发出警告
     if df[name_col].duplicated().any():
         dup_names = df.loc[df[name_col].duplicated(), name_col].unique()
         print(f"[WARN] Excel 中以下姓名出现重复，仅使用首次出现的编号: {dup_names}")
         df = df.drop_duplicates(subset=name_col, keep="first")
-    return df.set_index(name_col)[uid_col].to_dict()
+    return {name: int(uid) for name, uid in zip(df[name_col], df[uid_col])}
 
 def update_json(json_path: Path, uid_map: dict[str, int]) -> list[dict]:
     """
@@ -47,7 +53,9 @@ def update_json(json_path: Path, uid_map: dict[str, int]) -> list[dict]:
 # ------------------ 命令行接口 ------------------ #
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="根据 Excel 更新 JSON 用户信息")
-    parser.add_argument("--excel", required=True, type=Path, help="包含姓名与编号的 xlsx 文件")
+    parser.add_argument("--excel", type=Path, default=None, help="包含姓名与编号的 xlsx 文件")
+    parser.add_argument("--registry", type=Path, default=None,
+                        help="改用受试者注册表（subject_registry.py import 生成），不再读取 Excel")
     parser.add_argument("--json",  required=True, type=Path, help="原始 JSON 文件")
     parser.add_argument("--output", type=Path, default=None,
                         help="输出 JSON（默认覆盖原文件）")
@@ -58,11 +66,19 @@ if __name__ == "__main__":
     parser.add_argument("--uid-col", default="uid",
                         help="Excel 中的编号列名（默认 'uid'）")
     args = parser.parse_args()
+    if not args.excel and not args.registry:
+        parser.error("需要 --excel 或 --registry 之一")
 
-    uid_map = build_uid_map(args.excel,
-                            sheet_name=args.sheet,
-                            name_col=args.name_col,
-                            uid_col=args.uid_col)
+    if args.registry:
+        names = [record_name(entry) for entry in json.loads(args.json.read_text(encoding="utf-8"))]
+        registry = SubjectRegistry(args.registry)
+        uid_map = registry.lookup_many(names)       # {原始姓名: uid}，按规范化姓名匹配
+        registry.close()
+    else:
+        uid_map = build_uid_map(args.excel,
+                                sheet_name=args.sheet,
+                                name_col=args.name_col,
+                                uid_col=args.uid_col)
     updated = update_json(args.json, uid_map)
 
     out_path = args.output or args.json  # 覆盖或另存为
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+model_server.py
+------------------------------------------
+常驻本地模型服务：预热 Big-5 回归模型与 SentenceTransformer，
+通过 localhost HTTP 提供批量推理接口，避免每个脚本重复加载模型。
+
+启动：
+    python model_server.py --port 8765
+
+客户端（服务不可用时自动回退到进程内加载）：
+    from model_server import score_big5, embed
+    score_big5(texts)                 # -> np.ndarray (N, 5)
+    embed(texts, model_name)          # -> np.ndarray (N, D)
+
+接口：
+    POST /score_big5   {"texts": [...]}
+    POST /embed        {"texts": [...], "model": "...", "normalize": bool}
+    GET  /health
+响应体为 float32 原始字节，形状放在 X-Shape 头里，避免大矩阵走 JSON。
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import error as urlerror
+from urllib import request as urlrequest
+
+import numpy as np
+from loguru import logger
+
+# ===== 配置区 =====
+BIG5_MODEL_NAME  = "vladinc/bigfive-regression-model"
+EMBED_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+SERVER_URL       = os.getenv("BIGFIVE_MODEL_SERVER", "http://127.0.0.1:8765")  # 设为 off 则不连服务
+BATCH_WINDOW     = 0.02                # 合批等待窗口（秒）
+MAX_BATCH        = 256                 # 单批最多合并的文本条数
+CLIENT_TIMEOUT   = float(os.getenv("BIGFIVE_MODEL_SERVER_TIMEOUT", 300))   # 客户端等待服务响应的上限（秒）
+
+# ----------------- 进程内模型 -----------------
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_big5():
+    """懒加载 Big-5 回归模型，返回 (tokenizer, model, device)"""
+    with _models_lock:
+        if "big5" not in _models:
+            import torch
+            from transformers import AutoTokenizer, AutoModelForSequenceClassification
+            logger.info(f"加载回归模型 {BIG5_MODEL_NAME} …")
+            tokenizer = AutoTokenizer.from_pretrained(BIG5_MODEL_NAME)
+            model = AutoModelForSequenceClassification.from_pretrained(BIG5_MODEL_NAME)
+            model.eval()                         # 关闭 dropout
+            device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+            model.to(device)
+            _models["big5"] = (tokenizer, model, device)
+    return _models["big5"]
+
+
+def load_embedder(model_name: str = EMBED_MODEL_NAME):
+    """懒加载 SentenceTransformer"""
+    key = ("embed", model_name)
+    with _models_lock:
+        if key not in _models:
+            from sentence_transformers import SentenceTransformer
+            logger.info(f"加载句向量模型 {model_name} …")
+            _models[key] = SentenceTransformer(model_name)
+    return _models[key]
+
+
+def predict_big5_local(texts: list[str], batch_size: int = 8, show_progress: bool = False) -> np.ndarray:
+    """进程内批量返回 Big-5 得分 (N, 5)"""
+    import torch
+    from tqdm import tqdm
+    tokenizer, model, device = load_big5()
+    all_outputs = []
+    steps = range(0, len(texts), batch_size)
+    for i in (tqdm(steps) if show_progress else steps):
+        batch_texts = texts[i:i + batch_size]
+        inputs = tokenizer(batch_texts, padding=True, truncation=True,
+                           max_length=512, return_tensors="pt")
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+        with torch.no_grad():
+            logits = model(**inputs).logits.cpu()      # shape (B, 5)
+        all_outputs.append(logits)
+    if not all_outputs:
+        return np.zeros((0, 5), dtype=np.float32)
+    return torch.cat(all_outputs, dim=0).numpy().astype(np.float32)
+
+
+def encode_local(texts: list[str], model_name: str = EMBED_MODEL_NAME, batch_size: int = 512,
+                 normalize: bool = False, show_progress: bool = False) -> np.ndarray:
+    """进程内句向量编码 (N, D)"""
+    model = load_embedder(model_name)
+    emb = model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress,
+                       normalize_embeddings=normalize)
+    return np.asarray(emb, dtype=np.float32)
+
+
+# ----------------- 合批 -----------------
+class Batcher:
+    """把并发请求在短时间窗口内合并成一个批次，交给同一个模型推理"""
+
+    def __init__(self, fn, window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH):
+        self.fn, self.window, self.max_batch = fn, window, max_batch
+        self.queue = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, texts: list[str]) -> np.ndarray:
+        slot = {"texts": texts, "event": threading.Event()}
+        self.queue.put(slot)
+        slot["event"].wait()
+        if "error" in slot:
+            raise slot["error"]
+        return slot["result"]
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            n = len(batch[0]["texts"])
+            deadline = time.monotonic() + self.window
+            while n < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    slot = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(slot)
+                n += len(slot["texts"])
+
+            texts = [t for slot in batch for t in slot["texts"]]
+            try:
+                out = self.fn(texts)
+                offset = 0
+                for slot in batch:
+                    slot["result"] = out[offset:offset + len(slot["texts"])]
+                    offset += len(slot["texts"])
+                logger.debug(f"合批推理完成：{len(batch)} 个请求，{len(texts)} 条文本")
+            except Exception as e:
+                logger.error(f"合批推理失败: {e}")
+                for slot in batch:
+                    slot["error"] = e
+            finally:
+                for slot in batch:
+                    slot["event"].set()
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(kind: str, model_name: str = "", normalize: bool = False) -> Batcher:
+    key = (kind, model_name, normalize)
+    with _batchers_lock:
+        if key not in _batchers:
+            if kind == "big5":
+                _batchers[key] = Batcher(lambda texts: predict_big5_local(texts))
+            else:
+                _batchers[key] = Batcher(lambda texts: encode_local(texts, model_name, normalize=normalize))
+    return _batchers[key]
+
+
+# ----------------- HTTP 服务 -----------------
+class ModelHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def _send_array(self, arr: np.ndarray):
+        body = np.ascontiguousarray(arr, dtype=np.float32).tobytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("X-Shape", json.dumps(list(arr.shape)))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, code: int, obj: dict):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "models": [str(k) for k in _models]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            texts = req["texts"]
+            if self.path == "/score_big5":
+                self._send_array(get_batcher("big5").submit(texts))
+            elif self.path == "/embed":
+                batcher = get_batcher("embed", req.get("model", EMBED_MODEL_NAME), bool(req.get("normalize", False)))
+                self._send_array(batcher.submit(texts))
+            else:
+                self._send_json(404, {"error": "not found"})
+        except Exception as e:
+            logger.error(f"请求处理失败: {e}")
+            self._send_json(500, {"error": str(e)})
+
+
+# ----------------- 客户端 -----------------
+_server_down = False
+
+
+def _post_array(path: str, payload: dict) -> np.ndarray | None:
+    """请求常驻服务；服务不可达时返回 None，之后本进程不再尝试"""
+    global _server_down
+    if _server_down or SERVER_URL.lower() == "off":
+        return None
+    req = urlrequest.Request(SERVER_URL + path, data=json.dumps(payload).encode("utf-8"),
+                             headers={"Content-Type": "application/json"})
+    try:
+        with urlrequest.urlopen(req, timeout=CLIENT_TIMEOUT) as resp:
+            shape = json.loads(resp.headers["X-Shape"])
+            return np.frombuffer(resp.read(), dtype=np.float32).reshape(shape)
+    except (urlerror.URLError, ConnectionError, TimeoutError) as e:
+        if isinstance(e, urlerror.HTTPError):
+            raise
+        logger.info(f"模型服务 {SERVER_URL} 不可用（{e}），回退到进程内加载")
+        _server_down = True
+        return None
+
+
+def score_big5(texts: list[str], batch_size: int = 8, show_progress: bool = False) -> np.ndarray:
+    """Big-5 回归打分 (N, 5)，优先走常驻服务"""
+    out = _post_array("/score_big5", {"texts": texts})
+    if out is None:
+        out = predict_big5_local(texts, batch_size=batch_size, show_progress=show_progress)
+    return out
+
+
+def embed(texts: list[str], model_name: str = EMBED_MODEL_NAME, batch_size: int = 512,
+          normalize: bool = False, show_progress: bool = False) -> np.ndarray:
+    """句向量 (N, D)，优先走常驻服务"""
+    out = _post_array("/embed", {"texts": texts, "model": model_name, "normalize": normalize})
+    if out is None:
+        out = encode_local(texts, model_name, batch_size=batch_size,
+                           normalize=normalize, show_progress=show_progress)
+    return out
+
+
+# ----------------- 主入口 -----------------
+def main():
+    parser = argparse.ArgumentParser(description="常驻本地模型服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址，默认仅本机")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--embed-models", nargs="*", default=[EMBED_MODEL_NAME],
+                        help="启动时预热的句向量模型")
+    parser.add_argument("--no-big5", action="store_true", help="启动时不预热 Big-5 回归模型")
+    args = parser.parse_args()
+
+    if not args.no_big5:
+        load_big5()
+    for name in args.embed_models:
+        load_embedder(name)
+
+    server = ThreadingHTTPServer((args.host, args.port), ModelHandler)
+    logger.success(f"模型服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("收到中断，服务退出")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
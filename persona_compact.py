@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+persona_compact.py
+------------------------------------------
+人格画像压缩：在人格文件与 prompt_generator 之间，按 token 预算裁剪每个用户的画像。
+
+    * memory：按关键词 weight 从高到低保留记忆，超出预算后丢弃低权重关键词的记忆
+    * story ：故事没有权重，按句子顺序保留到预算为止
+    * 至少保留第一条（最高权重）记忆 / 第一句，即使它本身就超出预算，避免画像被裁成空、
+      静默退化成无画像的 baseline prompt；这类用户在报告中标记 over_budget 并打印警告
+token 用本地 tokenizer 计数；压缩结果按 (用户画像内容, 预算, tokenizer) 缓存，
+并输出每个用户的 token 报告。
+
+    python persona_compact.py --data-type memory --budget 800
+"""
+
+import argparse
+import hashlib
+import json
+import re
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from atomic_json import update_json
+
+# ===== 配置区 =====
+TOKENIZER_NAME = "Qwen/Qwen2.5-7B-Instruct"      # 与调用的 qwen 系列模型同一套词表
+CACHE_FILE     = Path("persona_compact_cache.json")
+CACHE_VERSION  = 2                                # 裁剪规则变化时递增，旧缓存自动失效
+MEMORY_SEP     = "\n    "                         # 与 cbfpib_completion 拼接记忆的分隔符一致
+
+_tokenizer = None                                 # False 表示离线且本地没有 tokenizer，退回字符估计
+_offline = False
+
+
+def set_offline(offline: bool = True):
+    """离线模式（plan_run.py）：tokenizer 只从本地缓存加载，不联网下载；加载不到时按字符粗略估计"""
+    global _offline
+    _offline = offline
+
+
+def approx_tokens(text: str) -> int:
+    """粗略 token 数：CJK 字符各算一个，其余按空白分词（无 tokenizer 时使用）"""
+    cjk = len(re.findall(r"[一-鿿]", text))
+    return cjk + len(re.sub(r"[一-鿿]", " ", text).split())
+
+
+def count_tokens(text: str) -> int:
+    """本地 tokenizer 计数（不含特殊 token）"""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            from transformers import AutoTokenizer
+            _tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME, local_files_only=_offline)
+        except (ImportError, OSError, ValueError) as e:
+            if not _offline:
+                raise
+            logger.warning(f"本地没有 {TOKENIZER_NAME} 的 tokenizer，改按字符粗略估计：{e}")
+            _tokenizer = False
+    if _tokenizer is False:
+        return approx_tokens(text)
+    return len(_tokenizer.encode(text, add_special_tokens=False)) if text else 0
+
+
+def split_sentences(text: str) -> list[str]:
+    """按中文句末标点 / 换行切句，保留标点"""
+    return [s for s in re.findall(r"[^。！？!?\n]*[。！？!?\n]+|[^。！？!?\n]+$", text) if s.strip()]
+
+
+def compact_memory_entry(entry: dict, budget: int) -> tuple[dict, dict]:
+    """按关键词权重保留记忆，直到 token 预算用完"""
+    sep_cost = count_tokens(MEMORY_SEP)
+    keywords = sorted(entry.get("keywords", []), key=lambda kw: kw.get("weight", 0), reverse=True)
+    used, kept_kw, n_before, n_after, exhausted = 0, [], 0, 0, False
+    for kw in keywords:
+        kept = []
+        for m in kw.get("memories", []):
+            n_before += 1
+            cost = count_tokens(m) + (sep_cost if used else 0)
+            if not exhausted and (used + cost <= budget or n_after + len(kept) == 0):
+                kept.append(m)
+                used += cost
+            else:
+                exhausted = True                  # 之后的（更低权重）记忆全部丢弃
+        if kept:
+            kept_kw.append({**kw, "memories": kept})
+            n_after += len(kept)
+    before = count_tokens(MEMORY_SEP.join(m for kw in keywords for m in kw.get("memories", [])))
+    return {**entry, "keywords": kept_kw}, {
+        "tokens_before": before, "tokens_after": used,
+        "units_before": n_before, "units_after": n_after, "over_budget": used > budget,
+    }
+
+
+def compact_story_entry(entry: dict, budget: int) -> tuple[dict, dict]:
+    """按句子顺序保留故事，直到 token 预算用完"""
+    sentences = split_sentences(entry.get("story") or "")
+    kept, used = [], 0
+    for s in sentences:
+        cost = count_tokens(s)
+        if used + cost > budget and kept:
+            break
+        kept.append(s)
+        used += cost
+    return {**entry, "story": "".join(kept)}, {
+        "tokens_before": count_tokens(entry.get("story") or ""), "tokens_after": count_tokens("".join(kept)),
+        "units_before": len(sentences), "units_after": len(kept), "over_budget": used > budget,
+    }
+
+
+def _cache_key(entry: dict, data_type: str, budget: int) -> str:
+    persona = entry.get("keywords") if data_type == "memory" else entry.get("story")
+    raw = json.dumps([CACHE_VERSION, TOKENIZER_NAME, data_type, budget, persona], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def compact_personas(data: list[dict], data_type: str, budget: int,
+                     cache_path: Path = CACHE_FILE, write_cache: bool = True) -> tuple[list[dict], pd.DataFrame]:
+    """
+    压缩一批用户画像。
+
+    :param data: bigfive_memories.json / bigfive_stories.json 的内容
+    :param data_type: 'memory' 或 'story'
+    :param budget: 每个用户画像的 token 上限
+    :param write_cache: False 时只读缓存、不写回（plan_run.py 的预估不产生任何文件）
+    :return: (压缩后的数据, 每用户 token 报告)
+    """
+    cache = json.loads(cache_path.read_text("utf-8")) if cache_path.exists() else {}
+    new = {}
+    compact = compact_memory_entry if data_type == "memory" else compact_story_entry
+    out, rows, hits = [], [], 0
+    for entry in data:
+        key = _cache_key(entry, data_type, budget)
+        if key in cache:
+            hits += 1
+            persona, report = cache[key]["persona"], cache[key]["report"]
+            new_entry = {**entry, ("keywords" if data_type == "memory" else "story"): persona}
+        else:
+            new_entry, report = compact(entry, budget)
+            persona = new_entry.get("keywords") if data_type == "memory" else new_entry.get("story")
+            new[key] = cache[key] = {"persona": persona, "report": report}
+        out.append(new_entry)
+        rows.append({"user": entry.get("user"), "uid": entry.get("uid"), **report})
+    if new and write_cache:                          # 加锁合并写回，并发运行的其他进程新增的条目不会丢
+        update_json(cache_path, lambda c: c.update(new))
+
+    report = pd.DataFrame(rows)
+    if len(report):
+        logger.info(f"画像压缩（{data_type}, 预算 {budget} tokens）：缓存命中 {hits}/{len(data)}，"
+                    f"总 token {report['tokens_before'].sum()} → {report['tokens_after'].sum()}，"
+                    f"单用户最大 {report['tokens_after'].max()}")
+        over = report.loc[report["over_budget"], "user"].tolist()
+        if over:
+            logger.warning(f"{len(over)} 个用户的第一条记忆 / 第一句已超出预算 {budget}，仅保留这一条：{over}")
+    return out, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按 token 预算压缩人格画像")
+    parser.add_argument("--data-type", choices=["memory", "story"], default="memory", help="画像类型")
+    parser.add_argument("--budget", type=int, required=True, help="每个用户画像的 token 上限")
+    parser.add_argument("--input", type=Path, default=None, help="输入文件，默认按类型选择")
+    parser.add_argument("--output", type=Path, default=None, help="输出文件，默认 <输入>_tok<预算>.json")
+    parser.add_argument("--report", type=Path, default=Path("persona_token_report.csv"), help="token 报告 CSV")
+    args = parser.parse_args()
+
+    in_path = args.input or Path("bigfive_memories.json" if args.data_type == "memory" else "bigfive_stories.json")
+    out_path = args.output or in_path.with_name(f"{in_path.stem}_tok{args.budget}.json")
+    data = json.loads(in_path.read_text(encoding="utf-8"))
+    compacted, report = compact_personas(data, args.data_type, args.budget)
+    out_path.write_text(json.dumps(compacted, ensure_ascii=False, indent=2), encoding="utf-8")
+    report.to_csv(args.report, index=False)
+    logger.success(f"压缩结果已写入 {out_path}，token 报告 → {args.report}")
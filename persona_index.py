@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+persona_index.py
+------------------------------------------
+用户相似度索引：从 bigfive_prompt_payload.json 为每个用户构造稀疏的 关键词 / 主题 加权向量
+（关键词权重 × idf，主题为该主题下关键词权重之和，两部分各自 L2 归一化后按 --theme-weight 拼接），
+可选再混入记忆句向量的均值（--memories，走 embedding_cache 缓存）。
+
+用途：新模型试跑时挑一小批能代表全体的用户，而不是每次都跑满 50 人。
+
+    python persona_index.py neighbors 苹果人 -k 5                       # 最相似的用户
+    python persona_index.py select -m 10 --method kcenter -o pilot_users.txt
+    python persona_index.py select -m 10 --method stratified --memories bigfive_memories.json
+    python persona_index.py coverage --users-file pilot_users.txt        # 评估已有子集
+    python cbfpib_completion.py --model qwen-turbo --users-file pilot_users.txt ...
+
+选择方法：
+    kcenter     贪心最远点：先取 medoid，再反复加入离已选集合最远的用户，使覆盖半径尽量小；
+    stratified  按主导主题分层，按人数比例分配名额（最大余数法），层内再做 k-center。
+覆盖统计：每个用户到最近被选用户的距离（均值 / 最大值）、代表簇大小、主导主题分布的总变差距离、
+关键词权重覆盖率；有 cbfpib.csv 时还给出子集与全体在五个维度上的均值 / 标准差对比。
+"""
+
+import argparse
+import csv
+import json
+import math
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from users_file import read_users_file
+
+# ===== 配置区 =====
+PAYLOAD_FILE  = Path("bigfive_prompt_payload.json")
+TRUTH_CSV     = Path("cbfpib.csv")
+DIMS          = ["N", "C", "A", "O", "E"]
+THEME_WEIGHT  = 0.3                    # 相似度中主题部分的占比，其余为关键词部分
+EMBED_WEIGHT  = 0.5                    # 给出 --memories 时句向量相似度的占比
+
+# ----------------- 核心函数 -----------------
+
+
+class PersonaIndex:
+    """稀疏向量 + 倒排表的用户相似度索引（余弦相似度）"""
+
+    def __init__(self, payload: list[dict], theme_weight: float = THEME_WEIGHT,
+                 memories: list[dict] | None = None, embed_weight: float = EMBED_WEIGHT):
+        self.users = [entry["user"] for entry in payload]
+        self.pos = {u: i for i, u in enumerate(self.users)}
+        n = len(payload)
+        df = Counter(tok for entry in payload for tok in {kw["token"] for kw in entry["keywords"]})
+        idf = {tok: math.log((1 + n) / (1 + c)) + 1 for tok, c in df.items()}
+
+        self.vectors, self.themes, self.keyword_weight = [], [], []
+        for entry in payload:
+            kw_vec, theme_vec = defaultdict(float), defaultdict(float)
+            for kw in entry["keywords"]:
+                kw_vec[kw["token"]] += kw["weight"] * idf[kw["token"]]
+                theme_vec[kw["context"]] += kw["weight"]
+            vec = {}
+            for prefix, part, share in (("kw:", kw_vec, 1 - theme_weight), ("theme:", theme_vec, theme_weight)):
+                norm = math.sqrt(sum(v * v for v in part.values())) or 1.0
+                vec.update({prefix + f: v / norm * math.sqrt(share) for f, v in part.items()})
+            self.vectors.append(vec)
+            self.themes.append(max(theme_vec, key=theme_vec.get) if theme_vec else "")
+            self.keyword_weight.append({kw["token"]: kw["weight"] for kw in entry["keywords"]})
+
+        self.postings = defaultdict(list)                 # 特征 → [(用户序号, 取值)]
+        for i, vec in enumerate(self.vectors):
+            for f, v in vec.items():
+                self.postings[f].append((i, v))
+
+        self.embed_weight, self.emb = 0.0, None
+        if memories:
+            self.emb = memory_embeddings(self.users, memories)
+            self.embed_weight = embed_weight
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.users)
+
+    def scores(self, i: int) -> np.ndarray:
+        """用户 i 与所有用户的相似度；稀疏部分只遍历 i 的非零特征对应的倒排表"""
+        sims = np.zeros(len(self))
+        for f, v in self.vectors[i].items():
+            for j, w in self.postings[f]:
+                sims[j] += v * w
+        if self.emb is not None:
+            sims = (1 - self.embed_weight) * sims + self.embed_weight * (self.emb @ self.emb[i])
+        return sims
+
+    def neighbors(self, user: str, k: int = 5) -> list[tuple[str, float]]:
+        i = self.pos[user]
+        sims = self.scores(i)
+        sims[i] = -np.inf
+        order = np.argsort(-sims)[:k]
+        return [(self.users[j], round(float(sims[j]), 4)) for j in order]
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.vstack([self.scores(i) for i in range(len(self))])
+        return self._matrix
+
+
+def memory_embeddings(users: list[str], memories: list[dict]) -> np.ndarray:
+    """每个用户全部记忆句向量的均值（归一化）；没有记忆的用户为零向量"""
+    from embedding_cache import encode_cached
+    by_user = {e["user"]: [m for kw in e.get("keywords", []) for m in kw.get("memories", [])] for e in memories}
+    texts = [m for u in users for m in by_user.get(u, [])]
+    emb = encode_cached(texts, normalize=True)
+    out, offset = np.zeros((len(users), emb.shape[1]), dtype=np.float32), 0
+    for i, u in enumerate(users):
+        n = len(by_user.get(u, []))
+        if n:
+            mean = emb[offset:offset + n].mean(axis=0)
+            out[i] = mean / (np.linalg.norm(mean) or 1.0)
+        offset += n
+    missing = [u for u in users if not by_user.get(u)]
+    if missing:
+        logger.warning(f"{len(missing)} 个用户没有记忆，句向量部分记为 0：{missing}")
+    return out
+
+
+def k_center(sim: np.ndarray, m: int, candidates: list[int] | None = None) -> list[int]:
+    """贪心 k-center（距离 = 1 - 相似度），首个点取候选集内的 medoid"""
+    cand = list(range(len(sim))) if candidates is None else list(candidates)
+    if not cand or m <= 0:
+        return []
+    sub = sim[np.ix_(cand, cand)]
+    chosen = [int(np.argmax(sub.sum(axis=1)))]
+    nearest = 1 - sub[chosen[0]]
+    while len(chosen) < min(m, len(cand)):
+        nearest[chosen] = -np.inf
+        nxt = int(np.argmax(nearest))
+        chosen.append(nxt)
+        nearest = np.minimum(nearest, 1 - sub[nxt])
+    return [cand[c] for c in chosen]
+
+
+def stratified(index: PersonaIndex, m: int) -> list[int]:
+    """按主导主题分层，最大余数法按比例分配名额，层内 k-center"""
+    strata = defaultdict(list)
+    for i, theme in enumerate(index.themes):
+        strata[theme].append(i)
+    n = len(index)
+    quota = {t: m * len(members) / n for t, members in strata.items()}
+    alloc = {t: int(q) for t, q in quota.items()}
+    for t in sorted(quota, key=lambda t: quota[t] - alloc[t], reverse=True)[:m - sum(alloc.values())]:
+        alloc[t] += 1
+    sim = index.matrix()
+    return [i for t, members in strata.items() for i in k_center(sim, alloc[t], members)]
+
+
+def load_truth(path: Path = TRUTH_CSV) -> dict:
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8-sig") as f:
+        return {row["user"]: {d: float(row[d]) for d in DIMS} for row in csv.DictReader(f)}
+
+
+def coverage(index: PersonaIndex, selected: list[int], truth: dict | None = None) -> dict:
+    """子集对全体的覆盖统计"""
+    if not selected:
+        raise ValueError("子集为空：请检查 -m 是否大于 0，或 --users-file 中是否有索引内的用户")
+    sim = index.matrix()
+    dist = 1 - sim[:, selected]
+    nearest = dist.min(axis=1)
+    owner = np.array(selected)[dist.argmin(axis=1)]
+    cluster = Counter(index.users[o] for o in owner)
+
+    all_themes = Counter(index.themes)
+    sub_themes = Counter(index.themes[i] for i in selected)
+    tv = 0.5 * sum(abs(all_themes[t] / len(index) - sub_themes[t] / len(selected)) for t in all_themes)
+
+    total_w = defaultdict(float)
+    for kws in index.keyword_weight:
+        for tok, w in kws.items():
+            total_w[tok] += w
+    covered = {tok for i in selected for tok in index.keyword_weight[i]}
+    kw_cov = sum(w for tok, w in total_w.items() if tok in covered) / (sum(total_w.values()) or 1.0)
+
+    stats = {
+        "users": len(selected), "cohort": len(index),
+        "mean_dist": round(float(nearest.mean()), 4), "max_dist": round(float(nearest.max()), 4),
+        "largest_cluster": max(cluster.values()), "theme_tv": round(tv, 4), "keyword_coverage": round(kw_cov, 4),
+        "clusters": dict(cluster.most_common()),
+    }
+    if truth:
+        cohort = np.array([[truth[u][d] for d in DIMS] for u in index.users if u in truth])
+        sub = np.array([[truth[index.users[i]][d] for d in DIMS] for i in selected if index.users[i] in truth])
+        if len(cohort) and len(sub):
+            std = cohort.std(axis=0)
+            stats["dims"] = {d: {"cohort_mean": round(float(cohort[:, j].mean()), 2),
+                                 "subset_mean": round(float(sub[:, j].mean()), 2),
+                                 "cohort_std": round(float(std[j]), 2),
+                                 "subset_std": round(float(sub[:, j].std()), 2),
+                                 "mean_gap_sd": round(float((sub[:, j].mean() - cohort[:, j].mean()) / (std[j] or 1)), 3)}
+                             for j, d in enumerate(DIMS)}
+    return stats
+
+
+def print_coverage(stats: dict):
+    logger.info(f"子集 {stats['users']}/{stats['cohort']} 人：平均最近距离 {stats['mean_dist']}，"
+                f"覆盖半径 {stats['max_dist']}，最大代表簇 {stats['largest_cluster']} 人，"
+                f"主题分布总变差 {stats['theme_tv']}，关键词权重覆盖率 {stats['keyword_coverage']:.1%}")
+    for d, s in stats.get("dims", {}).items():
+        logger.info(f"  {d}: 全体 {s['cohort_mean']}±{s['cohort_std']}  子集 {s['subset_mean']}±{s['subset_std']}"
+                    f"  均值偏差 {s['mean_gap_sd']:+.3f} SD")
+
+
+# ----------------- 主入口 -----------------
+def build_index(args) -> PersonaIndex:
+    payload = json.loads(args.payload.read_text(encoding="utf-8"))
+    memories = json.loads(args.memories.read_text(encoding="utf-8")) if args.memories else None
+    index = PersonaIndex(payload, args.theme_weight, memories, args.embed_weight)
+    logger.info(f"索引 {len(index)} 个用户，{len(index.postings)} 个特征")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用户相似度索引与代表性子集选择")
+    parser.add_argument("--payload", type=Path, default=PAYLOAD_FILE, help="关键词 payload JSON")
+    parser.add_argument("--memories", type=Path, default=None, help="混入记忆句向量（如 bigfive_memories.json）")
+    parser.add_argument("--theme-weight", type=float, default=THEME_WEIGHT, help="主题部分占比")
+    parser.add_argument("--embed-weight", type=float, default=EMBED_WEIGHT, help="句向量部分占比（需 --memories）")
+    parser.add_argument("--truth", type=Path, default=TRUTH_CSV, help="真实维度分 CSV，用于覆盖统计")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("neighbors", help="查询最相似的用户")
+    p.add_argument("user", nargs="+", help="用户名")
+    p.add_argument("-k", type=int, default=5, help="返回个数")
+
+    p = sub.add_parser("select", help="选出 m 个代表用户")
+    p.add_argument("-m", type=int, default=10, help="子集大小")
+    p.add_argument("--method", choices=["kcenter", "stratified"], default="kcenter", help="选择方法")
+    p.add_argument("-o", "--output", type=Path, default=None, help="写出用户名列表（供 --users-file 使用）")
+
+    p = sub.add_parser("coverage", help="评估已有子集的覆盖情况")
+    p.add_argument("--users-file", type=Path, required=True, help="每行一个用户名")
+    args = parser.parse_args()
+
+    index = build_index(args)
+    if args.cmd == "neighbors":
+        for user in args.user:
+            if user not in index.pos:
+                logger.error(f"未找到用户 {user}")
+                continue
+            logger.info(f"{user} 的近邻：" + "，".join(f"{u}({s})" for u, s in index.neighbors(user, args.k)))
+        return
+
+    if args.cmd == "select":
+        selected = k_center(index.matrix(), args.m) if args.method == "kcenter" else stratified(index, args.m)
+        users = [index.users[i] for i in selected]
+        logger.success(f"{args.method} 选出 {len(users)} 人：{users}")
+        if args.output:
+            args.output.write_text("\n".join(users) + "\n", encoding="utf-8")
+            logger.success(f"用户列表已写入 {args.output}")
+    else:
+        names = read_users_file(args.users_file)
+        unknown = [u for u in names if u not in index.pos]
+        if unknown:
+            logger.warning(f"索引中没有这些用户，已忽略：{unknown}")
+        selected = [index.pos[u] for u in names if u in index.pos]
+    if not selected:
+        raise SystemExit("子集为空：请检查 -m 是否大于 0，或 --users-file 中是否有索引内的用户")
+    print_coverage(coverage(index, selected, load_truth(args.truth)))
+
+
+if __name__ == "__main__":
+    main()
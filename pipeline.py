@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pipeline.py
+------------------------------------------
+按内容哈希增量执行整条流水线：每个阶段声明输入文件、输出文件、脚本与参数，
+运行前对 输入内容 + 代码（脚本及其 import 的本地模块）+ 参数 + 相关环境变量 求哈希，
+与 .pipeline_state.json 中上次成功时的记录比较，只重跑依赖变化了的阶段；
+互不依赖的分支（问卷 / 直接评估 / 回归模型）并发执行。
+
+    generate_prompt_payload → matching → generate_memory → generate_story → 问卷（run.sh 各配置）
+                                   │              └→ bigfiveRegressionModel
+                                   └→ direct_evaluation
+
+各脚本写死的文件名并不完全衔接（generate_memory 写 bigfive_story.json，下游读 bigfive_memories.json；
+generate_story 写 stories.json，问卷读 bigfive_stories.json），由 promote_* 复制阶段接上。
+
+    python pipeline.py --status                  # 查看各阶段是否过期及原因
+    python pipeline.py                           # 重建所有过期阶段
+    python pipeline.py survey_story_cot --jobs 2 # 只构建指定阶段（连同过期的上游）
+    python pipeline.py --force generate_story    # 无视哈希强制重跑（下游随之过期）
+
+输入变化后重跑时，旧产物先改名为 <文件>.stale（各脚本会按已有产物断点续跑，不挪开会混入旧结果）；
+上次失败 / 中断的阶段则保留部分产物，直接续跑。
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from loguru import logger
+
+# ===== 配置区 =====
+ROOT        = Path(__file__).resolve().parent
+STATE_FILE  = ROOT / ".pipeline_state.json"
+RUN_SCRIPT  = ROOT / "run.sh"                     # 问卷阶段取 run.sh 中的每一行配置
+RAW_JSON    = "人格特质50位受试者原始数据.json"
+UID_EXCEL   = "人格朋友圈尝试代入分析.xlsx"
+QUESTIONS_JSON = "CBF-PI-B.json"                  # 问卷题库（cbfpib_completion.CBFPIB）
+MAX_JOBS    = 3                                   # 同时运行的阶段数（每个阶段内部还有自己的 API 并发）
+API_ENV     = ["LLM_API_URL"]                     # 影响产物的环境变量（API Key 不计入）
+
+# 阶段声明：script 与 args 组成命令（解释器为当前 python），copy 为进程内复制阶段
+STAGES = [
+    {"name": "generate_prompt_payload", "script": "generate_prompt_payload.py",
+     "args": ["--input", RAW_JSON, "--output", "bigfive_prompt_payload_raw.json", "--topk", "80"],
+     "inputs": [RAW_JSON], "outputs": ["bigfive_prompt_payload_raw.json"]},
+    {"name": "matching", "script": "matching.py",
+     "args": ["--excel", UID_EXCEL, "--json", "bigfive_prompt_payload_raw.json",
+              "--output", "bigfive_prompt_payload.json", "--name-col", "用户昵称", "--uid-col", "编号"],
+     "inputs": [UID_EXCEL, "bigfive_prompt_payload_raw.json"], "outputs": ["bigfive_prompt_payload.json"]},
+    {"name": "generate_memory", "script": "generate_memory.py", "env": API_ENV,
+     "inputs": ["bigfive_prompt_payload.json"], "outputs": ["bigfive_story.json"]},
+    {"name": "promote_memories", "copy": ["bigfive_story.json", "bigfive_memories.json"]},
+    {"name": "generate_story", "script": "generate_story.py", "env": API_ENV,
+     "inputs": ["bigfive_memories.json"], "outputs": ["stories.json"]},
+    {"name": "promote_stories", "copy": ["stories.json", "bigfive_stories.json"]},
+    {"name": "direct_evaluation", "script": "direct_evaluation.py", "env": API_ENV,
+     "inputs": ["bigfive_prompt_payload.json"], "outputs": ["bigfive_deepseek_scores.json"]},
+    {"name": "regression_memory", "script": "bigfiveRegressionModel.py", "env": ["BIGFIVE_MODEL_SERVER"],
+     "inputs": ["bigfive_memories.json"], "outputs": ["big5_regression_memory.csv"]},
+]
+
+# ----------------- 工具函数 -----------------
+
+
+def survey_stages(script: Path = RUN_SCRIPT) -> list[dict]:
+    """
+    run.sh 中每行 cbfpib_completion.py 配置 → 一个问卷阶段（结果文件名沿用 run_config.result_path 的规则）。
+    只用 run_config，不导入 cbfpib_completion、不建目录：--status 也会走到这里。
+    """
+    if not script.exists():
+        return []
+    import run_config
+    parser = run_config.build_parser()
+    stages = []
+    for argv in run_config.parse_run_script(script):
+        args = parser.parse_args(argv)
+        outfile = run_config.result_path(args)
+        personas = "bigfive_memories.json" if args.data_type == "memory" else "bigfive_stories.json"
+        inputs = [personas, QUESTIONS_JSON] + ([args.users_file] if args.users_file else [])
+        stages.append({"name": "survey_" + outfile.stem.removeprefix("bigfive_result_"),
+                       "script": "cbfpib_completion.py", "args": argv, "env": API_ENV,
+                       "inputs": inputs, "outputs": [outfile.as_posix()]})
+    return stages
+
+
+def load_stages(with_survey: bool = True) -> dict[str, dict]:
+    stages = STAGES + (survey_stages() if with_survey else [])
+    for st in stages:
+        if "copy" in st:
+            st.setdefault("inputs", [st["copy"][0]])
+            st.setdefault("outputs", [st["copy"][1]])
+    by_name = {st["name"]: st for st in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("阶段名重复")
+    return by_name
+
+
+def build_graph(stages: dict[str, dict]) -> dict[str, set[str]]:
+    """{阶段: 其上游阶段}；输入文件由哪个阶段产出即依赖哪个阶段，没人产出的视为源文件"""
+    producer = {}
+    for name, st in stages.items():
+        for out in st["outputs"]:
+            if out in producer:
+                raise ValueError(f"{out} 同时由 {producer[out]} 与 {name} 产出")
+            producer[out] = name
+    return {name: {producer[i] for i in st["inputs"] if i in producer} for name, st in stages.items()}
+
+
+def topo_order(graph: dict[str, set[str]]) -> list[str]:
+    order, seen, visiting = [], set(), set()
+
+    def visit(n):
+        if n in seen:
+            return
+        if n in visiting:
+            raise ValueError(f"阶段依赖成环：{n}")
+        visiting.add(n)
+        for d in sorted(graph[n]):
+            visit(d)
+        visiting.discard(n)
+        seen.add(n)
+        order.append(n)
+    for n in graph:
+        visit(n)
+    return order
+
+
+def local_modules(script: str) -> list[str]:
+    """脚本及其（递归）import 的仓库内模块，作为该阶段的代码依赖"""
+    found, todo = [], [script]
+    while todo:
+        rel = todo.pop()
+        if rel in found:
+            continue
+        found.append(rel)
+        tree = ast.parse((ROOT / rel).read_text(encoding="utf-8"))
+        for node in ast.walk(tree):
+            names = [a.name for a in node.names] if isinstance(node, ast.Import) else \
+                    [node.module] if isinstance(node, ast.ImportFrom) and node.module and not node.level else []
+            for mod in names:
+                path = mod.split(".")[0] + ".py"
+                if (ROOT / path).exists():
+                    todo.append(path)
+    return sorted(found)
+
+
+class FileHasher:
+    """sha1 文件哈希，按 (大小, mtime) 缓存，避免每次都重读大文件"""
+
+    def __init__(self, cache: dict):
+        self.cache = cache
+
+    def __call__(self, rel: str) -> str | None:
+        path = ROOT / rel
+        if not path.exists():
+            return None
+        st = path.stat()
+        sig = [st.st_size, st.st_mtime_ns]
+        hit = self.cache.get(rel)
+        if hit and hit[:2] == sig:
+            return hit[2]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        self.cache[rel] = sig + [h.hexdigest()]
+        return h.hexdigest()
+
+
+def fingerprint(st: dict, hasher: FileHasher) -> dict:
+    """阶段的依赖指纹：输入、代码、参数、环境变量各自的哈希，以及合成的 key"""
+    fp = {
+        "inputs": {i: hasher(i) for i in st["inputs"]},
+        "code": {c: hasher(c) for c in local_modules(st["script"])} if "script" in st else {},
+        "params": {"args": st.get("args", []), "copy": st.get("copy")},
+        "env": {k: os.getenv(k) for k in st.get("env", [])},
+    }
+    fp["key"] = hashlib.sha1(json.dumps(fp, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    return fp
+
+
+def stale_reasons(st: dict, fp: dict, record: dict | None, hasher: FileHasher) -> list[str]:
+    """为空表示最新；否则列出过期原因"""
+    missing = [i for i, h in fp["inputs"].items() if h is None]
+    if missing:
+        return [f"缺少输入 {', '.join(missing)}"]
+    if record is None:
+        return ["没有成功记录"]
+    reasons = []
+    if record["key"] != fp["key"]:
+        for part in ("inputs", "code", "params", "env"):
+            old, new = record.get(part, {}), fp[part]
+            if old == new:
+                continue
+            if isinstance(new, dict) and part != "params":
+                changed = sorted(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+                reasons.append(f"{part} 变化：{', '.join(changed)}")
+            else:
+                reasons.append(f"{part} 变化")
+    for out, h in record.get("outputs", {}).items():
+        now = hasher(out)
+        if now is None:
+            reasons.append(f"产物 {out} 不存在")
+        elif now != h:
+            reasons.append(f"产物 {out} 被改动")
+    return reasons
+
+
+def load_state() -> dict:
+    if STATE_FILE.exists():
+        return json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    return {"stages": {}, "files": {}}
+
+
+def save_state(state: dict):
+    tmp = STATE_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, STATE_FILE)
+
+
+# ----------------- 核心函数 -----------------
+def run_stage(st: dict, log_dir: Path) -> float:
+    """执行一个阶段，返回耗时；失败抛 RuntimeError"""
+    t0 = time.perf_counter()
+    if "copy" in st:
+        src, dst = st["copy"]
+        shutil.copyfile(ROOT / src, ROOT / dst)
+        return time.perf_counter() - t0
+    cmd = [sys.executable, st["script"], *st.get("args", [])]
+    log_dir.mkdir(parents=True, exist_ok=True)
+    log_path = log_dir / f"{st['name']}.log"
+    logger.info(f"[{st['name']}] {shlex.join(cmd[1:])}（日志 → {log_path}）")
+    with open(log_path, "w", encoding="utf-8") as log:
+        proc = subprocess.run(cmd, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    if proc.returncode != 0:
+        raise RuntimeError(f"退出码 {proc.returncode}，详见 {log_path}")
+    missing = [o for o in st["outputs"] if not (ROOT / o).exists()]
+    if missing:
+        raise RuntimeError(f"未生成产物 {', '.join(missing)}")
+    return time.perf_counter() - t0
+
+
+def set_aside(st: dict):
+    """依赖变化后重跑前，把旧产物挪成 .stale，避免脚本的断点续跑沿用旧结果"""
+    for out in st["outputs"]:
+        path = ROOT / out
+        if path.exists():
+            path.replace(path.with_name(path.name + ".stale"))
+            logger.warning(f"[{st['name']}] 旧产物已挪到 {path.name}.stale")
+
+
+def select(graph: dict[str, set[str]], targets: list[str]) -> set[str]:
+    """目标阶段及其全部上游"""
+    chosen, todo = set(), list(targets)
+    while todo:
+        n = todo.pop()
+        if n not in graph:
+            raise SystemExit(f"未知阶段 {n}，可选：{', '.join(graph)}")
+        if n not in chosen:
+            chosen.add(n)
+            todo.extend(graph[n])
+    return chosen
+
+
+def status(stages: dict[str, dict], graph: dict[str, set[str]], state: dict, force: set[str]):
+    """打印各阶段状态；上游过期的阶段记为"随上游"，实际是否需要重跑要等上游产物出来再判断"""
+    hasher = FileHasher(state["files"])
+    pending = set()
+    for name in topo_order(graph):
+        st = stages[name]
+        if name in force:
+            reasons = ["--force"]
+        elif graph[name] & pending:
+            reasons = [f"随上游 {', '.join(sorted(graph[name] & pending))}"]
+        else:
+            reasons = stale_reasons(st, fingerprint(st, hasher), state["stages"].get(name), hasher)
+        if reasons:
+            pending.add(name)
+        print(f"{'过期' if reasons else '最新'}  {name:<36s} {'；'.join(reasons)}")
+    save_state(state)
+
+
+def build(stages: dict[str, dict], graph: dict[str, set[str]], state: dict, force: set[str],
+          jobs: int = MAX_JOBS, log_dir: Path = ROOT / "logs" / "pipeline") -> bool:
+    """
+    按拓扑顺序调度：上游全部结束（最新 / 成功）后再判断本阶段是否过期，
+    这样上游重跑但产物内容没变时，下游不会被连带重跑。
+    """
+    hasher = FileHasher(state["files"])
+    remaining = {n: set(deps) for n, deps in graph.items()}
+    running, ok = {}, True
+
+    def fail(name, err):
+        nonlocal remaining, ok
+        logger.error(f"[{name}] 失败：{err}")
+        ok = False
+        for n in sorted(n for n, deps in remaining.items() if name in deps):
+            logger.warning(f"[{n}] 上游 {name} 失败，跳过")
+        remaining = {n: deps for n, deps in remaining.items() if name not in deps}
+
+    def launch(pool, name):
+        st = stages[name]
+        fp = fingerprint(st, hasher)
+        record = state["stages"].get(name)
+        missing = [i for i, h in fp["inputs"].items() if h is None]
+        if missing:
+            raise RuntimeError(f"缺少输入 {', '.join(missing)}")
+        reasons = ["--force"] if name in force else stale_reasons(st, fp, record, hasher)
+        if not reasons:
+            logger.info(f"[{name}] 最新，跳过")
+            return None
+        logger.info(f"[{name}] 需要重建：{'；'.join(reasons)}")
+        if record is not None:
+            set_aside(st)
+        state["stages"].pop(name, None)
+        save_state(state)
+        return pool.submit(run_stage, st, log_dir), fp
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while remaining or running:
+            ready = [n for n, deps in remaining.items() if not deps]
+            while ready:                         # 跳过的阶段会让下游立即就绪
+                name = ready.pop()
+                del remaining[name]
+                try:
+                    job = launch(pool, name)
+                except Exception as e:
+                    fail(name, e)
+                    continue
+                if job is None:
+                    for n, deps in remaining.items():
+                        if name in deps:
+                            deps.discard(name)
+                            if not deps:
+                                ready.append(n)
+                else:
+                    running[job[0]] = (name, job[1])
+            if not running:
+                if remaining:                    # 只剩依赖失败阶段的下游
+                    for name in sorted(remaining):
+                        logger.warning(f"[{name}] 上游失败，跳过")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, fp = running.pop(fut)
+                try:
+                    seconds = fut.result()
+                except Exception as e:
+                    fail(name, e)
+                    continue
+                state["stages"][name] = {**fp, "outputs": {o: hasher(o) for o in stages[name]["outputs"]},
+                                         "seconds": round(seconds, 1),
+                                         "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+                save_state(state)
+                logger.success(f"[{name}] 完成，用时 {seconds:.1f}s")
+                for deps in remaining.values():
+                    deps.discard(name)
+    return ok
+
+
+# ----------------- 主入口 -----------------
+def main():
+    parser = argparse.ArgumentParser(description="按内容哈希增量执行 Big Five 流水线")
+    parser.add_argument("targets", nargs="*", help="只构建这些阶段（连同其上游），默认全部")
+    parser.add_argument("--status", action="store_true", help="只打印各阶段是否过期，不执行")
+    parser.add_argument("--force", nargs="*", default=None, help="强制重跑的阶段（不给名字则全部）")
+    parser.add_argument("--jobs", type=int, default=MAX_JOBS, help="同时运行的阶段数")
+    parser.add_argument("--no-survey", action="store_true", help="不从 run.sh 生成问卷阶段")
+    parser.add_argument("--list", action="store_true", help="列出阶段及其输入输出")
+    args = parser.parse_args()
+
+    stages = load_stages(with_survey=not args.no_survey)
+    graph = build_graph(stages)
+    if args.targets:
+        chosen = select(graph, args.targets)
+        stages = {n: st for n, st in stages.items() if n in chosen}
+        graph = {n: deps & chosen for n, deps in graph.items() if n in chosen}
+    force = set() if args.force is None else set(args.force or stages)
+
+    if args.list:
+        for name in topo_order(graph):
+            st = stages[name]
+            print(f"{name:<36s} {', '.join(st['inputs'])} → {', '.join(st['outputs'])}")
+        return
+    state = load_state()
+    if args.status:
+        status(stages, graph, state, force)
+        return
+    if not build(stages, graph, state, force, args.jobs):
+        sys.exit(1)
+    logger.success("流水线已是最新")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+plan_run.py
+------------------------------------------
+问卷运行的离线预估（dry-run）：不发任何网络请求，按 cbfpib_completion.py 的逻辑渲染每一条
+将要发送的 prompt，本地计数 token，再按延迟 / 限流 / 价格画像估算调用数、费用与墙钟时间。
+不写任何文件（不建 results/，--token-budget 的裁剪缓存只读不写）；--retrieval-k 时不编码句向量，
+按 k × 该用户记忆平均 token 估算；tokenizer 只从本地缓存加载（local_files_only），没有时按字符粗略估计。
+
+    python plan_run.py                                  # 解析 run.sh 中的每一行配置
+    python plan_run.py --config "--model qwen-turbo --data-type story --repeat 5 --cot"
+    python cbfpib_completion.py --model qwen-turbo --data-type memory --repeat 5 --dry-run
+
+延迟画像优先使用实测值：cbfpib_completion.py 每次运行结束会把 <模型>[_cot] 的延迟分位数与
+失败率写入 latency_profiles.json；没有实测值时回退到 MODEL_PROFILES 的经验值。
+限流（RPM / TPM）与价格（元 / 千 token）以服务商控制台为准，可用 --profiles 覆盖。
+"""
+
+import argparse
+import json
+import shlex
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+import cbfpib_completion as cb
+import persona_compact
+from run_config import parse_run_script
+
+# ===== 配置区 =====
+RUN_SCRIPT       = Path("run.sh")
+MEASURED_FILE    = Path("latency_profiles.json")    # cbfpib_completion.py 写入的实测延迟
+CHAT_OVERHEAD    = 8                                # 每条消息的模板 token（role 标记等）
+
+# 经验画像：latency_s 为无 CoT 时单次调用均值，s_per_out_token 为每个输出 token 的额外耗时
+MODEL_PROFILES = {
+    "default":    {"latency_s": 1.5, "s_per_out_token": 0.02, "rpm": 600, "tpm": 1_000_000,
+                   "price_in": 0.0008, "price_out": 0.002, "retry_rate": 0.02},
+    "qwen-turbo": {"latency_s": 0.6, "s_per_out_token": 0.01, "rpm": 1200, "tpm": 5_000_000,
+                   "price_in": 0.0003, "price_out": 0.0006, "retry_rate": 0.02},
+}
+# 每次回答的输出 token 估计
+OUTPUT_TOKENS = {"direct": 2, "cot": 250, "thinking": 600}
+
+# ----------------- 工具函数 -----------------
+
+
+def make_counter(approx: bool):
+    """带记忆的 token 计数；同一用户各题共用 system prompt，只需数一次"""
+    count = persona_compact.approx_tokens if approx else persona_compact.count_tokens
+    memo = {}
+
+    def counter(text: str) -> int:
+        if text not in memo:
+            memo[text] = count(text)
+        return memo[text]
+    return counter
+
+
+def load_profile(model: str, cot: bool, thinking: bool, overrides: dict) -> dict:
+    """经验画像 ← 实测延迟 ← --profiles 覆盖，依次叠加"""
+    profile = {**MODEL_PROFILES["default"], **MODEL_PROFILES.get(model, {})}
+    out_tokens = OUTPUT_TOKENS["thinking" if thinking else "cot" if cot else "direct"]
+    profile["out_tokens"] = out_tokens
+    profile["call_s"] = profile["latency_s"] + profile["s_per_out_token"] * out_tokens
+    profile["source"] = "经验值"
+
+    measured = json.loads(MEASURED_FILE.read_text("utf-8")) if MEASURED_FILE.exists() else {}
+    m = measured.get(f"{model}{'_cot' if cot else ''}{'_thinking' if thinking else ''}")
+    if m and m.get("mean_s"):
+        profile["call_s"] = m["mean_s"]
+        profile["retry_rate"] = m.get("retry_rate", profile["retry_rate"])
+        profile["source"] = f"实测({m.get('samples', 0)} 样本)"
+    profile.update(overrides.get("default", {}))
+    profile.update(overrides.get(model, {}))
+    return profile
+
+
+def retrieval_prompt_tokens(entry: dict, questions: list[dict], count) -> list[int] | None:
+    """
+    检索模式下每次调用的 prompt token 估计（不编码、不检索）：
+    system prompt = 模板 + min(k, 记忆数) × 该用户记忆的平均 token；没有记忆时返回 None，按全量渲染
+    """
+    mems = [m for kw in entry.get("keywords", []) for m in kw.get("memories", [])]
+    if not mems:
+        return None
+    head, tail = cb.system_prompt_raw
+    mean_mem = sum(count(m) for m in mems) / len(mems)
+    system = count(head + tail) + round(min(cb.retrieval_k, len(mems)) * mean_mem) + CHAT_OVERHEAD
+    per_item = [system + count(cb.USER_PROMPT[0] + q["text"]) + CHAT_OVERHEAD for q in questions]
+    return per_item * cb.repeat
+
+
+# ----------------- 核心函数 -----------------
+def plan_config(args, count, overrides: dict, concurrency: int, include_done: bool = False) -> dict:
+    """渲染一个配置的全部请求，返回该配置的预估行"""
+    cb.configure_run(args)
+    outfile = cb.result_path(args)
+    data = cb.load_personas(args, write_cache=False)
+    done = {entry["user"] for entry in cb.load_output(outfile)}
+    if not include_done:
+        data = [entry for entry in data if entry["user"] not in done]
+    questions = json.loads(Path(cb.CBFPIB).read_text(encoding="utf-8"))
+
+    calls = prompt_tokens = max_prompt = 0
+    for entry in data:
+        sizes = retrieval_prompt_tokens(entry, questions, count) if cb.retrieval_k else None
+        if sizes is None:
+            tasks, _ = cb.build_user_tasks(entry, questions, args.seed)
+            sizes = [sum(count(m["content"]) + CHAT_OVERHEAD for m in messages) for messages in tasks.values()]
+        for n in sizes:
+            calls += 1
+            prompt_tokens += n
+            max_prompt = max(max_prompt, n)
+
+    p = load_profile(args.model, args.cot, args.thinking, overrides)
+    factor = 1 + p["retry_rate"]
+    eff_calls = calls * factor
+    completion_tokens = calls * p["out_tokens"]
+    cost = (prompt_tokens * p["price_in"] + completion_tokens * p["price_out"]) / 1000 * factor
+    limits = {
+        "latency": eff_calls * p["call_s"] / concurrency,
+        "rpm": eff_calls / p["rpm"] * 60,
+        "tpm": (prompt_tokens + completion_tokens) * factor / p["tpm"] * 60,
+    }
+    bottleneck = max(limits, key=limits.get)
+    return {
+        "config": outfile.stem, "users": len(data), "skipped_done": 0 if include_done else len(done),
+        "calls": calls, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+        "max_prompt_tokens": max_prompt, "cost": round(cost, 2), "wall_h": round(limits[bottleneck] / 3600, 2),
+        "bottleneck": bottleneck, "profile": p["source"],
+    }
+
+
+def plan(configs: list[list[str]], approx: bool = False, profiles: Path | None = None,
+         concurrency: int = cb.MAX_API_CONC, include_done: bool = False) -> pd.DataFrame:
+    overrides = json.loads(profiles.read_text("utf-8")) if profiles else {}
+    persona_compact.set_offline()                   # 计数与 --token-budget 裁剪都不联网下载 tokenizer
+    count = make_counter(approx)
+    parser = cb.build_parser()
+    rows = [plan_config(parser.parse_args(argv), count, overrides, concurrency, include_done) for argv in configs]
+    df = pd.DataFrame(rows)
+    if len(df):
+        total = {"config": "TOTAL", **{c: df[c].sum() for c in
+                 ("users", "calls", "prompt_tokens", "completion_tokens", "cost", "wall_h")}}
+        df = pd.concat([df, pd.DataFrame([total])], ignore_index=True)
+    return df
+
+
+def print_plan(df: pd.DataFrame, output: Path | None = None):
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(df.fillna("").to_string(index=False))
+    if output:
+        df.to_csv(output, index=False)
+        logger.success(f"预估表已写入 {output}")
+
+
+# ----------------- 主入口 -----------------
+def main():
+    parser = argparse.ArgumentParser(description="问卷运行离线预估（不访问网络）")
+    parser.add_argument("--script", type=Path, default=RUN_SCRIPT, help="从脚本中解析配置（默认 run.sh）")
+    parser.add_argument("--config", action="append", default=None,
+                        help="直接给出一组 cbfpib_completion.py 参数（可多次），指定后忽略 --script")
+    parser.add_argument("--profiles", type=Path, default=None, help="覆盖画像的 JSON：{模型: {rpm, tpm, price_in, ...}}")
+    parser.add_argument("--concurrency", type=int, default=cb.MAX_API_CONC, help="API 并发数")
+    parser.add_argument("--approx-tokens", action="store_true", help="不加载 tokenizer，按字符粗略计数")
+    parser.add_argument("--include-done", action="store_true", help="已有结果的用户也计入")
+    parser.add_argument("--output", type=Path, default=None, help="CSV 输出路径")
+    args = parser.parse_args()
+
+    configs = [shlex.split(c) for c in args.config] if args.config else parse_run_script(args.script)
+    print_plan(plan(configs, args.approx_tokens, args.profiles, args.concurrency, args.include_done), args.output)
+
+
+if __name__ == "__main__":
+    main()
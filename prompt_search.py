@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+prompt_search.py
+------------------------------------------
+用 successive halving 在 prompt 变体之间做筛选，而不是每个变体都跑满 50 人 × 40 题 × 5 次：
+
+    变体 = data_type(memory/story) × cot × zeroshot，共 8 个（prompt_generator.py 的网格）
+    第 r 轮：存活变体在前 users0·eta^r 个用户、repeat0·eta^r 次重复上作答（封顶为全部用户 / max-repeat），
+            与 cbfpib.csv 的真实维度分比较，按误差保留前 1/eta，直到只剩一个或用户用完。
+
+用户子集按随机种子固定顺序抽取，后续轮次只补新增的 (用户, repeat)，已答过的题从缓存复用；
+缓存 results/prompt_search_<模型>_answers.jsonl 也支持中断后续跑。
+
+    python prompt_search.py --model qwen-turbo --users0 4 --repeat0 1 --max-repeat 5
+"""
+
+import argparse
+import csv
+import json
+import math
+import random
+from collections import defaultdict
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import cbfpib_completion as cb
+from scheduler import FairScheduler
+
+# ===== 配置区 =====
+TRUTH_CSV   = Path("cbfpib.csv")
+ANSWER_LOG  = "results/prompt_search_{tag}_answers.jsonl"     # tag = 模型名[_thinking]
+ROUNDS_CSV  = "results/prompt_search_{tag}_rounds.csv"
+DIMS        = ["N", "C", "A", "O", "E"]
+VARIANTS    = [{"data_type": d, "cot": c, "zeroshot": z}
+               for d, c, z in product(["memory", "story"], [False, True], [False, True])]
+
+# ----------------- 工具函数 -----------------
+
+
+def variant_name(v: dict) -> str:
+    return f"{v['data_type']}{'_cot' if v['cot'] else ''}{'_zeroshot' if v['zeroshot'] else ''}"
+
+
+def load_truth() -> dict:
+    with open(TRUTH_CSV, encoding="utf-8-sig") as f:
+        return {row["user"]: {d: float(row[d]) for d in DIMS} for row in csv.DictReader(f)}
+
+
+def load_answers(path: Path) -> dict:
+    """{(变体, 用户, repeat, 题号): 评分}"""
+    answers = {}
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                r = json.loads(line)
+                answers[(r["variant"], r["user"], r["rep"], r["qid"])] = r["answer"]
+    return answers
+
+
+def append_answers(path: Path, variant: str, user: str, results: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for (rep, qid), (answer, text) in results.items():
+            f.write(json.dumps({"variant": variant, "user": user, "rep": rep, "qid": qid,
+                                "answer": answer, "text": text}, ensure_ascii=False) + "\n")
+
+
+def score_variant(variant: str, users: list[str], n_rep: int, answers: dict,
+                  questions: list[dict], truth: dict) -> dict:
+    """维度分（跨 repeat 取均值）与真实值的 MAE，以及各维度跨用户相关系数的均值"""
+    pred = []
+    for user in users:
+        dims = defaultdict(float)
+        for rep in range(n_rep):
+            for q in questions:
+                a = answers[(variant, user, rep, q["id"])]
+                dims[q["dimension"]] += (7 - a if q["reverse"] else a) / n_rep
+        pred.append([dims[d] for d in DIMS])
+    pred = np.array(pred)
+    true = np.array([[truth[u][d] for d in DIMS] for u in users])
+    mae = float(np.abs(pred - true).mean())
+    corrs = [np.corrcoef(pred[:, j], true[:, j])[0, 1] for j in range(len(DIMS))
+             if len(users) >= 3 and pred[:, j].std() > 0 and true[:, j].std() > 0]
+    return {"mae": round(mae, 3), "corr": round(float(np.mean(corrs)), 3) if corrs else None}
+
+
+# ----------------- 核心函数 -----------------
+def run_round(variants: list[dict], users: list[str], n_rep: int, personas: dict,
+              questions: list[dict], answers: dict, log_path: Path, args) -> int:
+    """补齐存活变体在 (users × n_rep) 上缺的回答，返回本轮实际调用数"""
+    sched = FairScheduler(n_workers=cb.MAX_WORKERS, max_attempts=cb.MAX_RETRY, demote_after=cb.DEMOTE_AFTER,
+                          backoff=cb.retry_backoff)
+    n_calls = 0
+    for v in variants:
+        name = variant_name(v)
+        cb.setup_run(argparse.Namespace(model=args.model, data_type=v["data_type"], cot=v["cot"],
+                                        zeroshot=v["zeroshot"], repeat=n_rep, thinking=args.thinking,
+                                        retrieval_k=0, token_budget=0))
+        for user in users:
+            tasks, _ = cb.build_user_tasks(personas[v["data_type"]][user], questions, args.seed)
+            tasks = {k: m for k, m in tasks.items() if (name, user, k[0], k[1]) not in answers}
+            if tasks:
+                sched.add_job((name, user), tasks)
+                n_calls += len(tasks)
+    if not n_calls:
+        return 0
+    logger.info(f"本轮需要 {n_calls} 次调用")
+    for (name, user), results, exc in sched.run(cb.ask_item):
+        if exc is not None:
+            raise RuntimeError(f"{name} / {user} 作答失败：{exc}")
+        append_answers(log_path, name, user, results)
+        for (rep, qid), (answer, _) in results.items():
+            answers[(name, user, rep, qid)] = answer
+    return n_calls
+
+
+def successive_halving(args):
+    truth = load_truth()
+    questions = json.loads(Path(cb.CBFPIB).read_text(encoding="utf-8"))
+    personas = {
+        "memory": {e["user"]: e for e in json.loads(Path("bigfive_memories.json").read_text("utf-8"))},
+        "story":  {e["user"]: e for e in json.loads(Path("bigfive_stories.json").read_text("utf-8"))},
+    }
+    pool = sorted(set(truth) & set(personas["memory"]) & set(personas["story"]))
+    if not pool:
+        raise SystemExit("没有同时具备真实分数、记忆与故事的用户，请先生成 bigfive_memories.json / bigfive_stories.json")
+    random.Random(args.seed).shuffle(pool)
+    max_users = min(args.max_users or len(pool), len(pool))
+
+    variants = [v for v in VARIANTS if not args.variants or variant_name(v) in args.variants]
+    if not variants:
+        raise SystemExit(f"--variants 没有匹配的变体，可选：{', '.join(variant_name(v) for v in VARIANTS)}")
+    tag = f"{args.model}{'_thinking' if args.thinking else ''}"
+    log_path, rounds_csv = Path(ANSWER_LOG.format(tag=tag)), Path(ROUNDS_CSV.format(tag=tag))
+    answers = load_answers(log_path)
+    rounds, total_calls, r = [], 0, 0
+    while True:
+        n_users = min(args.users0 * args.eta ** r, max_users)
+        n_rep = min(args.repeat0 * args.eta ** r, args.max_repeat)
+        users = pool[:n_users]
+        logger.info(f"第 {r} 轮：{len(variants)} 个变体 × {n_users} 用户 × {n_rep} 次重复")
+        total_calls += run_round(variants, users, n_rep, personas, questions, answers, log_path, args)
+
+        scored = []
+        for v in variants:
+            s = score_variant(variant_name(v), users, n_rep, answers, questions, truth)
+            scored.append((s["mae"], v))
+            rounds.append({"round": r, "variant": variant_name(v), "users": n_users, "repeat": n_rep, **s})
+            logger.info(f"  {variant_name(v):<24s} MAE={s['mae']:.3f} corr={s['corr']}")
+        scored.sort(key=lambda x: x[0])
+
+        if n_users >= max_users and n_rep >= args.max_repeat:
+            break
+        variants = [v for _, v in scored[:max(1, math.ceil(len(variants) / args.eta))]]
+        if len(variants) == 1:
+            break
+        r += 1
+
+    rounds_csv.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(rounds).to_csv(rounds_csv, index=False)
+    exhaustive = len(VARIANTS) * max_users * args.max_repeat * len(questions)
+    logger.success(f"最优变体：{variant_name(scored[0][1])}（MAE={scored[0][0]:.3f}）；"
+                   f"本次调用 {total_calls} 次，穷举需要 {exhaustive} 次；各轮得分 → {rounds_csv}")
+
+
+# ----------------- 主入口 -----------------
+def main():
+    parser = argparse.ArgumentParser(description="Successive halving 筛选 prompt 变体")
+    parser.add_argument("--model", type=str, required=True, help="模型名称，例如 qwen-turbo")
+    parser.add_argument("--thinking", action="store_true", help="是否启用模型自带的思考模式")
+    parser.add_argument("--users0", type=int, default=4, help="第一轮用户数")
+    parser.add_argument("--repeat0", type=int, default=1, help="第一轮重复次数")
+    parser.add_argument("--max-users", type=int, default=0, help="用户数上限（0 为全部）")
+    parser.add_argument("--max-repeat", type=int, default=5, help="重复次数上限")
+    parser.add_argument("--eta", type=int, default=2, help="每轮保留 1/eta，资源放大 eta 倍")
+    parser.add_argument("--variants", nargs="*", default=None, help="只比较指定变体，例如 memory_cot story")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子（用户抽样与记忆打乱）")
+    args = parser.parse_args()
+    successive_halving(args)
+
+
+if __name__ == "__main__":
+    main()
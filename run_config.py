@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+run_config.py
+------------------------------------------
+问卷运行配置的轻量部分：命令行参数、结果文件命名、run.sh 解析。
+只依赖标准库，pipeline.py --list / --status 之类只需要文件名的场景不必导入 cbfpib_completion
+（requests、prompt 模板等），也不会有建目录之类的副作用。
+"""
+
+import argparse
+import shlex
+from pathlib import Path
+
+
+def add_run_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """问卷运行的公共参数，其他驱动脚本（批量模式等）复用"""
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，默认为 42")
+    parser.add_argument("--model", type=str, required=True ,help="模型名称，例如 qwen-turbo")
+    parser.add_argument("--data-type", type=str, default="memory", choices=["memory", "story"], help="处理类型，默认为 memory")
+    parser.add_argument("--cot", action="store_true", help="是否启用 Chain of Thought (CoT) 模式")
+    parser.add_argument("--zeroshot", action="store_true", help="是否启用zeroshot")
+    parser.add_argument("--repeat", type=int, default=1, help="重复次数，默认为 1")
+    parser.add_argument("--thinking", action="store_true", help="是否启用模型自带的思考模式")
+    parser.add_argument("--token-budget", type=int, default=0, help="人格画像 token 上限，超出按关键词权重裁剪（0 为不限制）")
+    parser.add_argument("--retrieval-k", type=int, default=0, help="检索模式：每道题只提供最相关的 k 条记忆（仅 memory，0 为关闭）")
+    parser.add_argument("--users-file", type=str, default=None, help="只跑文件中列出的用户（每行一个，见 persona_index.py select）")
+    return parser
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = add_run_args(argparse.ArgumentParser(description="CBF-PI-B Memory Zero-shot Processing"))
+    parser.add_argument("--dry-run", action="store_true", help="只预估调用数 / token / 费用 / 耗时，不发请求（见 plan_run.py）")
+    parser.add_argument("--trace", type=str, default=None, help="开启阶段追踪，退出时把 Chrome trace 写到该路径（见 tracing.py）")
+    return parser
+
+def users_suffix(args) -> str:
+    """只跑部分用户时结果另存，避免与全量结果混在同一个文件里续跑"""
+    users_file = getattr(args, "users_file", None)
+    return f"_users-{Path(users_file).stem}" if users_file else ""
+
+def result_path(args) -> Path:
+    """本次运行的结果文件路径；只按参数计算，不设置全局变量也不创建目录"""
+    k = args.retrieval_k if args.data_type == "memory" else 0
+    outfile_path = f'''bigfive_result_{args.model}_{args.data_type}{"_cot" if args.cot else ""}{"_zeroshot" if args.zeroshot else ""}{f"_tok{args.token_budget}" if args.token_budget else ""}{f"_rag{k}" if k else ""}{users_suffix(args)}_repeat{args.repeat}.json'''
+    return Path.joinpath(Path("results"), Path(outfile_path))
+
+def parse_run_script(path: Path) -> list[list[str]]:
+    """取出脚本中每一行 cbfpib_completion.py 的参数"""
+    configs = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if line.startswith("#") or "cbfpib_completion.py" not in line:
+            continue
+        argv = shlex.split(line)
+        configs.append(argv[argv.index(next(a for a in argv if a.endswith("cbfpib_completion.py"))) + 1:])
+    return configs
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scheduler.py
+------------------------------------------
+任务级公平调度：把每个用户拆成若干小任务（如 (repeat, 题号)），放进共享队列由固定数量的工作线程执行。
+
+    * 主通道按用户到达顺序取任务，单用户同时在跑的任务数有上限，先到的用户先完成；
+    * 同一任务连续失败 demote_after 次后降级到低优先级重试通道（带退避），
+      只在主通道空闲或每 retry_every 次取任务时才轮到它，不再占着线程拖慢健康用户；
+    * 任务失败达到 max_attempts 次（或 backoff 返回 None）时整个用户判定失败，其余任务直接丢弃。
+
+用法：
+    sched = FairScheduler(n_workers=4, max_attempts=200)
+    for uid, tasks in ...:
+        sched.add_job(uid, tasks)            # tasks: {key: payload}
+    for job_id, results, error in sched.run(fn):   # fn(payload) -> 结果，失败抛异常
+        ...                                  # 在调用线程中按完成顺序逐个返回
+
+流式模式（streaming=True）下 run() 期间可以从其他线程继续 add_job，调用 close() 表示不再有新用户，
+此后所有已加入的用户结束时 run() 返回。
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+from tracing import span
+
+
+class _Job:
+    __slots__ = ("job_id", "pending", "inflight", "remaining", "results", "error")
+
+    def __init__(self, job_id, tasks: dict):
+        self.job_id = job_id
+        self.pending = deque((key, payload, 0) for key, payload in tasks.items())
+        self.inflight = 0
+        self.remaining = len(tasks)
+        self.results = {}
+        self.error = None
+
+
+class FairScheduler:
+    """按用户公平、带重试降级通道的线程池调度器"""
+
+    def __init__(self, n_workers: int = 4, max_attempts: int = 200, demote_after: int = 3,
+                 per_job_inflight: int | None = None, retry_every: int = 4, backoff=None,
+                 streaming: bool = False):
+        """
+        :param per_job_inflight: 单用户同时执行的任务上限，默认 n_workers // 2（至少 1）
+        :param retry_every:      主通道有活时，每取 retry_every 个任务才从重试通道取一个
+        :param backoff:          backoff(exc, attempts) -> 重新排队前的等待秒数；大于 0 时直接进重试通道，
+                                 返回 None 表示不再重试，该用户立即判定失败。
+                                 默认降级前为 0，降级后 min(2^(n-demote_after), 60)
+        :param streaming:        run() 期间允许继续加入用户，直到 close()
+        """
+        self.n_workers = n_workers
+        self.max_attempts = max_attempts
+        self.demote_after = demote_after
+        self.per_job_inflight = per_job_inflight or max(1, n_workers // 2)
+        self.retry_every = retry_every
+        self.backoff = backoff or (lambda exc, n: 0 if n < demote_after else min(2 ** (n - demote_after), 60))
+
+        self.jobs: OrderedDict = OrderedDict()      # 未结束的用户，保持到达顺序
+        self.retry_lane = []                        # (ready_at, seq, job, key, payload, attempts)
+        self.seq = itertools.count()
+        self.picks = 0
+        self.cond = threading.Condition()
+        self.done = queue.Queue()
+        self.stats = {"tasks": 0, "failures": 0, "demoted": 0}
+        self.closed = not streaming
+        self.added = 0
+
+    def add_job(self, job_id, tasks: dict):
+        with self.cond:
+            self.added += 1
+            job = _Job(job_id, tasks)
+            if not tasks:
+                self.done.put((job_id, {}, None))
+                return
+            self.jobs[job_id] = job
+            self.cond.notify_all()
+
+    def close(self):
+        """流式模式：不再加入新用户"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    # ----------------- 取任务 -----------------
+    def _next_main(self):
+        for job in self.jobs.values():
+            if job.pending and job.inflight < self.per_job_inflight:
+                return job, *job.pending.popleft()
+        return None
+
+    def _next_retry(self, now: float):
+        while self.retry_lane and self.retry_lane[0][0] <= now:
+            _, _, job, key, payload, attempts = heapq.heappop(self.retry_lane)
+            if job.error is None:                   # 用户已判定失败的残留任务直接丢弃
+                return job, key, payload, attempts
+        return None
+
+    def _take(self):
+        """在锁内取下一个任务；没有可执行任务时返回 None"""
+        now = time.monotonic()
+        self.picks += 1
+        prefer_retry = self.picks % self.retry_every == 0
+        task = (self._next_retry(now) or self._next_main()) if prefer_retry else (self._next_main() or self._next_retry(now))
+        if task:
+            task[0].inflight += 1
+        return task
+
+    def _wait_time(self) -> float:
+        if self.retry_lane:
+            return max(0.0, min(1.0, self.retry_lane[0][0] - time.monotonic()))
+        return 1.0
+
+    # ----------------- 结果回收 -----------------
+    def _finish(self, job: _Job):
+        self.jobs.pop(job.job_id, None)
+        self.done.put((job.job_id, job.results, job.error))
+
+    def _on_success(self, job: _Job, key, result):
+        job.inflight -= 1
+        if job.error is not None:
+            return
+        job.results[key] = result
+        job.remaining -= 1
+        if job.remaining == 0:
+            self._finish(job)
+
+    def _on_failure(self, job: _Job, key, payload, attempts: int, exc: Exception):
+        job.inflight -= 1
+        self.stats["failures"] += 1
+        if job.error is not None:
+            return
+        delay = self.backoff(exc, attempts)
+        if attempts >= self.max_attempts or delay is None:
+            job.error = RuntimeError(f"任务 {key} 失败 {attempts} 次：{exc}")
+            job.pending.clear()
+            self.retry_lane = [t for t in self.retry_lane if t[2] is not job]
+            heapq.heapify(self.retry_lane)
+            self._finish(job)
+            return
+        if attempts < self.demote_after and delay <= 0:
+            job.pending.appendleft((key, payload, attempts))     # 偶发失败：留在主通道立即重试
+            return
+        if attempts == self.demote_after:
+            self.stats["demoted"] += 1
+        heapq.heappush(self.retry_lane, (time.monotonic() + delay, next(self.seq), job, key, payload, attempts))
+
+    # ----------------- 工作线程 -----------------
+    def _worker(self, fn, stop: threading.Event):
+        while True:
+            with self.cond:
+                task = None
+                while not stop.is_set() and (self.jobs or self.retry_lane or not self.closed):
+                    task = self._take()
+                    if task:
+                        break
+                    with span("sched_idle"):
+                        self.cond.wait(self._wait_time())
+                if task is None:
+                    return
+            job, key, payload, attempts = task
+            try:
+                result = fn(payload)
+            except Exception as e:
+                with self.cond:
+                    self._on_failure(job, key, payload, attempts + 1, e)
+                    self.cond.notify_all()
+                continue
+            with self.cond:
+                self.stats["tasks"] += 1
+                self._on_success(job, key, result)
+                self.cond.notify_all()
+
+    def run(self, fn):
+        """
+        启动工作线程执行已加入的任务，按用户完成顺序逐个产出 (job_id, {key: 结果}, error)；
+        error 非 None 表示该用户失败。流式模式下一直产出到 close() 且已加入的用户全部结束。
+        """
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._worker, args=(fn, stop), daemon=True, name=f"sched-{i}")
+                   for i in range(self.n_workers)]
+        for t in threads:
+            t.start()
+        try:
+            yielded = 0
+            while True:
+                with self.cond:
+                    if self.closed and yielded == self.added:
+                        break
+                    closed = self.closed
+                try:
+                    item = self.done.get(timeout=None if closed else 0.5)   # 未 close 时定期醒来检查
+                except queue.Empty:
+                    continue
+                yielded += 1
+                yield item
+        finally:
+            stop.set()
+            with self.cond:
+                self.cond.notify_all()
+            for t in threads:
+                t.join()
@@ -1,16 +1,357 @@
+"""
+statistic.py
+------------------------------------------
+朋友圈原始导出的流式画像：不把整个 JSON 读进内存，一遍扫描得到
+
+    * 不重复用户数 / 朋友圈条目总数 / 图片总数（原有的三项）
+    * 每个用户的条目数、图片数、平均字数
+    * 条目字数分布（分桶直方图 + 分位数）
+    * 每个用户、每个主题的条目数与关键词频次（可直接导出成 人格特质50位受试者原始数据.json 的格式）
+
+文件是一个顶层 JSON 数组。大文件按字节切成若干段并行解析：每段从切点之后的第一个对象起始处
+重新同步，处理起始位置落在本段内的对象；相邻两段的衔接位置会被校验，不一致的段按前一段给出的
+准确起点串行重跑，所以结果与单进程完全一致。
+
+    python statistic.py
+    python statistic.py --input moments.json --workers 8 --emit-raw 人格特质原始数据_new.json
+    python statistic.py --text-field content --theme-field classify.theme --keywords-field classify.keywords
+"""
+
+import argparse
+import bisect
+import codecs
+import csv
 import json
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# ===== 配置区 =====
+INPUT_FILE   = "人格特质图像识别+分类.json"
+CHUNK_BYTES  = 4 << 20                  # 每次读取 4MB
+MIN_SPLIT    = 64 << 20                 # 小于 64MB 的文件不切分
+MAX_OBJECT_CHARS = 64 << 20             # 单条记录的字符上限，超过视为格式错误
+RESYNC_CHARS = 1 << 20                  # 重新同步时试探解码的字符上限
+RESYNC_LOOKAHEAD = 4                    # 重新同步时向后校验的对象数
+LENGTH_BINS  = [0, 10, 20, 50, 100, 200, 500, 1000, 2000]   # 字数分桶下界
+TOP_K        = 10                       # 导出原始数据时每个主题保留的关键词数
+
+_decoder = json.JSONDecoder()
+_WS = " \t\r\n"
+
+# ----------------- 工具函数 -----------------
+
+
+def get_field(obj: dict, path: str):
+    """按 a.b.c 取嵌套字段，缺失时返回 None"""
+    for key in path.split("."):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def new_stats() -> dict:
+    return {
+        "posts": 0, "images": 0,
+        "length_hist": Counter(),
+        "user_posts": Counter(), "user_images": Counter(), "user_chars": Counter(),
+        "theme_posts": defaultdict(Counter),          # user → {theme: 条目数}
+        "theme_keywords": defaultdict(Counter),       # (user, theme) → {关键词: 频次}
+    }
+
+
+def merge_stats(a: dict, b: dict) -> dict:
+    a["posts"] += b["posts"]
+    a["images"] += b["images"]
+    for key in ("length_hist", "user_posts", "user_images", "user_chars"):
+        a[key].update(b[key])
+    for key in ("theme_posts", "theme_keywords"):
+        for k, counter in b[key].items():
+            a[key][k].update(counter)
+    return a
+
+
+def add_post(stats: dict, item: dict, fields: argparse.Namespace):
+    user = get_field(item, fields.user_field)
+    images = len(as_list(get_field(item, fields.images_field)))
+    text = get_field(item, fields.text_field) or ""
+    n_chars = len(text) if isinstance(text, str) else 0
+
+    stats["posts"] += 1
+    stats["images"] += images
+    stats["length_hist"][LENGTH_BINS[bisect.bisect_right(LENGTH_BINS, n_chars) - 1]] += 1
+    stats["user_posts"][user] += 1
+    stats["user_images"][user] += images
+    stats["user_chars"][user] += n_chars
+
+    keywords = get_field(item, fields.keywords_field)
+    for theme in as_list(get_field(item, fields.theme_field)):
+        stats["theme_posts"][user][theme] += 1
+        counter = stats["theme_keywords"][(user, theme)]
+        if isinstance(keywords, dict):
+            counter.update({k: v for k, v in keywords.items() if isinstance(v, (int, float))})
+        else:
+            counter.update(k for k in as_list(keywords) if isinstance(k, str))
+
+
+# ----------------- 流式解析 -----------------
+class ObjectStream:
+    """从字节偏移 start 开始逐个解码顶层数组中的对象，同时记录当前位置的字节偏移"""
+
+    def __init__(self, path: Path, start: int):
+        self.f = open(path, "rb")
+        self.f.seek(start)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf, self.pos, self.offset, self.eof = "", 0, start, False   # offset = buf[pos] 的字节偏移
+        if start:                                # 切点可能落在多字节字符中间，跳过续字节
+            while True:
+                b = self.f.read(1)
+                if not b or not 0x80 <= b[0] <= 0xBF:
+                    break
+                self.offset += 1
+            self.f.seek(self.offset)
+
+    def fill(self) -> bool:
+        """再读一块；顺便丢掉已消费的前缀，保证缓冲区大小有界"""
+        if self.eof:
+            return False
+        chunk = self.f.read(CHUNK_BYTES)
+        self.eof = not chunk
+        self.buf = self.buf[self.pos:] + self.decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return bool(chunk)
+
+    def consume(self, n: int):
+        self.offset += len(self.buf[self.pos:self.pos + n].encode("utf-8"))
+        self.pos += n
+
+    def skip(self, chars: str) -> str | None:
+        """跳过空白与给定分隔符，返回下一个有效字符（文件结束返回 None）"""
+        while True:
+            i = self.pos
+            while i < len(self.buf) and (self.buf[i] in _WS or self.buf[i] in chars):
+                i += 1
+            self.consume(i - self.pos)
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def decode_at(self, rel: int, limit: int = MAX_OBJECT_CHARS):
+        """
+        在 pos + rel 处解码一个 JSON 值，返回 (对象, 相对 pos 的结束位置)。
+        解析失败时继续读取，已缓冲 limit 个字符仍失败则视为格式错误。
+        """
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos + rel)
+                return obj, end - self.pos
+            except json.JSONDecodeError:
+                if len(self.buf) - self.pos - rel >= limit or not self.fill():
+                    raise
+
+    def resync(self, user_field: str) -> bool:
+        """定位到切点之后第一个顶层对象的起始处"""
+        rel = 0
+        while True:
+            idx = self.buf.find("{", self.pos + rel)
+            if idx < 0:
+                rel = len(self.buf) - self.pos
+                if not self.fill():
+                    return False
+                continue
+            rel = idx - self.pos
+            try:
+                obj, end = self.decode_at(rel, RESYNC_CHARS)
+            except json.JSONDecodeError:
+                rel += 1
+                continue
+            if isinstance(obj, dict) and get_field(obj, user_field) is not None and self._looks_top_level(end, user_field):
+                self.consume(rel)
+                return True
+            rel += 1
+
+    def _looks_top_level(self, end: int, user_field: str, lookahead: int = RESYNC_LOOKAHEAD) -> bool:
+        """
+        候选对象之后应是顶层数组的延续：接连几个同类对象，或 ']' 后直到文件结束。
+        嵌套在记录内部的列表（如评论）很快会遇到 ']' 后还有内容，从而被排除。
+        """
+        for _ in range(lookahead):
+            while True:
+                tail = self.buf[self.pos + end:].lstrip(_WS)
+                if tail or not self.fill():
+                    break
+            if not tail:
+                return True
+            if tail[0] == "]":
+                rest = self.buf[self.pos + end:].lstrip(_WS)[1:]
+                while not rest.strip(_WS) and self.fill():
+                    rest = self.buf[self.pos + end:].lstrip(_WS)[1:]
+                return not rest.strip(_WS)
+            if tail[0] != ",":
+                return False
+            nxt = self.buf.find("{", self.pos + end)
+            if nxt < 0 or self.buf[self.pos + end:nxt].strip(_WS + ","):
+                return False
+            try:
+                obj, end = self.decode_at(nxt - self.pos, RESYNC_CHARS)
+            except json.JSONDecodeError:
+                return False
+            if not isinstance(obj, dict) or get_field(obj, user_field) is None:
+                return False
+        return True
+
+    def close(self):
+        self.f.close()
+
+
+def iter_array(path: Path):
+    """逐个产出顶层 JSON 数组中的元素，内存占用与单条记录同阶，不随文件大小增长"""
+    stream = ObjectStream(Path(path), 0)
+    try:
+        if stream.skip("") != "[":
+            raise ValueError(f"{path} 不是 JSON 数组")
+        stream.consume(1)
+        while True:
+            c = stream.skip(",")
+            if c is None or c == "]":
+                return
+            obj, n = stream.decode_at(0)
+            stream.consume(n)
+            yield obj
+    finally:
+        stream.close()
+
+
+def profile_range(path: str, start: int, end: int, exact: bool, fields: argparse.Namespace):
+    """
+    解析起始偏移落在 [start, end) 内的对象。
+    :param exact: start 是否已知为对象起点（或文件开头）；否则先重新同步
+    :return: (统计, 第一个对象的偏移, 本段之后第一个对象的偏移)
+    """
+    stats = new_stats()
+    stream = ObjectStream(Path(path), start)
+    try:
+        if start == 0:
+            if stream.skip("") != "[":
+                raise ValueError("输入文件不是 JSON 数组")
+            stream.consume(1)
+        elif not exact and not stream.resync(fields.user_field):
+            return stats, end, end
+        first, size = None, os.path.getsize(path)
+        while True:
+            c = stream.skip(",")
+            if c is None or c == "]":
+                return stats, first if first is not None else end, size
+            if stream.offset >= end:
+                return stats, first if first is not None else stream.offset, stream.offset
+            if first is None:
+                first = stream.offset
+            obj, n = stream.decode_at(0)
+            stream.consume(n)
+            add_post(stats, obj, fields)
+    finally:
+        stream.close()
+
+
+def profile(path: Path, workers: int, fields: argparse.Namespace) -> dict:
+    size = path.stat().st_size
+    n = max(1, min(workers, size // MIN_SPLIT))
+    bounds = [size * i // n for i in range(n)] + [size]
+    if n == 1:
+        return profile_range(str(path), 0, size, True, fields)[0]
+
+    with ProcessPoolExecutor(max_workers=n) as pool:
+        parts = list(pool.map(profile_range, [str(path)] * n, bounds[:-1], bounds[1:], [False] * n, [fields] * n))
+
+    # 校验衔接：第 i 段给出的下一个对象起点必须等于第 i+1 段的第一个对象起点
+    total, next_start = new_stats(), None
+    for i, (stats, first, nxt) in enumerate(parts):
+        if i and first != next_start:
+            print(f"⚠️  第 {i} 段重新同步位置 {first} 与前一段衔接位置 {next_start} 不一致，串行重跑该段")
+            if next_start < bounds[i + 1]:
+                stats, _, nxt = profile_range(str(path), next_start, bounds[i + 1], True, fields)
+            else:
+                stats, nxt = new_stats(), next_start
+        merge_stats(total, stats)
+        next_start = nxt
+    return total
+
+
+# ----------------- 输出 -----------------
+def quantile_from_hist(hist: Counter, q: float) -> int:
+    total, acc = sum(hist.values()), 0
+    for lo in sorted(hist):
+        acc += hist[lo]
+        if acc >= q * total:
+            return lo
+    return 0
+
+
+def print_report(stats: dict):
+    print(f"不重复用户数: {len(stats['user_posts'])}")
+    print(f"朋友圈条目总数: {stats['posts']}")
+    print(f"图片总数: {stats['images']}")
+    print("\n条目字数分布:")
+    for i, lo in enumerate(LENGTH_BINS):
+        hi = f"{LENGTH_BINS[i + 1] - 1}" if i + 1 < len(LENGTH_BINS) else "+"
+        n = stats["length_hist"].get(lo, 0)
+        print(f"  {lo:>5d}-{hi:<5s} {n:>9d}  {n / max(stats['posts'], 1) * 100:5.1f}%")
+    print("  中位数所在区间下界: {}，P90 所在区间下界: {}".format(
+        quantile_from_hist(stats["length_hist"], 0.5), quantile_from_hist(stats["length_hist"], 0.9)))
+
+
+def write_users_csv(stats: dict, out: Path):
+    with open(out, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["user", "posts", "images", "avg_chars"])
+        for user, posts in stats["user_posts"].most_common():
+            writer.writerow([user, posts, stats["user_images"][user], round(stats["user_chars"][user] / posts, 1)])
+
+
+def to_raw_format(stats: dict, top_k: int = TOP_K) -> list[dict]:
+    """转换成 人格特质50位受试者原始数据.json 的结构"""
+    raw = []
+    for user, themes in stats["theme_posts"].items():
+        data = [{"theme": theme, "frequency": float(cnt),
+                 "keywords": dict(stats["theme_keywords"][(user, theme)].most_common(top_k)) or None}
+                for theme, cnt in themes.most_common()]
+        raw.append({"name": user, "data": data})
+    return raw
+
+
+# ----------------- 主入口 -----------------
+def main():
+    parser = argparse.ArgumentParser(description="朋友圈原始数据流式画像")
+    parser.add_argument("--input", type=Path, default=Path(INPUT_FILE), help="朋友圈导出 JSON（顶层数组）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="并行进程数（文件足够大时才切分）")
+    parser.add_argument("--user-field", default="user", help="用户字段（支持 a.b 嵌套）")
+    parser.add_argument("--text-field", default="text", help="正文字段")
+    parser.add_argument("--images-field", default="images", help="图片列表字段")
+    parser.add_argument("--theme-field", default="theme", help="主题字段（字符串或列表）")
+    parser.add_argument("--keywords-field", default="keywords", help="关键词字段（列表或 {词: 频次}）")
+    parser.add_argument("--users-csv", type=Path, default=None, help="每用户统计 CSV 输出路径")
+    parser.add_argument("--emit-raw", type=Path, default=None, help="按原始数据格式导出主题 / 关键词频次")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="导出时每个主题保留的关键词数")
+    args = parser.parse_args()
 
-# 1. 读入数据 ---------------------------------------------------------
-with open("人格特质图像识别+分类.json", "r", encoding="utf-8") as f:
-    moments = json.load(f)          # moments 是一个列表，每个元素是一条朋友圈记录
+    stats = profile(args.input, args.workers, args)
+    print_report(stats)
+    if args.users_csv:
+        write_users_csv(stats, args.users_csv)
+        print(f"每用户统计 → {args.users_csv}")
+    if args.emit_raw:
+        args.emit_raw.write_text(json.dumps(to_raw_format(stats, args.top_k), ensure_ascii=False, indent=2), "utf-8")
+        print(f"主题 / 关键词频次 → {args.emit_raw}")
 
-# 2. 计算指标 ---------------------------------------------------------
-users      = {item["user"] for item in moments}          # 不重复用户集合
-num_users  = len(users)                                  # 用户数
-num_posts  = len(moments)                                # 朋友圈条目数
-num_images = sum(len(item.get("images", [])) for item in moments)   # 图片总数
 
-# 3. 打印结果 ---------------------------------------------------------
-print(f"不重复用户数: {num_users}")
-print(f"朋友圈条目总数: {num_posts}")
-print(f"图片总数: {num_images}")
+if __name__ == "__main__":
+    main()
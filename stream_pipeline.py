@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+stream_pipeline.py
+------------------------------------------
+按用户流式执行 记忆生成 → 故事合成 → CBF-PI-B 作答：某个用户的上一阶段一完成就进入下一阶段，
+不必等全部用户的记忆 / 故事都生成完，第一份问卷结果几分钟内就能落盘，阶段交界处也不会空转。
+
+    payload ─▶ [memory × M 线程] ─▶ 有界队列 ─▶ [story × S 线程] ─▶ 有界队列 ─▶ [问卷 FairScheduler]
+                     │                                                        ▲
+                     └──────────────── --data-type memory 时直接送问卷 ────────┘
+
+各阶段之间是容量为 --queue-size 的有界队列：下游忙不过来时上游自动放慢，内存中积压的用户数有上限；
+问卷阶段沿用 cbfpib_completion.py 的作答 / 重试 / 降级逻辑，同时在跑的用户数同样受 --queue-size 限制。
+
+产物与分步执行时一致，均支持断点续跑（已完成的用户直接复用）：
+    bigfive_memories.json / bigfive_stories.json / results/bigfive_result_*.json
+
+    python stream_pipeline.py --model qwen-turbo --data-type story --repeat 5 --cot
+    python stream_pipeline.py --model qwen-turbo --data-type memory --repeat 5 --no-story
+"""
+
+import argparse
+import copy
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from loguru import logger
+
+import cbfpib_completion as cb
+import generate_memory as gm
+import generate_story as gs
+import tracing
+from users_file import read_users_file
+from scheduler import FairScheduler
+from tracing import span
+
+# ===== 配置区 =====
+PAYLOAD_FILE    = Path("bigfive_prompt_payload.json")
+MEMORY_FILE     = Path("bigfive_memories.json")
+STORY_FILE      = Path("bigfive_stories.json")
+MEMORY_WORKERS  = 4                    # 记忆阶段并发用户数（每个用户内部按关键词串行）
+STORY_WORKERS   = 4                    # 故事阶段并发用户数
+QUEUE_SIZE      = 8                    # 阶段间队列容量 / 问卷阶段同时在跑的用户数
+STAGE_RETRY     = 3                    # 记忆 / 故事单次生成的重试次数
+
+_DONE = object()                       # 队列结束标记
+
+# ----------------- 工具函数 -----------------
+
+
+class JsonSink:
+    """按用户名去重的增量 JSON 列表；线程安全，每加一条整体重写（与各脚本的落盘方式一致）"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.records = json.loads(path.read_text(encoding="utf-8")) if path.exists() else []
+        self.index = {r["user"]: r for r in self.records}
+        self.lock = threading.Lock()
+
+    def get(self, user: str) -> dict | None:
+        with self.lock:
+            return self.index.get(user)
+
+    def add(self, record: dict):
+        with self.lock, span("save_result", file=str(self.path)):
+            self.records.append(record)
+            self.index[record["user"]] = record
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.records, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, self.path)
+
+
+class StageStats:
+    """各阶段完成 / 复用 / 失败计数，以及首个与最近一个产出的时间"""
+
+    def __init__(self, *names: str):
+        self.t0 = time.perf_counter()
+        self.lock = threading.Lock()
+        self.rows = {n: {"done": 0, "reused": 0, "failed": 0, "first_s": None, "last_s": None} for n in names}
+
+    def mark(self, stage: str, what: str):
+        with self.lock:
+            row = self.rows[stage]
+            row[what] += 1
+            if what == "done":
+                now = round(time.perf_counter() - self.t0, 1)
+                row["first_s"] = row["first_s"] if row["first_s"] is not None else now
+                row["last_s"] = now
+
+    def log(self):
+        for name, r in self.rows.items():
+            logger.info(f"[{name}] 完成 {r['done']}，复用 {r['reused']}，失败 {r['failed']}，"
+                        f"首个产出 {r['first_s']}s，最后产出 {r['last_s']}s")
+
+
+def with_retry(fn, what: str):
+    for attempt in range(1, STAGE_RETRY + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == STAGE_RETRY:
+                raise
+            logger.warning(f"{what} 失败({attempt}/{STAGE_RETRY})：{e}")
+
+
+def start_stage(name: str, n_workers: int, in_q: queue.Queue, handle, outs: list[queue.Queue],
+                stats: StageStats) -> list[threading.Thread]:
+    """
+    n_workers 个线程从 in_q 取用户，handle(entry) 返回交给下游的记录并放入 outs 中每个队列；
+    失败的用户记日志后丢弃。上游结束且本阶段线程全部退出后，向下游传递结束标记。
+    """
+    left, lock = [n_workers], threading.Lock()
+
+    def loop():
+        while True:
+            entry = in_q.get()
+            if entry is _DONE:
+                in_q.put(_DONE)                  # 留给同阶段的其他线程
+                break
+            try:
+                with span(name, user=entry["user"]):
+                    record = handle(entry)
+            except Exception as e:
+                logger.error(f"[{name}] 用户 {entry['user']} 失败：{e}")
+                stats.mark(name, "failed")
+                continue
+            for q in outs:
+                q.put(record)                    # 下游满时在此阻塞，形成背压
+        with lock:
+            left[0] -= 1
+            if left[0] == 0:
+                for q in outs:
+                    q.put(_DONE)
+
+    threads = [threading.Thread(target=loop, name=f"{name}-{i}", daemon=True) for i in range(n_workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+# ----------------- 各阶段 -----------------
+def make_memory_stage(sink: JsonSink, stats: StageStats):
+    def handle(entry: dict) -> dict:
+        done = sink.get(entry["user"])
+        if done is not None:
+            stats.mark("memory", "reused")
+            return done
+        keywords = copy.deepcopy(sorted(entry["keywords"], key=lambda x: x["weight"], reverse=True)[:gm.K])
+        for i, kw in enumerate(keywords):
+            payload = gm.generate_payload(kw["context"], kw["token"], len(keywords) - i)   # 与 generate_memory.py 相同的句数递减
+            try:
+                with span("call_llm", user=entry["user"], token=kw["token"]):
+                    kw["memories"] = with_retry(lambda: gm.call_deepseek(payload), f"用户 {entry['user']} 关键词 {kw['token']}")
+            except Exception as e:                   # 与 generate_memory.py 相同：单个关键词失败只留空，不丢整个用户
+                logger.error(f"用户 {entry['user']} 关键词 {kw['token']} 生成失败，跳过：{e}")
+                kw["memories"] = []
+        record = {"user": entry["user"], "uid": entry["uid"], "keywords": keywords}
+        sink.add(record)
+        stats.mark("memory", "done")
+        return record
+    return handle
+
+
+def make_story_stage(sink: JsonSink, stats: StageStats):
+    def handle(entry: dict) -> dict:
+        done = sink.get(entry["user"])
+        if done is not None:
+            stats.mark("story", "reused")
+            return done
+        messages = gs.build_messages(gs.sort_memories(entry["keywords"]))
+        with span("call_llm", user=entry["user"]):
+            story = with_retry(lambda: gs.call_llm(messages), f"用户 {entry['user']} 故事")
+        record = {"uid": entry["uid"], "user": entry["user"], "story": story}
+        sink.add(record)
+        stats.mark("story", "done")
+        return record
+    return handle
+
+
+def feed_survey(in_q: queue.Queue, sched: FairScheduler, slots: threading.Semaphore, results: JsonSink,
+                questions: list[dict], args, entries: dict, sizes: dict, stats: StageStats):
+    """把到达的用户转成作答任务交给调度器；同时在跑的用户数受 slots 限制"""
+    while True:
+        entry = in_q.get()
+        if entry is _DONE:
+            break
+        if results.get(entry["user"]) is not None:
+            stats.mark("survey", "reused")
+            continue
+        slots.acquire()
+        try:
+            if args.token_budget:
+                from persona_compact import compact_personas
+                entry = compact_personas([entry], args.data_type, args.token_budget)[0][0]
+            if cb.retrieval_k:
+                with span("retrieval_index"):
+                    cb.build_retrieval_index([entry], questions)
+            with span("build_prompts", user=entry["user"]):
+                tasks, sizes[entry["user"]] = cb.build_user_tasks(entry, questions, args.seed)
+        except Exception as e:
+            logger.error(f"[survey] 用户 {entry['user']} 构造 prompt 失败：{e}")
+            stats.mark("survey", "failed")
+            slots.release()
+            continue
+        entries[entry["user"]] = entry
+        sched.add_job(entry["user"], tasks)
+    sched.close()
+
+
+# ----------------- 主流程 -----------------
+def run(args):
+    outfile = cb.setup_run(args)
+    with span("load_json", file=str(PAYLOAD_FILE)):
+        payload = json.loads(PAYLOAD_FILE.read_text(encoding="utf-8"))
+    if args.users_file:
+        wanted = set(read_users_file(args.users_file))
+        payload = [entry for entry in payload if entry["user"] in wanted]
+    questions = json.loads(Path(cb.CBFPIB).read_text(encoding="utf-8"))
+    memories, stories, results = JsonSink(MEMORY_FILE), JsonSink(STORY_FILE), JsonSink(outfile)
+    stats = StageStats("memory", "story", "survey")
+
+    use_story = not (args.no_story and args.data_type == "memory")
+    memory_q, story_q, survey_q = (queue.Queue(maxsize=args.queue_size) for _ in range(3))
+    memory_outs = ([story_q] if use_story else []) + ([survey_q] if args.data_type == "memory" else [])
+    threads = start_stage("memory", args.memory_workers, memory_q, make_memory_stage(memories, stats), memory_outs, stats)
+    if use_story:
+        story_outs = [survey_q] if args.data_type == "story" else []
+        threads += start_stage("story", args.story_workers, story_q, make_story_stage(stories, stats), story_outs, stats)
+
+    sched = FairScheduler(n_workers=cb.MAX_WORKERS, max_attempts=cb.MAX_RETRY, demote_after=cb.DEMOTE_AFTER,
+                          backoff=cb.retry_backoff, streaming=True)
+    slots = threading.Semaphore(args.queue_size)
+    entries, sizes = {}, {}
+    if results.get("baseline") is None:          # 无画像的对照用户，与 load_personas 一致
+        baseline = {"user": "baseline", "uid": -1, "story": ""}
+        slots.acquire()                          # 先于 feeder 占位，主线程不会阻塞
+        entries["baseline"] = baseline
+        sched.add_job("baseline", cb.build_user_tasks(baseline, questions, args.seed)[0])
+    feeder = threading.Thread(target=feed_survey, name="survey-feed", daemon=True,
+                              args=(survey_q, sched, slots, results, questions, args, entries, sizes, stats))
+    feeder.start()
+
+    def produce():
+        for entry in payload:
+            memory_q.put(entry)
+        memory_q.put(_DONE)
+    threading.Thread(target=produce, name="payload", daemon=True).start()
+
+    logger.info(f"流式运行：{len(payload)} 个用户 → {outfile}")
+    for user, answers, exc in sched.run(cb.ask_item):
+        slots.release()
+        if exc is not None:
+            logger.error(f"[survey] 用户 {user} 处理异常: {exc}")
+            stats.mark("survey", "failed")
+            continue
+        results.add(cb.assemble_result(entries.pop(user), questions, answers, sizes.pop(user, None)))
+        stats.mark("survey", "done")
+        logger.success(f"[survey] 用户 {user} 问卷完成（已完成 {len(results.records)} 人）")
+
+    feeder.join()
+    for t in threads:
+        t.join()
+    stats.log()
+    logger.info(f"调度统计：成功调用 {sched.stats['tasks']} 次，失败 {sched.stats['failures']} 次，降级 {sched.stats['demoted']} 题")
+    cb.HEDGER.log_summary()
+    if use_story:
+        gs.HEDGER.log_summary()
+    cb.save_latency_profile(args, sched.stats)
+    logger.success(f"全部完成 → {MEMORY_FILE}, {STORY_FILE if use_story else ''} {outfile}")
+
+
+# ----------------- 主入口 -----------------
+def main():
+    parser = cb.add_run_args(argparse.ArgumentParser(description="按用户流式执行 记忆 → 故事 → 问卷"))
+    parser.add_argument("--memory-workers", type=int, default=MEMORY_WORKERS, help="记忆阶段并发用户数")
+    parser.add_argument("--story-workers", type=int, default=STORY_WORKERS, help="故事阶段并发用户数")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="阶段间队列容量")
+    parser.add_argument("--no-story", action="store_true", help="--data-type memory 时不生成故事")
+    parser.add_argument("--trace", type=str, default=None, help="开启阶段追踪，退出时把 Chrome trace 写到该路径")
+    args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+subject_registry.py
+------------------------------------------
+受试者注册表（SQLite）：xlsx 只在导入时读一次，之后所有脚本按规范化姓名批量查 uid，
+不再每次 pd.read_excel。uid 一律存为整数，"7" / 7 / 7.0 视为同一个受试者。
+
+    import     从 xlsx 导入（默认 IMPORTS 中的两个工作簿；文件内容未变则跳过，--force 重导；
+               重导时先删除该工作簿上次写入的记录，再按新内容写入）
+               带编号列的表写入 姓名 → uid；只有姓名列的表（名册）只做核对，列出对不上的姓名
+    alias      为对不上的写法补一个别名：python subject_registry.py alias "Lily " 12
+    lookup     查询若干姓名的 uid
+    annotate   一次性给多个 JSON 产物补 / 校正 uid 字段（默认覆盖 ANNOTATE_GLOBS 匹配的全部文件）
+    status     注册表概况
+
+    python subject_registry.py import
+    python subject_registry.py annotate                      # payload、记忆、故事、各结果文件
+    python subject_registry.py annotate results/*.json --drop-unmatched
+    python matching.py --registry subjects.sqlite --json bigfive_prompt_payload.json
+
+姓名规范化：NFKC（全角转半角）→ 去首尾空白 → 内部连续空白并为一个 → casefold。
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from pathlib import Path
+
+from loguru import logger
+
+# ===== 配置区 =====
+DB_PATH = Path("subjects.sqlite")
+# (工作簿, 姓名列, 编号列)；编号列为 None 的是只有姓名的名册
+IMPORTS = [
+    ("人格朋友圈尝试代入分析.xlsx", "用户昵称", "编号"),
+    ("人格特质48位受试者原始数据.xlsx", "名称", None),
+]
+ANNOTATE_GLOBS = [
+    "bigfive_prompt_payload.json", "bigfive_memories.json", "bigfive_stories.json",
+    "bigfive_story.json", "stories.json", "bigfive_deepseek_scores*.json", "results/bigfive_result_*.json",
+]
+BASELINE_USERS = {"baseline"}          # 问卷里无画像的对照用户，uid 固定为 -1，不参与匹配
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subjects (
+    uid     INTEGER PRIMARY KEY,
+    name    TEXT NOT NULL,
+    source  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS names (
+    norm    TEXT PRIMARY KEY,                        -- 规范化姓名
+    uid     INTEGER NOT NULL REFERENCES subjects(uid),
+    raw     TEXT NOT NULL,
+    source  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS names_uid ON names(uid);
+CREATE TABLE IF NOT EXISTS imports (
+    path         TEXT PRIMARY KEY,
+    sha1         TEXT NOT NULL,
+    rows         INTEGER NOT NULL,
+    unmatched    TEXT NOT NULL,                      -- 名册中对不上的姓名（JSON 列表）
+    imported_at  REAL NOT NULL
+);
+"""
+
+# ----------------- 工具函数 -----------------
+
+
+def normalize_name(name) -> str:
+    return unicodedata.normalize("NFKC", " ".join(str(name).split())).casefold()
+
+
+def normalize_uid(value) -> int | None:
+    """把 uid 统一成 int；空值返回 None，非整数抛 ValueError"""
+    if value is None or (isinstance(value, float) and value != value):     # None / NaN
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"非法 uid: {value!r}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"非法 uid: {value!r}")
+        return int(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    if not re.fullmatch(r"[+-]?\d+(\.0*)?", text):
+        raise ValueError(f"非法 uid: {value!r}")
+    return int(float(text)) if "." in text else int(text)
+
+
+def file_sha1(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def record_name(entry: dict) -> str:
+    return str(entry.get("name", entry.get("user", ""))).strip()
+
+
+# ----------------- 核心函数 -----------------
+class SubjectRegistry:
+    """姓名 → uid 的持久化索引"""
+
+    def __init__(self, db_path: Path = DB_PATH):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # ---------- 导入 ----------
+    def import_excel(self, path: Path, name_col: str, uid_col: str | None, sheet=0, force: bool = False) -> dict:
+        """
+        导入一个工作簿；内容哈希与上次导入相同则跳过。
+        :return: {"rows", "added", "unmatched", "skipped"}
+        """
+        path = Path(path)
+        sha1 = file_sha1(path)
+        row = self.conn.execute("SELECT sha1, rows, unmatched FROM imports WHERE path = ?", (str(path),)).fetchone()
+        if row and row[0] == sha1 and not force:
+            return {"rows": row[1], "added": 0, "unmatched": json.loads(row[2]), "skipped": True}
+
+        import pandas as pd                              # 只有导入时才需要 pandas / openpyxl
+        df = pd.read_excel(path, sheet_name=sheet, dtype=str)
+        cols = [name_col] + ([uid_col] if uid_col else [])
+        missing = [c for c in cols if c not in df.columns]
+        if missing:
+            raise ValueError(f"{path} 缺少列：{missing}，请通过 --name-col / --uid-col 指定")
+        df = df.dropna(subset=[name_col])
+
+        added, unmatched = 0, []
+        with self.conn:
+            if uid_col:
+                # 工作簿内容变了：先清掉该来源上次写入的姓名 / 受试者，改名、删行、换编号都以新内容为准
+                self.conn.execute("DELETE FROM names WHERE source = ?", (path.name,))
+                self.conn.execute("DELETE FROM subjects WHERE source = ?", (path.name,))
+                for name, uid in zip(df[name_col], df[uid_col]):
+                    uid = normalize_uid(uid)
+                    if uid is None:
+                        logger.warning(f"{path}：{name} 没有编号，跳过")
+                        continue
+                    added += self._add_name(name, uid, path.name, create=True)
+                dangling = [r for r, in self.conn.execute(
+                    "SELECT raw FROM names WHERE uid NOT IN (SELECT uid FROM subjects)")]
+                if dangling:
+                    logger.warning(f"{path} 重导后这些别名指向的 uid 已不存在，请重新 alias：{dangling}")
+            else:
+                known = self.lookup_many(df[name_col].unique().tolist())
+                unmatched = sorted({str(n).strip() for n in df[name_col]} - set(known))
+            self.conn.execute("INSERT OR REPLACE INTO imports VALUES (?, ?, ?, ?, ?)",
+                              (str(path), sha1, len(df), json.dumps(unmatched, ensure_ascii=False), time.time()))
+        return {"rows": len(df), "added": added, "unmatched": unmatched, "skipped": False}
+
+    def _add_name(self, name: str, uid: int, source: str, create: bool = False) -> int:
+        norm, raw = normalize_name(name), str(name).strip()
+        if create:
+            self.conn.execute("INSERT OR IGNORE INTO subjects VALUES (?, ?, ?)", (uid, raw, source))
+        elif self.conn.execute("SELECT 1 FROM subjects WHERE uid = ?", (uid,)).fetchone() is None:
+            raise ValueError(f"注册表中没有 uid {uid}")
+        old = self.conn.execute("SELECT uid FROM names WHERE norm = ?", (norm,)).fetchone()
+        if old and old[0] != uid:
+            logger.warning(f"姓名 {raw!r} 已对应 uid {old[0]}，保留原编号，忽略 {uid}（{source}）")
+            return 0
+        self.conn.execute("INSERT OR IGNORE INTO names VALUES (?, ?, ?, ?)", (norm, uid, raw, source))
+        return 0 if old else 1
+
+    def add_alias(self, name: str, uid) -> bool:
+        with self.conn:
+            return bool(self._add_name(name, normalize_uid(uid), "alias"))
+
+    # ---------- 查询 ----------
+    def lookup_many(self, names: list[str]) -> dict[str, int]:
+        """批量查询：临时表与 names 做一次 JOIN，返回 {原始姓名: uid}，查不到的不出现在结果里"""
+        names = [str(n) for n in names]
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (raw TEXT, norm TEXT)")
+        self.conn.execute("DELETE FROM wanted")
+        self.conn.executemany("INSERT INTO wanted VALUES (?, ?)", [(n, normalize_name(n)) for n in names])
+        rows = self.conn.execute("SELECT w.raw, n.uid FROM wanted w JOIN names n ON n.norm = w.norm").fetchall()
+        self.conn.execute("DELETE FROM wanted")
+        self.conn.commit()
+        return dict(rows)
+
+    def uid_of(self, name: str) -> int | None:
+        return self.lookup_many([name]).get(str(name))
+
+    def uid_map(self) -> dict[str, int]:
+        """{规范化姓名: uid} 全表"""
+        return dict(self.conn.execute("SELECT norm, uid FROM names"))
+
+    def status(self) -> dict:
+        subjects = self.conn.execute("SELECT COUNT(*) FROM subjects").fetchone()[0]
+        names = self.conn.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+        imports = self.conn.execute("SELECT path, rows, unmatched, imported_at FROM imports").fetchall()
+        return {"subjects": subjects, "names": names,
+                "imports": [{"path": p, "rows": r, "unmatched": json.loads(u),
+                             "imported_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))}
+                            for p, r, u, t in imports]}
+
+
+def annotate_records(records: list[dict], uid_map: dict[str, int], drop_unmatched: bool = False) -> tuple[list[dict], dict]:
+    """
+    按注册表给每条记录写入整数 uid；已有 uid 与注册表冲突时以注册表为准并计数。
+    :param uid_map: SubjectRegistry.uid_map() 的结果（规范化姓名 → uid）
+    """
+    out, stats = [], {"matched": 0, "changed": 0, "conflict": 0, "unmatched": []}
+    for entry in records:
+        name = record_name(entry)
+        if name in BASELINE_USERS:
+            out.append(entry)
+            continue
+        uid = uid_map.get(normalize_name(name))
+        if uid is None:
+            stats["unmatched"].append(name)
+            if not drop_unmatched:
+                out.append(entry)
+            continue
+        stats["matched"] += 1
+        if "uid" in entry:
+            try:
+                old = normalize_uid(entry["uid"])
+            except ValueError:
+                old = None
+            if old is not None and old != uid:
+                stats["conflict"] += 1
+                logger.warning(f"{name}: uid {entry['uid']!r} 与注册表 {uid} 不一致，改为 {uid}")
+        if entry.get("uid") != uid or type(entry.get("uid")) is not int:
+            entry["uid"] = uid
+            stats["changed"] += 1
+        out.append(entry)
+    return out, stats
+
+
+def annotate_files(paths: list[Path], registry: SubjectRegistry, drop_unmatched: bool = False,
+                   dry_run: bool = False) -> dict[str, dict]:
+    """一次读取注册表，逐个更新 JSON 产物（内容有变化才原子覆盖写）"""
+    uid_map = registry.uid_map()
+    report = {}
+    for path in paths:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if not isinstance(data, list):
+            logger.warning(f"{path} 不是记录列表，跳过")
+            continue
+        n_before = len(data)
+        data, stats = annotate_records(data, uid_map, drop_unmatched)
+        stats["dropped"] = n_before - len(data)
+        report[str(path)] = stats
+        if (stats["changed"] or stats["dropped"]) and not dry_run:
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, path)
+    return report
+
+
+def expand_paths(patterns: list[str]) -> list[Path]:
+    seen = []
+    for pattern in patterns:
+        for p in sorted(glob.glob(pattern)) or ([pattern] if Path(pattern).exists() else []):
+            if Path(p) not in seen:
+                seen.append(Path(p))
+    return seen
+
+
+# ----------------- 主入口 -----------------
+def main():
+    parser = argparse.ArgumentParser(description="受试者注册表（姓名 → uid）")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help="注册表路径（默认 subjects.sqlite）")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("import", help="从 xlsx 导入")
+    p.add_argument("--excel", type=Path, default=None, help="只导入该工作簿（默认导入 IMPORTS 中的全部）")
+    p.add_argument("--name-col", default="用户昵称", help="姓名列名（配合 --excel）")
+    p.add_argument("--uid-col", default="编号", help="编号列名（配合 --excel；传空字符串表示名册）")
+    p.add_argument("--sheet", default=0, help="工作表名称或索引")
+    p.add_argument("--force", action="store_true", help="文件未变也重新导入")
+
+    p = sub.add_parser("alias", help="添加姓名别名")
+    p.add_argument("name")
+    p.add_argument("uid")
+
+    p = sub.add_parser("lookup", help="查询姓名对应的 uid")
+    p.add_argument("names", nargs="+")
+
+    p = sub.add_parser("annotate", help="批量给 JSON 产物写入 uid")
+    p.add_argument("files", nargs="*", help="文件或通配符（默认 ANNOTATE_GLOBS）")
+    p.add_argument("--drop-unmatched", action="store_true", help="删除注册表中查不到的记录（matching.py 的旧行为）")
+    p.add_argument("--dry-run", action="store_true", help="只报告不写文件")
+
+    sub.add_parser("status", help="注册表概况")
+    args = parser.parse_args()
+
+    registry = SubjectRegistry(args.db)
+    if args.cmd == "import":
+        jobs = [(args.excel, args.name_col, args.uid_col or None)] if args.excel else \
+               [(Path(x), n, u) for x, n, u in IMPORTS]
+        for path, name_col, uid_col in jobs:
+            sheet = int(args.sheet) if str(args.sheet).isdigit() else args.sheet
+            r = registry.import_excel(path, name_col, uid_col, sheet, args.force)
+            if r["skipped"]:
+                logger.info(f"{path} 未变化，跳过（上次 {r['rows']} 行）")
+            else:
+                logger.success(f"{path}：{r['rows']} 行，新增 {r['added']} 个姓名")
+            if r["unmatched"]:
+                logger.warning(f"{path} 中 {len(r['unmatched'])} 个姓名在注册表中找不到（可用 alias 补充）：{r['unmatched']}")
+    elif args.cmd == "alias":
+        added = registry.add_alias(args.name, args.uid)
+        logger.success(f"{args.name} → {normalize_uid(args.uid)}" if added else f"{args.name} 已存在，未修改")
+    elif args.cmd == "lookup":
+        found = registry.lookup_many(args.names)
+        for name in args.names:
+            print(f"{name}\t{found.get(name, '-')}")
+    elif args.cmd == "annotate":
+        paths = expand_paths(args.files or ANNOTATE_GLOBS)
+        for path, s in annotate_files(paths, registry, args.drop_unmatched, args.dry_run).items():
+            logger.info(f"{path}: 匹配 {s['matched']}，更新 {s['changed']}，冲突 {s['conflict']}，"
+                        f"删除 {s['dropped']}，未匹配 {len(s['unmatched'])}"
+                        + (f" {s['unmatched']}" if s["unmatched"] else ""))
+    else:
+        print(json.dumps(registry.status(), ensure_ascii=False, indent=2))
+    registry.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tracing.py
+------------------------------------------
+轻量级阶段追踪：记录带线程号的嵌套 span，导出 Chrome / Perfetto 可读的 trace JSON，
+并打印按阶段汇总的耗时表（总耗时 / 自身耗时 / 次数 / 均值 / 最大值）。
+
+开关（默认关闭，关闭时 span 只是一个空的上下文管理器）：
+    BIGFIVE_TRACE=trace.json python generate_story.py        # 任意脚本，通过环境变量
+    python cbfpib_completion.py --model qwen-turbo --trace trace.json
+
+用法：
+    from tracing import span
+    with span("network", user=user):
+        ...
+
+自身耗时只扣除同一线程内的子 span。交给线程池执行的工作（如 hedging.py 的 hedge 线程）
+记在池线程上，调用方需在等待处自己开一个 span（hedging.py 用 hedge_wait），否则等待时间会算进外层的自身耗时。
+
+进程退出时自动写出 trace（chrome://tracing 或 https://ui.perfetto.dev 打开）与汇总；
+也可以手动调用 export() / summary()。
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from pathlib import Path
+
+ENV_VAR = "BIGFIVE_TRACE"
+
+_events = []                    # (name, tid, start_ns, end_ns, args)
+_thread_names = {}
+_enabled = False
+_output = None
+_t0 = time.perf_counter_ns()
+_NULL = nullcontext()
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict):
+        self.name, self.args = name, args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        tid = threading.get_ident()
+        if tid not in _thread_names:
+            _thread_names[tid] = threading.current_thread().name
+        if exc_type is not None:
+            self.args = {**self.args, "error": exc_type.__name__}
+        _events.append((self.name, tid, self.start, time.perf_counter_ns(), self.args))   # list.append 自带 GIL 原子性
+        return False
+
+
+def span(name: str, **args):
+    """记录一个阶段；追踪关闭时几乎零开销"""
+    return _Span(name, args) if _enabled else _NULL
+
+
+def enable(output: str | Path | None = "trace.json"):
+    """开启追踪；output 不为 None 时进程退出时自动导出并打印汇总"""
+    global _enabled, _output
+    if output is not None and _output is None:
+        atexit.register(_at_exit)
+    _enabled, _output = True, output
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def export(path: str | Path) -> Path:
+    """写出 Chrome trace event 格式（complete 事件 + 线程名元数据）"""
+    pid = os.getpid()
+    events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": tname}}
+              for tid, tname in _thread_names.items()]
+    for name, tid, start, end, args in list(_events):
+        events.append({"name": name, "ph": "X", "pid": pid, "tid": tid,
+                       "ts": (start - _t0) / 1000, "dur": (end - start) / 1000, "args": args})
+    path = Path(path)
+    path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, ensure_ascii=False), "utf-8")
+    return path
+
+
+def summary() -> list[dict]:
+    """
+    按阶段汇总。自身耗时 = 总耗时 - 同线程内直接子 span 的耗时，
+    各阶段自身耗时之和即被追踪覆盖到的线程时间。
+    """
+    stats = defaultdict(lambda: {"count": 0, "total_s": 0.0, "self_s": 0.0, "max_s": 0.0})
+    by_tid = defaultdict(list)
+    for ev in list(_events):
+        by_tid[ev[1]].append(ev)
+    for evs in by_tid.values():
+        evs.sort(key=lambda e: (e[2], -e[3]))
+        stack = []                               # [(end_ns, name, child_ns)]
+        def pop():
+            end, name, child = stack.pop()
+            stats[name]["self_s"] -= child / 1e9
+        for name, _, start, end, _ in evs:
+            while stack and stack[-1][0] <= start:
+                pop()
+            dur = end - start
+            s = stats[name]
+            s["count"] += 1
+            s["total_s"] += dur / 1e9
+            s["self_s"] += dur / 1e9
+            s["max_s"] = max(s["max_s"], dur / 1e9)
+            if stack:
+                stack[-1] = (stack[-1][0], stack[-1][1], stack[-1][2] + dur)
+            stack.append((end, name, 0))
+        while stack:
+            pop()
+    rows = [{"phase": k, **v, "mean_s": v["total_s"] / v["count"]} for k, v in stats.items()]
+    return sorted(rows, key=lambda r: r["self_s"], reverse=True)
+
+
+def format_summary(rows: list[dict]) -> str:
+    total_self = sum(r["self_s"] for r in rows) or 1.0
+    lines = [f"{'phase':<24s} {'count':>8s} {'total_s':>10s} {'self_s':>10s} {'self%':>6s} {'mean_ms':>9s} {'max_ms':>9s}"]
+    for r in rows:
+        lines.append(f"{r['phase']:<24s} {r['count']:>8d} {r['total_s']:>10.3f} {r['self_s']:>10.3f} "
+                     f"{r['self_s'] / total_self * 100:>5.1f}% {r['mean_s'] * 1e3:>9.2f} {r['max_s'] * 1e3:>9.2f}")
+    return "\n".join(lines)
+
+
+def _at_exit():
+    if not _events or _output is None:
+        return
+    path = export(_output)
+    print(f"\n[trace] {len(_events)} 个 span → {path}\n{format_summary(summary())}", flush=True)
+
+
+if os.getenv(ENV_VAR):
+    enable(os.environ[ENV_VAR])
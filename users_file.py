@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+users_file.py
+------------------------------------------
+--users-file 的读取：每行一个用户名，忽略空行与 # 注释。
+单独成模块，作答脚本按名单筛选用户时不必加载 persona_index（numpy 等）。
+"""
+
+from pathlib import Path
+
+
+def read_users_file(path: str | Path) -> list[str]:
+    """每行一个用户名，忽略空行与 # 注释"""
+    return [line.strip() for line in Path(path).read_text(encoding="utf-8").splitlines()
+            if line.strip() and not line.lstrip().startswith("#")]